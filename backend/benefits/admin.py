@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Region, Benefit, CommercialOffer, UserBenefitInteraction
+from .models import Category, Region, Benefit, CommercialOffer, UserBenefitInteraction, CrawledPage
 
 
 @admin.register(Category)
@@ -62,3 +62,10 @@ class UserBenefitInteractionAdmin(admin.ModelAdmin):
     list_filter = ['interaction_type', 'created_at']
     search_fields = ['user__username', 'user__email']
     readonly_fields = ['created_at']
+
+
+@admin.register(CrawledPage)
+class CrawledPageAdmin(admin.ModelAdmin):
+    list_display = ['url', 'etag', 'last_modified', 'checked_at', 'changed_at']
+    search_fields = ['url']
+    readonly_fields = ['checked_at']
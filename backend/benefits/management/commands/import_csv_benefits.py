@@ -1,6 +1,8 @@
 import csv
 from django.core.management.base import BaseCommand
 from benefits.models import Benefit, Category
+from search.services import services
+from search.signals import bulk_indexing
 from django.utils import timezone
 from datetime import datetime
 
@@ -33,9 +35,11 @@ class Command(BaseCommand):
         # Read and import CSV
         imported_count = 0
         updated_count = 0
+        services.embedding_service.reset_cache_stats()
 
         try:
-            with open(csv_file, 'r', encoding='utf-8') as f:
+            # Embeddings for saved rows are requested in batches
+            with bulk_indexing(), open(csv_file, 'r', encoding='utf-8') as f:
                 reader = csv.DictReader(f)
 
                 for row in reader:
@@ -72,7 +76,7 @@ class Command(BaseCommand):
                             'title': row.get('header', 'Без названия'),
                             'description': row.get('text', 'Описание отсутствует'),
                             'benefit_type': benefit_type,
-                            'target_groups': list(set(target_groups)),  # Remove duplicates
+                            'target_groups': list(dict.fromkeys(target_groups)),  # Remove duplicates, keep order stable
                             'applies_to_all_regions': True,  # SFR benefits are typically federal
                             'valid_from': timezone.now().date(),
                             'status': 'active',
@@ -105,5 +109,7 @@ class Command(BaseCommand):
             f'\nImport completed successfully!\n'
             f'Imported: {imported_count} new benefits\n'
             f'Updated: {updated_count} existing benefits\n'
-            f'Total processed: {imported_count + updated_count}'
+            f'Total processed: {imported_count + updated_count}\n'
+            f'Embedding cache: {services.embedding_service.cache_hits} hits, '
+            f'{services.embedding_service.cache_misses} misses (API calls)'
         ))
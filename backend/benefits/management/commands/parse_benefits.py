@@ -1,15 +1,26 @@
+import hashlib
+import json
 import requests
 from bs4 import BeautifulSoup
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta
-from benefits.models import Benefit, Category, Region
+from benefits.models import Benefit, Category, Region, CrawledPage
+from search.services import services
+from search.signals import bulk_indexing
 import re
 
+# Responses that mean a source page is gone, together with the benefits parsed from it
+GONE_STATUSES = {404, 410}
+
 
 class Command(BaseCommand):
     help = 'Parse benefits from sfr.gov.ru websites'
 
+    # Re-runs are incremental: each page is requested with its stored ETag/Last-Modified
+    # (CrawledPage), and a page whose parsed benefits hash the same as last time is skipped.
+    # Only added, changed and removed benefits are written, so only they are re-indexed.
+
     URLS = [
         'https://sfr.gov.ru/grazhdanam/pensionres/',
         'https://sfr.gov.ru/grazhdanam/semyam_s_detmi/',
@@ -37,15 +48,24 @@ class Command(BaseCommand):
             default=None,
             help='Limit number of URLs to parse (for testing)',
         )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Refetch and re-save every page, ignoring the stored crawl state',
+        )
 
     def handle(self, *args, **options):
         self.dry_run = options.get('dry_run', False)
+        self.full = options.get('full', False)
+        self.changes = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged_pages': 0}
+        self.saved_ids = set()
         limit = options.get('limit')
 
         if self.dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No data will be saved'))
 
         self.stdout.write('Starting benefit parsing...')
+        services.embedding_service.reset_cache_stats()
 
         # Ensure regions exist
         if not self.dry_run:
@@ -54,12 +74,13 @@ class Command(BaseCommand):
 
         # Parse each URL
         urls_to_parse = self.URLS[:limit] if limit else self.URLS
-        for url in urls_to_parse:
-            try:
-                self.stdout.write(f'Parsing: {url}')
-                self.parse_url(url)
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error parsing {url}: {str(e)}'))
+        with bulk_indexing():
+            for url in urls_to_parse:
+                try:
+                    self.stdout.write(f'Parsing: {url}')
+                    self.parse_url(url)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error parsing {url}: {str(e)}'))
 
         # Create mock commercial offers
         if not self.dry_run:
@@ -69,6 +90,14 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS('Parsing test completed! (No data saved)'))
         else:
             self.stdout.write(self.style.SUCCESS('Parsing completed!'))
+            self.stdout.write(
+                f"Benefits: {self.changes['added']} added, {self.changes['changed']} changed, "
+                f"{self.changes['removed']} removed; {self.changes['unchanged_pages']} pages unchanged"
+            )
+            self.stdout.write(
+                f'Embedding cache: {services.embedding_service.cache_hits} hits, '
+                f'{services.embedding_service.cache_misses} misses (API calls)'
+            )
 
     def create_initial_regions(self):
         """Create initial Russian regions"""
@@ -106,12 +135,30 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('Categories created'))
 
     def parse_url(self, url):
-        """Parse a single URL and extract benefits"""
+        """Parse a single URL and save the benefits that were added, changed or removed since the last run"""
+        # The dry run doesn't touch the database, so it has no crawl state either
+        page = None if self.dry_run else CrawledPage.objects.filter(url=url).first()
         try:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
+            if page and not self.full:
+                if page.etag:
+                    headers['If-None-Match'] = page.etag
+                if page.last_modified:
+                    headers['If-Modified-Since'] = page.last_modified
             response = requests.get(url, headers=headers, timeout=30)
+
+            if response.status_code == 304:
+                self.stdout.write('  Not modified')
+                self.changes['unchanged_pages'] += 1
+                page.save(update_fields=['checked_at'])
+                return
+            if response.status_code in GONE_STATUSES and page:
+                self.stdout.write(self.style.WARNING(f'  Page is gone ({response.status_code})'))
+                self.remove_stale_benefits(url, keep=())
+                page.delete()
+                return
             response.raise_for_status()
 
             soup = BeautifulSoup(response.content, 'lxml')
@@ -120,11 +167,50 @@ class Command(BaseCommand):
             # This is a simplified parser - adjust selectors based on actual HTML structure
             benefits = self.extract_benefits_from_page(soup, url)
 
-            for benefit_data in benefits:
-                self.save_benefit(benefit_data)
-
         except requests.RequestException as e:
             self.stdout.write(self.style.WARNING(f'Request failed for {url}: {str(e)}'))
+            return
+
+        content_hash = self.benefits_hash(benefits)
+        if page and page.content_hash == content_hash and not self.full:
+            self.stdout.write('  Content unchanged')
+            self.changes['unchanged_pages'] += 1
+        else:
+            benefit_ids = []
+            for benefit_data in benefits:
+                benefit_id = self.benefit_id_for(benefit_data['title'])
+                # Sections with the same title map to one benefit; the first one parsed in this run wins
+                if benefit_id not in self.saved_ids:
+                    self.saved_ids.add(benefit_id)
+                    self.save_benefit(benefit_data)
+                benefit_ids.append(benefit_id)
+            if not self.dry_run:
+                self.remove_stale_benefits(url, keep=benefit_ids)
+
+        if not self.dry_run:
+            page = page or CrawledPage(url=url)
+            if page.content_hash != content_hash:
+                page.content_hash = content_hash
+                page.changed_at = timezone.now()
+            page.etag = response.headers.get('ETag', '')
+            page.last_modified = response.headers.get('Last-Modified', '')
+            page.save()
+
+    def benefits_hash(self, benefits):
+        """Hash of the parsed benefits with whitespace collapsed, so layout-only changes don't count"""
+        normalized = [
+            {key: ' '.join(value.split()) if isinstance(value, str) else value for key, value in benefit.items()}
+            for benefit in benefits
+        ]
+        return hashlib.sha256(json.dumps(normalized, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def remove_stale_benefits(self, source_url, keep):
+        """Delete benefits parsed from source_url earlier that the page no longer has"""
+        stale = Benefit.objects.filter(source_url=source_url, benefit_id__startswith='sfr-').exclude(benefit_id__in=keep)
+        for benefit in stale:
+            benefit.delete()  # post_delete removes it from the search index
+            self.changes['removed'] += 1
+            self.stdout.write(self.style.WARNING(f'Removed benefit: {benefit.benefit_id}'))
 
     def extract_benefits_from_page(self, soup, source_url):
         """Extract benefit information from parsed HTML"""
@@ -147,8 +233,8 @@ class Command(BaseCommand):
         accordions = soup.find_all(['div', 'section'], class_=re.compile(r'accordion|toggle|collapse'))
         content_sections.extend(accordions)
 
-        # Remove duplicates
-        content_sections = list(set(content_sections))
+        # Remove duplicates, keeping document order so the first-10 cut and the page hash are stable
+        content_sections = list(dict.fromkeys(content_sections))
 
         if not content_sections:
             # Fallback: create generic benefit from the page
@@ -219,21 +305,34 @@ class Command(BaseCommand):
             return text[:500] if text else 'Подробности на официальном сайте'
         return element.get_text(strip=True)[:500]
 
-    def save_benefit(self, benefit_data):
-        """Save or update a benefit in the database"""
-        # Generate unique benefit ID
-        title_slug = re.sub(r'[^\w\s-]', '', benefit_data['title']).strip().lower()
+    def benefit_id_for(self, title):
+        """Generate unique benefit ID"""
+        title_slug = re.sub(r'[^\w\s-]', '', title).strip().lower()
         title_slug = re.sub(r'[-\s]+', '-', title_slug)[:50]
-        benefit_id = f"sfr-{title_slug}"
+        return f"sfr-{title_slug}"
+
+    def save_benefit(self, benefit_data):
+        """Create the benefit, or update it if its text changed. Returns its benefit_id"""
+        benefit_id = self.benefit_id_for(benefit_data['title'])
 
         if self.dry_run:
             self.stdout.write(f'[DRY RUN] Would create: {benefit_id} - {benefit_data["title"][:60]}...')
-            return
-
-        # Check if benefit already exists
-        if Benefit.objects.filter(benefit_id=benefit_id).exists():
-            self.stdout.write(f'Benefit already exists: {benefit_id}')
-            return
+            return benefit_id
+
+        # Update an existing benefit only where the page changed it
+        existing = Benefit.objects.filter(benefit_id=benefit_id).first()
+        if existing is not None:
+            changed = [
+                field for field in ('title', 'description', 'target_groups', 'source_url')
+                if getattr(existing, field) != benefit_data[field]
+            ]
+            if changed:
+                for field in changed:
+                    setattr(existing, field, benefit_data[field])
+                existing.save(update_fields=changed)  # post_save re-indexes it if an indexed field changed
+                self.changes['changed'] += 1
+                self.stdout.write(self.style.SUCCESS(f'Updated benefit: {benefit_id}'))
+            return benefit_id
 
         # Create benefit
         benefit = Benefit.objects.create(
@@ -255,7 +354,9 @@ class Command(BaseCommand):
         # Add categories
         self.add_categories_to_benefit(benefit, benefit_data['title'])
 
+        self.changes['added'] += 1
         self.stdout.write(self.style.SUCCESS(f'Created benefit: {benefit_id}'))
+        return benefit_id
 
     def add_categories_to_benefit(self, benefit, title):
         """Add appropriate categories to a benefit based on keywords"""
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-17 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('benefits', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawledPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('content_hash', models.CharField(blank=True, help_text='SHA-256 нормализованных льгот со страницы', max_length=64)),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+                ('changed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Страница источника',
+                'verbose_name_plural': 'Страницы источников',
+                'ordering': ['url'],
+            },
+        ),
+    ]
@@ -200,3 +200,22 @@ class UserBenefitInteraction(models.Model):
         verbose_name = 'Взаимодействие пользователя'
         verbose_name_plural = 'Взаимодействия пользователей'
         ordering = ['-created_at']
+
+
+class CrawledPage(models.Model):
+    """Source page state from the last parse_benefits run, for conditional re-crawls"""
+
+    url = models.URLField(max_length=500, unique=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, help_text='SHA-256 нормализованных льгот со страницы')
+    checked_at = models.DateTimeField(auto_now=True)
+    changed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.url
+
+    class Meta:
+        verbose_name = 'Страница источника'
+        verbose_name_plural = 'Страницы источников'
+        ordering = ['url']
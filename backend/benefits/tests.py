@@ -1,3 +1,140 @@
-from django.test import TestCase
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from bs4 import BeautifulSoup
+from django.core.management import call_command
+
+from benefits.management.commands.parse_benefits import Command
+from benefits.models import Benefit, CrawledPage
+from search.models import SearchIndex
+from search.signals import process_queue
+from search.tests import SearchTestCase
+
+PAGE_URL = Command.URLS[0]
+
+
+def section(title, text):
+    return f'<div class="card"><h3>{title}</h3><p>{text}</p></div>'
+
+
+def page_html(*sections):
+    return f'<html><body><h1>Пенсионерам</h1>{"".join(sections)}</body></html>'
+
+
+FREE_TRAVEL = section(
+    'Бесплатный проезд в транспорте',
+    'Пенсионеры могут ездить бесплатно в городском общественном транспорте по социальной карте.',
+)
+MEDICINE = section(
+    'Лекарства для пенсионеров',
+    'Бесплатные лекарства по рецепту врача выдаются в аптеках, которые работают с программой.',
+)
+
+
+def response(status=200, html='', headers=None):
+    return SimpleNamespace(
+        status_code=status,
+        content=html.encode('utf-8'),
+        headers=headers or {},
+        raise_for_status=lambda: None,
+    )
+
+
+class ExtractBenefitsTests(SearchTestCase):
+    def extract(self, html):
+        command = Command(stdout=StringIO())
+        return command.extract_benefits_from_page(BeautifulSoup(html, 'lxml'), PAGE_URL)
+
+    def test_sections_come_out_in_document_order(self):
+        # A section matched by two strategies (card and accordion) is kept once, where it first appears
+        html = page_html(
+            FREE_TRAVEL.replace('class="card"', 'class="card accordion"'),
+            MEDICINE,
+        )
+
+        benefits = self.extract(html)
+
+        self.assertEqual(
+            [benefit['title'] for benefit in benefits],
+            ['Бесплатный проезд в транспорте', 'Лекарства для пенсионеров'],
+        )
+        self.assertEqual(benefits[0]['target_groups'], ['pensioner'])
+
+    def test_hash_ignores_whitespace_but_not_text(self):
+        command = Command(stdout=StringIO())
+        benefits = self.extract(page_html(FREE_TRAVEL, MEDICINE))
+        relaid = self.extract(page_html(FREE_TRAVEL.replace('<p>', '<p>\n    '), MEDICINE))
+        reworded = self.extract(page_html(FREE_TRAVEL.replace('бесплатно', 'со скидкой'), MEDICINE))
+
+        self.assertEqual(command.benefits_hash(benefits), command.benefits_hash(relaid))
+        self.assertNotEqual(command.benefits_hash(benefits), command.benefits_hash(reworded))
+
+
+class IncrementalParseTests(SearchTestCase):
+    """parse_benefits re-runs only write the benefits a source page added, changed or removed"""
+
+    def parse(self, *responses):
+        requests_get = mock.Mock(side_effect=responses)
+        with mock.patch('benefits.management.commands.parse_benefits.requests.get', requests_get):
+            call_command('parse_benefits', limit=1, stdout=StringIO())
+        process_queue()
+        return requests_get
+
+    @staticmethod
+    def indexed_titles():
+        return set(SearchIndex.objects.filter(content_type_name='benefit').values_list('title', flat=True))
+
+    def sfr_benefits(self):
+        return dict(Benefit.objects.filter(benefit_id__startswith='sfr-').values_list('title', 'description'))
+
+    def test_first_run_saves_benefits_and_crawl_state(self):
+        self.parse(response(html=page_html(FREE_TRAVEL, MEDICINE), headers={'ETag': '"v1"'}))
+
+        self.assertEqual(
+            set(self.sfr_benefits()),
+            {'Бесплатный проезд в транспорте', 'Лекарства для пенсионеров'},
+        )
+        self.assertEqual(self.indexed_titles(), set(self.sfr_benefits()))
+        page = CrawledPage.objects.get(url=PAGE_URL)
+        self.assertEqual(page.etag, '"v1"')
+        self.assertEqual(len(page.content_hash), 64)
+        self.assertIsNotNone(page.changed_at)
+
+    def test_not_modified_page_is_skipped(self):
+        self.parse(response(html=page_html(FREE_TRAVEL, MEDICINE), headers={'ETag': '"v1"'}))
+        before = self.sfr_benefits()
+
+        requests_get = self.parse(response(status=304))
+
+        self.assertEqual(requests_get.call_args.kwargs['headers']['If-None-Match'], '"v1"')
+        self.assertEqual(self.sfr_benefits(), before)
+
+    def test_unchanged_content_writes_nothing(self):
+        self.parse(response(html=page_html(FREE_TRAVEL, MEDICINE)))
+        changed_at = CrawledPage.objects.get(url=PAGE_URL).changed_at
+
+        with mock.patch.object(Benefit, 'save') as save:
+            self.parse(response(html=page_html(FREE_TRAVEL, MEDICINE)))
+
+        save.assert_not_called()
+        self.assertEqual(CrawledPage.objects.get(url=PAGE_URL).changed_at, changed_at)
+
+    def test_changed_page_updates_and_removes_benefits(self):
+        self.parse(response(html=page_html(FREE_TRAVEL, MEDICINE)))
+
+        self.parse(response(html=page_html(FREE_TRAVEL.replace('бесплатно', 'со скидкой'))))
+
+        benefits = self.sfr_benefits()
+        self.assertEqual(list(benefits), ['Бесплатный проезд в транспорте'])
+        self.assertIn('со скидкой', benefits['Бесплатный проезд в транспорте'])
+        self.assertEqual(self.indexed_titles(), {'Бесплатный проезд в транспорте'})
+
+    def test_gone_page_removes_its_benefits(self):
+        self.parse(response(html=page_html(FREE_TRAVEL, MEDICINE)))
+
+        self.parse(response(status=410))
+
+        self.assertEqual(self.sfr_benefits(), {})
+        self.assertEqual(self.indexed_titles(), set())
+        self.assertFalse(CrawledPage.objects.filter(url=PAGE_URL).exists())
@@ -78,39 +78,23 @@ from rest_framework.response import Response
         user_profile = getattr(request.user, 'userprofile', None)
         user_region = user_profile.region if user_profile else None
 
-        # 1. Parse query
-        parsed = query_parser.parse(query_text, user_region)
+        # 1-2. Parse query and generate query embedding concurrently (each with a timeout)
+        parsed, query_embedding = prepare_query(services.query_parser, query_text, user_region)
 
-        # 2. Generate query embedding
-        query_embedding = embedding_service.generate(f"query: {query_text}")
-
-        # 3. Search in FAISS
-        search_results = vector_store.search(
+        # 3. Search in FAISS, fused with local keyword search (still works if the embedding failed)
+        search_results = hybrid_search(
+            query_text,
             query_embedding,
             filters=parsed['filters'],
             top_k=20
         )
 
-        # 4. Fetch actual objects from SQLite
-        search_ids = [sid for sid, _ in search_results]
-        search_records = SearchIndex.objects.filter(id__in=search_ids)
+        # 4. Fetch actual objects from SQLite, in ranking order with their similarity
+        results = hydrate(search_results, prefetch=())
 
         # Group by type
-        benefits = []
-        offers = []
-        similarity_scores = {}
-
-        for sid, sim in search_results:
-            similarity_scores[sid] = sim
-
-        for record in search_records:
-            # Attach similarity score
-            record.search_similarity = similarity_scores.get(record.id, 0)
-
-            if record.content_type_name == 'benefit':
-                benefits.append(record.content_object)
-            elif record.content_type_name == 'commercial':
-                offers.append(record.content_object)
+        benefits = [obj for obj in results if isinstance(obj, Benefit)]
+        offers = [obj for obj in results if isinstance(obj, CommercialOffer)]
 
         # 5. Serialize with type information
         return Response({
@@ -121,12 +105,7 @@ from rest_framework.response import Response
                 'description': b.description,
                 'type': 'benefit',
                 'benefit_type': b.benefit_type,
-                'similarity': similarity_scores.get(
-                    SearchIndex.objects.get(
-                        content_type=ContentType.objects.get_for_model(Benefit),
-                        object_id=b.id
-                    ).id, 0
-                )
+                'similarity': b.search_similarity
             } for b in benefits[:10]],
             'offers': [{
                 'id': o.id,
@@ -135,12 +114,7 @@ from rest_framework.response import Response
                 'type': 'commercial',
                 'partner': o.partner_name,
                 'discount': o.discount_description,
-                'similarity': similarity_scores.get(
-                    SearchIndex.objects.get(
-                        content_type=ContentType.objects.get_for_model(CommercialOffer),
-                        object_id=o.id
-                    ).id, 0
-                )
+                'similarity': o.search_similarity
             } for o in offers[:10]],
             'total_benefits': len(benefits),
             'total_offers': len(offers)
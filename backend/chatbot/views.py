@@ -1,29 +1,17 @@
-import os
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from mistralai import Mistral
 from .models import ChatMessage
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 # Search integration
-from search.embedding_service import MistralEmbeddingService
-from search.vector_store import InMemoryVectorStore
-from search.models import SearchIndex
+from search.hybrid import hybrid_search
+from search.caching import query_embeddings
+from search.hydration import hydrate
+from search.services import services
 from benefits.models import Benefit, CommercialOffer
-from django.contrib.contenttypes.models import ContentType
-
-# API key
-MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
-
-# Initialize Mistral client
-mistral_client = Mistral(api_key=MISTRAL_API_KEY)
-
-# Initialize search services
-embedding_service = MistralEmbeddingService()
-vector_store = InMemoryVectorStore()
 
 
 @swagger_auto_schema(
@@ -76,34 +64,24 @@ def chat(request):
         # 1. Search for relevant context
         context_text = ""
         try:
-            # Generate embedding
-            query_embedding = embedding_service.generate(f"query: {message}")
+            # Generate embedding (cached per normalized message)
+            query_embedding = query_embeddings.get(message)
             
-            # Search in vector store
-            search_results = vector_store.search(
+            # Search in vector store + keyword index
+            search_results = hybrid_search(
+                message,
                 query_embedding,
                 filters={}, # No filters for now, search everything
                 top_k=3
             )
             
             if search_results:
-                search_ids = [sid for sid, _ in search_results]
-                search_records = SearchIndex.objects.filter(id__in=search_ids)
-                
                 found_items = []
-                for record in search_records:
-                    if record.content_type_name == 'benefit':
-                        try:
-                            benefit = Benefit.objects.get(id=record.object_id)
-                            found_items.append(f"Льгота: {benefit.title}\nОписание: {benefit.description}\nКто может получить: {benefit.requirements}")
-                        except Benefit.DoesNotExist:
-                            continue
-                    elif record.content_type_name == 'commercial':
-                        try:
-                            offer = CommercialOffer.objects.get(id=record.object_id)
-                            found_items.append(f"Предложение: {offer.title}\nПартнер: {offer.partner_name}\nСкидка: {offer.discount_description}")
-                        except CommercialOffer.DoesNotExist:
-                            continue
+                for obj in hydrate(search_results, prefetch=()):
+                    if isinstance(obj, Benefit):
+                        found_items.append(f"Льгота: {obj.title}\nОписание: {obj.description}\nКто может получить: {obj.requirements}")
+                    elif isinstance(obj, CommercialOffer):
+                        found_items.append(f"Предложение: {obj.title}\nПартнер: {obj.partner_name}\nСкидка: {obj.discount_description}")
                 
                 if found_items:
                     context_text = "\n\nНАЙДЕННАЯ ИНФОРМАЦИЯ ИЗ БАЗЫ ДАННЫХ:\n" + "\n---\n".join(found_items)
@@ -154,7 +132,7 @@ def chat(request):
             elif msg['role'] == 'assistant':
                  mistral_messages.append(AssistantMessage(content=msg['content']))
 
-        chat_response = mistral_client.chat.complete(
+        chat_response = services.mistral_client.chat.complete(
             model="mistral-large-latest",
             messages=mistral_messages,
             temperature=0.7,
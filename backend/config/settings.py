@@ -157,6 +157,51 @@ REST_FRAMEWORK = {
 # Vector store files will be created in BASE_DIR
 VECTOR_INDEX_PATH = BASE_DIR / 'search_index.faiss'
 VECTOR_MAPPING_PATH = BASE_DIR / 'search_mapping.json'
+VECTOR_IDS_PATH = BASE_DIR / 'search_ids.npy'
+# FAISS index_factory string for the vector store, e.g. 'Flat' (exact), 'HNSW32', 'IVF1024,Flat', 'IVF1024,PQ64'.
+# IVF/PQ are trained on the first VECTOR_TRAIN_SIZE vectors during `manage.py rebuild_index`.
+VECTOR_INDEX_FACTORY = os.getenv('VECTOR_INDEX_FACTORY', 'Flat')
+VECTOR_TRAIN_SIZE = int(os.getenv('VECTOR_TRAIN_SIZE', '50000'))
+# Default search breadth, overridable per search() call
+VECTOR_NPROBE = int(os.getenv('VECTOR_NPROBE', '16'))
+VECTOR_EF_SEARCH = int(os.getenv('VECTOR_EF_SEARCH', '64'))
+# Local full-text (FTS5) index fused with vector results; works without the embedding API
+LEXICAL_INDEX_PATH = BASE_DIR / 'search_lexical.sqlite3'
+# Search scores are cosine similarities; results below this are not returned
+VECTOR_MIN_SIMILARITY = float(os.getenv('VECTOR_MIN_SIMILARITY', '0.0'))
+# Embedding provider: 'mistral' (API) or 'local' (hashed character n-grams, offline and deterministic).
+# Vectors from different providers don't mix - run `manage.py rebuild_index --reembed` after switching.
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'mistral')
+# How SearchIndex.embedding_vector is packed: 'float32' (exact), 'float16' or 'int8' (smaller, lossy)
+SEARCH_EMBEDDING_DTYPE = os.getenv('SEARCH_EMBEDDING_DTYPE', 'float32')
+# Memory-map the index read-only so web workers share one copy; a process that writes
+# (indexing worker, management commands) switches to a private in-memory copy first
+VECTOR_INDEX_MMAP = os.getenv('VECTOR_INDEX_MMAP', 'False') == 'True'
+# Index writes are batched: at most one disk write per interval (seconds); a change made inside
+# the interval is written when it ends, plus on flush() / exit
+VECTOR_PERSIST_INTERVAL = float(os.getenv('VECTOR_PERSIST_INTERVAL', '5'))
+
+# 'sync': index inside post_save (no worker needed, saves wait for the embedding API).
+# 'queue': saves only enqueue an IndexingTask; needs `manage.py process_indexing_queue --loop` running.
+SEARCH_INDEXING_MODE = os.getenv('SEARCH_INDEXING_MODE', 'sync')
+# Query embeddings: per-process LRU cache (entries, seconds). Set QUERY_EMBEDDING_CACHE_BACKEND
+# to a CACHES alias to also share them between workers.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '2048'))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+QUERY_EMBEDDING_CACHE_BACKEND = os.getenv('QUERY_EMBEDDING_CACHE_BACKEND') or None
+# Parsed queries (intent/filters) cached per process: entries, seconds
+QUERY_PARSE_CACHE_SIZE = int(os.getenv('QUERY_PARSE_CACHE_SIZE', '2048'))
+QUERY_PARSE_CACHE_TTL = float(os.getenv('QUERY_PARSE_CACHE_TTL', '3600'))
+# Search parses and embeds the query in parallel; past these limits (seconds) it uses the
+# rule-based parse / keyword-only search instead of waiting
+QUERY_PARSE_TIMEOUT = float(os.getenv('QUERY_PARSE_TIMEOUT', '3'))
+QUERY_EMBEDDING_TIMEOUT = float(os.getenv('QUERY_EMBEDDING_TIMEOUT', '3'))
+SEARCH_QUERY_WORKERS = int(os.getenv('SEARCH_QUERY_WORKERS', '8'))
+# Hard limit (seconds) on those API calls, including the ones still running after the search gave up on them
+SEARCH_API_TIMEOUT = float(os.getenv('SEARCH_API_TIMEOUT', '10'))
+# Search services are created on first use. For web workers, list the ones to load at startup
+# (in a background thread), e.g. SEARCH_WARM_UP=vector_store,lexical_index,query_parser
+SEARCH_WARM_UP = [name for name in os.getenv('SEARCH_WARM_UP', '').split(',') if name]
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-your-key')
 
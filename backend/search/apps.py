@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class SearchConfig(AppConfig):
@@ -7,3 +8,8 @@ class SearchConfig(AppConfig):
 
     def ready(self):
         import search.signals
+
+        # Load the listed services now instead of on the first request
+        if settings.SEARCH_WARM_UP:
+            from .services import services
+            services.warm_up_in_background(settings.SEARCH_WARM_UP)
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL and hit/miss counters"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]  # Expired
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a query: case, 'ё' and whitespace differences don't matter"""
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+class QueryEmbeddingCache:
+    """
+    Query text -> embedding. An in-process LRU/TTL cache in front of an optional shared
+    django cache (QUERY_EMBEDDING_CACHE_BACKEND), in front of the embedding API.
+    Failed (zero) embeddings are never cached.
+    """
+
+    def __init__(self):
+        self.local = LRUCache(settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_CACHE_TTL)
+        self.shared_hits = 0
+
+    @property
+    def service(self):
+        from .services import services
+        return services.embedding_service
+
+    def _shared(self):
+        alias = settings.QUERY_EMBEDDING_CACHE_BACKEND
+        return caches[alias] if alias else None
+
+    def get(self, query: str) -> list[float]:
+        text = f"query: {normalize_query(query)}"
+        key = self.service.content_hash(text)
+
+        embedding = self.local.get(key)
+        if embedding is not None:
+            return embedding
+
+        shared = self._shared()
+        if shared is not None:
+            try:
+                data = shared.get(f"query-embedding:{key}")
+            except Exception as e:
+                print(f"Shared query cache unavailable: {e}")
+                data = None
+            if data is not None:
+                embedding = np.frombuffer(data, dtype=np.float32).tolist()
+                self.shared_hits += 1
+                self.local.set(key, embedding)
+                return embedding
+
+        embedding = self.service.generate(text)
+        if any(embedding):
+            self.local.set(key, embedding)
+            if shared is not None:
+                try:
+                    shared.set(f"query-embedding:{key}", np.asarray(embedding, dtype=np.float32).tobytes(),
+                               timeout=settings.QUERY_EMBEDDING_CACHE_TTL)
+                except Exception as e:
+                    print(f"Shared query cache unavailable: {e}")
+        return embedding
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        stats['shared_hits'] = self.shared_hits
+        return stats
+
+
+# Shared by search/views.py, benefits/views.py and chatbot/views.py
+query_embeddings = QueryEmbeddingCache()
@@ -1,51 +1,295 @@
 # ЗАКОММЕНТИРОВАНО: Используем только облачные API, без локальных моделей
 # from sentence_transformers import SentenceTransformer
 # import torch
+import abc
+import hashlib
 import json
 import os
-from mistralai import Mistral
+import math
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+from django.conf import settings
+from django.db import OperationalError
 import time
 
 
-class MistralEmbeddingService:
+class EmbeddingService(abc.ABC):
     """
-    Service for generating embeddings using Mistral API.
+    Base class for embedding providers (EMBEDDING_BACKEND). Subclasses set `model` and
+    implement generate_batch(); caching and the Benefit/CommercialOffer texts are shared.
     """
+    model = None
+    dimension = 1024
 
     def __init__(self):
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def generate(self, text: str) -> list[float]:
+        """Generate embedding for a single text string"""
+        return self.generate_batch([text])[0]
+
+    @abc.abstractmethod
+    def generate_batch(self, texts: list[str]) -> list[list[float]]:
+        """Embeddings for texts, in order; a zero vector marks a text that could not be embedded"""
+
+    def content_hash(self, text: str) -> str:
+        """Cache key: the exact embedded text plus the model that embeds it"""
+        return hashlib.sha256(f"{self.model}\n{text}".encode('utf-8')).hexdigest()
+
+    def generate_cached(self, text: str) -> list[float]:
+        """Generate embedding, reusing a stored one if this exact text was embedded before"""
+        return self.generate_batch_cached([text])[0]
+
+    def generate_batch_cached(self, texts: list[str]) -> list[list[float]]:
+        """Batch version of generate_cached: one cache lookup, batched API calls for the misses"""
+        from .models import EmbeddingCache
+
+        hashes = [self.content_hash(text) for text in texts]
+        cached = {}
+        try:
+            for start in range(0, len(hashes), 500):  # stay under SQLite's variable limit
+                cached.update(EmbeddingCache.objects.filter(
+                    content_hash__in=hashes[start:start + 500]
+                ).values_list('content_hash', 'vector'))
+        except OperationalError:
+            pass  # Cache table not created yet
+
+        # Embed each distinct missing text once
+        missing = {}
+        for text, content_hash in zip(texts, hashes):
+            if content_hash not in cached:
+                missing.setdefault(content_hash, text)
+        self.cache_hits += len(texts) - len(missing)
+        self.cache_misses += len(missing)
+
+        if missing:
+            fresh = dict(zip(missing, self.generate_batch(list(missing.values()))))
+            # Zero vectors mean the API call failed - never cache those
+            new_rows = [
+                EmbeddingCache(
+                    content_hash=content_hash,
+                    model=self.model,
+                    vector=np.asarray(embedding, dtype=np.float32).tobytes()
+                )
+                for content_hash, embedding in fresh.items() if any(embedding)
+            ]
+            try:
+                EmbeddingCache.objects.bulk_create(new_rows, ignore_conflicts=True)
+            except OperationalError:
+                pass
+        else:
+            fresh = {}
+
+        return [
+            fresh[content_hash] if content_hash in fresh
+            else np.frombuffer(cached[content_hash], dtype=np.float32).tolist()
+            for content_hash in hashes
+        ]
+
+    def cache_stats(self) -> dict:
+        total = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': self.cache_hits / total if total else 0.0,
+        }
+
+    def reset_cache_stats(self):
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def text_for_benefit(self, benefit) -> str:
+        """Text that represents a Benefit for semantic search"""
+        # Combine relevant fields for semantic search
+        text = f"{benefit.title} {benefit.description} {benefit.requirements}"
+        # Add target groups and regions for better context
+        if benefit.target_groups:
+            text += f" для {', '.join(benefit.target_groups)}"
+        return text
+
+    def text_for_offer(self, offer) -> str:
+        """Text that represents a CommercialOffer for semantic search"""
+        return f"{offer.title} {offer.description} {offer.partner_name} {offer.discount_description}"
+
+    def generate_for_benefit(self, benefit) -> list[float]:
+        """Generate embedding for a Benefit object"""
+        return self.generate_cached(self.text_for_benefit(benefit))
+
+    def generate_for_offer(self, offer) -> list[float]:
+        """Generate embedding for a CommercialOffer object"""
+        return self.generate_cached(self.text_for_offer(offer))
+
+    def generate_for_benefits(self, benefits) -> list[list[float]]:
+        """Batched generate_for_benefit"""
+        return self.generate_batch_cached([self.text_for_benefit(benefit) for benefit in benefits])
+
+    def generate_for_offers(self, offers) -> list[list[float]]:
+        """Batched generate_for_offer"""
+        return self.generate_batch_cached([self.text_for_offer(offer) for offer in offers])
+
+
+class MistralEmbeddingService(EmbeddingService):
+    """
+    Service for generating embeddings using Mistral API.
+    Document embeddings go through a persistent content-hash cache (EmbeddingCache).
+    """
+    # mistral-embed accepts 8192 tokens per input and about 16k tokens per request
+    MAX_TOKENS_PER_INPUT = 8000
+    MAX_TOKENS_PER_REQUEST = 16000
+    MAX_INPUTS_PER_REQUEST = 128
+    CHARS_PER_TOKEN = 3  # conservative for Russian text
+    # Rate limits, 5xx and timeouts: retries of the whole batch, 1s, 2s, 4s apart
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 1.0
+
+    def __init__(self, client=None):
+        super().__init__()
         api_key = os.getenv("MISTRAL_API_KEY")
         if not api_key:
             raise ValueError("MISTRAL_API_KEY environment variable is not set")
-        self.client = Mistral(api_key=api_key)
+        if client is None:
+            from mistralai import Mistral
+            client = Mistral(api_key=api_key)
+        self.client = client
         self.model = "mistral-embed"
 
     def generate(self, text: str) -> list[float]:
         """Generate embedding for a single text string"""
         if not text:
-            return [0.0] * 1024
-            
+            return [0.0] * self.dimension
+
         try:
+            # Query embeddings: keep a call the search stopped waiting for from hanging on
             response = self.client.embeddings.create(
                 model=self.model,
-                inputs=[text]
+                inputs=[self._fit(text)],
+                timeout_ms=int(settings.SEARCH_API_TIMEOUT * 1000)
             )
             return response.data[0].embedding
         except Exception as e:
             print(f"Error generating embedding: {e}")
             # Return zero vector on error to prevent crash, but log it
-            return [0.0] * 1024
+            return [0.0] * self.dimension
 
-    def generate_for_benefit(self, benefit) -> list[float]:
-        """Generate embedding for a Benefit object"""
-        # Combine relevant fields for semantic search
-        text = f"{benefit.title} {benefit.description} {benefit.requirements}"
-        # Add target groups and regions for better context
-        if benefit.target_groups:
-            text += f" для {', '.join(benefit.target_groups)}"
-        
-        return self.generate(text)
+    def generate_batch(self, texts: list[str]) -> list[list[float]]:
+        """Generate embeddings for many texts, packing as many inputs per request as the limits allow"""
+        embeddings = [[0.0] * self.dimension for _ in texts]
+        for batch in self._pack([i for i, text in enumerate(texts) if text], texts):
+            self._embed_batch(batch, texts, embeddings)
+        return embeddings
 
-    def generate_for_offer(self, offer) -> list[float]:
-        """Generate embedding for a CommercialOffer object"""
-        text = f"{offer.title} {offer.description} {offer.partner_name} {offer.discount_description}"
-        return self.generate(text)
\ No newline at end of file
+    def _embed_batch(self, batch: list[int], texts: list[str], embeddings: list):
+        """
+        Embed one packed batch. A rejected request (4xx: input too long, invalid text) is split
+        in halves to isolate the bad input; rate limits, server errors and timeouts retry the
+        whole batch with backoff. Inputs that still fail keep their zero vector.
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                response = self.client.embeddings.create(
+                    model=self.model,
+                    inputs=[self._fit(texts[i]) for i in batch]
+                )
+            except Exception as e:
+                if self._is_rejected_input(e):
+                    if len(batch) == 1:
+                        print(f"⚠️ Embedding input {batch[0]} rejected: {e}")
+                        return
+                    # Token estimate may be off or one input may be bad - retry in halves
+                    middle = len(batch) // 2
+                    self._embed_batch(batch[:middle], texts, embeddings)
+                    self._embed_batch(batch[middle:], texts, embeddings)
+                    return
+                if attempt == self.MAX_RETRIES:
+                    print(f"⚠️ Embedding batch of {len(batch)} inputs failed after {attempt + 1} attempts: {e}")
+                    return
+                time.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+                continue
+
+            for i, item in zip(batch, response.data):
+                embeddings[i] = item.embedding
+            return
+
+    @staticmethod
+    def _is_rejected_input(error) -> bool:
+        """4xx other than 408/429: the request itself is invalid, retrying it unchanged won't help"""
+        status = getattr(error, 'status_code', None)
+        return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+    def _estimate_tokens(self, text: str) -> int:
+        return len(text) // self.CHARS_PER_TOKEN + 1
+
+    def _fit(self, text: str) -> str:
+        """Trim text that would exceed the per-input token limit"""
+        return text[:self.MAX_TOKENS_PER_INPUT * self.CHARS_PER_TOKEN]
+
+    def _pack(self, indices: list[int], texts: list[str]):
+        """Split text indices into request-sized batches"""
+        batch, batch_tokens = [], 0
+        for i in indices:
+            tokens = min(self._estimate_tokens(texts[i]), self.MAX_TOKENS_PER_INPUT)
+            if batch and (batch_tokens + tokens > self.MAX_TOKENS_PER_REQUEST
+                          or len(batch) >= self.MAX_INPUTS_PER_REQUEST):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+
+_WORD_RE = re.compile(r'\w+')
+
+
+@lru_cache(maxsize=200_000)
+def _word_features(word: str, dimension: int):
+    """Hashed buckets and signs of a word's character 3-5-grams (plus the whole word)"""
+    padded = f' {word} '
+    grams = {padded[i:i + n] for n in (3, 4, 5) for i in range(len(padded) - n + 1)}
+    grams.add(padded)
+    hashes = np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint32)
+    # Low bits pick the bucket, the top bit the sign, so collisions tend to cancel out
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32) / math.sqrt(len(grams))
+    return (hashes % dimension).astype(np.int64), signs
+
+
+class HashingEmbeddingService(EmbeddingService):
+    """
+    Local CPU-only embeddings: character n-grams of each word hashed into `dimension`
+    buckets, weighted by sublinear term frequency and L2-normalized. No network, no API key,
+    and the same text always gets the same vector. Catches shared word stems and typos,
+    not synonyms - meant for offline indexing, development and reproducible benchmarks.
+    """
+    model = 'local-hashing-v1'
+
+    def generate_batch(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def generate_batch_cached(self, texts: list[str]) -> list[list[float]]:
+        """Computing a vector is cheaper than looking it up, so EmbeddingCache is skipped"""
+        return self.generate_batch(texts)
+
+    def _embed(self, text: str) -> list[float]:
+        from .lexical_index import STOPWORDS
+
+        # Drop the "query: " marker the search views add, it is not part of the question
+        text = (text or '').removeprefix('query: ').lower().replace('ё', 'е')
+        counts = Counter(word for word in _WORD_RE.findall(text) if word not in STOPWORDS)
+
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word, count in counts.items():
+            buckets, signs = _word_features(word, self.dimension)
+            np.add.at(vector, buckets, signs * (1.0 + math.log(count)))
+
+        norm = np.linalg.norm(vector)
+        return (vector / norm).tolist() if norm else vector.tolist()
+
+
+EMBEDDING_BACKENDS = {
+    'mistral': MistralEmbeddingService,
+    'local': HashingEmbeddingService,
+}
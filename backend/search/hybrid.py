@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+
+from .caching import query_embeddings
+from .services import services
+
+# Parsing and embedding a query are independent remote calls - run them side by side
+_query_executor = ThreadPoolExecutor(max_workers=settings.SEARCH_QUERY_WORKERS, thread_name_prefix='search-query')
+# One slot per worker thread: calls never queue behind slow ones, a full pool skips them instead
+_query_slots = threading.BoundedSemaphore(settings.SEARCH_QUERY_WORKERS)
+
+RRF_K = 60  # Standard reciprocal rank fusion constant
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K) -> list:
+    """Merge ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def hybrid_search(query_text: str, query_embedding, filters: dict, top_k: int = 20):
+    """
+    FAISS results fused with BM25 keyword results. Returns [(search_index_id, similarity)]
+    in fused order; similarity is the cosine score, or 0.0 for keyword-only hits.
+    A failed (zero) or missing (None) query embedding leaves the keyword results on their own.
+    """
+    if query_embedding is None:
+        vector_results = []
+    else:
+        vector_results = services.vector_store.search(query_embedding, filters=filters, top_k=top_k)
+
+    try:
+        lexical_ids = [search_index_id for search_index_id, _ in services.lexical_index.search(query_text, limit=top_k * 5)]
+        lexical_ids = services.vector_store.matching_ids(lexical_ids, filters)[:top_k]
+    except Exception as e:
+        print(f"Lexical search failed: {e}")
+        lexical_ids = []
+
+    similarity = dict(vector_results)
+    fused = reciprocal_rank_fusion([[search_index_id for search_index_id, _ in vector_results], lexical_ids])
+    return [(search_index_id, similarity.get(search_index_id, 0.0)) for search_index_id in fused[:top_k]]
+
+
+def _submit(fn, *args):
+    """Run fn in the query pool, or return None when every worker is still busy"""
+    if not _query_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _query_executor.submit(fn, *args)
+    except BaseException:
+        _query_slots.release()
+        raise
+    future.add_done_callback(lambda _: _query_slots.release())
+    return future
+
+
+def prepare_query(query_parser, query_text: str, user_region=None):
+    """
+    Parse and embed the query concurrently. Returns (parsed, query_embedding).
+    A parse slower than QUERY_PARSE_TIMEOUT is replaced by the rule-based fallback parse;
+    an embedding slower than QUERY_EMBEDDING_TIMEOUT comes back as None (keyword search only).
+    Calls that time out keep running (up to SEARCH_API_TIMEOUT) and still fill their caches
+    for the next query; while the pool is full of them, new calls are skipped the same way.
+    """
+    started = time.monotonic()
+    parse_future = _submit(query_parser.parse, query_text, user_region)
+    embed_future = _submit(query_embeddings.get, query_text)
+
+    if parse_future is None:
+        print("⚠️ Query workers busy, using fallback parse")
+        parsed = query_parser.parse_rules(query_text)
+    else:
+        try:
+            parsed = parse_future.result(timeout=settings.QUERY_PARSE_TIMEOUT)
+        except TimeoutError:
+            print(f"⚠️ Query parsing timed out after {settings.QUERY_PARSE_TIMEOUT}s, using fallback parse")
+            parsed = query_parser.parse_rules(query_text)
+
+    if embed_future is None:
+        print("⚠️ Query workers busy, using keyword search only")
+        return parsed, None
+
+    remaining = max(settings.QUERY_EMBEDDING_TIMEOUT - (time.monotonic() - started), 0)
+    try:
+        query_embedding = embed_future.result(timeout=remaining)
+    except TimeoutError:
+        print(f"⚠️ Query embedding timed out after {settings.QUERY_EMBEDDING_TIMEOUT}s, using keyword search only")
+        query_embedding = None
+    except Exception as e:
+        print(f"Error generating query embedding: {e}")
+        query_embedding = None
+
+    return parsed, query_embedding
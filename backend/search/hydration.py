@@ -0,0 +1,34 @@
+from benefits.models import Benefit, CommercialOffer
+from .models import SearchIndex
+
+MODELS = {'benefit': Benefit, 'commercial': CommercialOffer}
+
+
+def hydrate(search_results, prefetch=('regions',)) -> list:
+    """
+    Turn [(search_index_id, similarity)] into Benefit/CommercialOffer instances in the same
+    (ranking) order, each with a `search_similarity` attribute. Runs one query for the
+    SearchIndex rows plus one per content type (and per prefetch), however many results.
+    Results whose object no longer exists are dropped.
+    """
+    if not search_results:
+        return []
+
+    similarity = dict(search_results)
+    records = SearchIndex.objects.filter(id__in=similarity).values_list('id', 'content_type_name', 'object_id')
+    keys = {search_index_id: (content_type_name, object_id) for search_index_id, content_type_name, object_id in records}
+
+    instances = {}
+    for content_type_name, model in MODELS.items():
+        object_ids = [object_id for name, object_id in keys.values() if name == content_type_name]
+        if object_ids:
+            for instance in model.objects.filter(id__in=object_ids).prefetch_related(*prefetch):
+                instances[(content_type_name, instance.id)] = instance
+
+    hydrated = []
+    for search_index_id, _ in search_results:
+        instance = instances.get(keys.get(search_index_id))
+        if instance is not None:
+            instance.search_similarity = similarity[search_index_id]
+            hydrated.append(instance)
+    return hydrated
@@ -0,0 +1,141 @@
+import re
+import sqlite3
+import threading
+from django.conf import settings
+from django.db import OperationalError
+from benefits.models import Benefit, CommercialOffer
+from .models import SearchIndex
+
+# Light Russian stemmer: strip the longest inflectional ending, keep at least 3 letters of stem.
+# Good enough for matching "пенсионеров" with "пенсионеры"; abbreviations (ТСР, СНИЛС) stay as they are.
+_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ием', 'иям', 'ям', 'ам', 'ом', 'ем',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей',
+    'ий', 'ый', 'ую', 'юю', 'ия', 'ья', 'ье', 'ов', 'ев', 'ию', 'ью', 'ться', 'ть', 'ет', 'ют',
+    'ит', 'ят', 'ешь', 'ишь', 'ал', 'ил', 'ла', 'ли', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+STOPWORDS = {
+    'и', 'в', 'во', 'на', 'по', 'с', 'со', 'о', 'об', 'от', 'до', 'за', 'к', 'ко', 'из', 'у', 'для',
+    'как', 'что', 'это', 'мне', 'я', 'мы', 'вы', 'он', 'она', 'они', 'не', 'ли', 'или', 'а', 'но',
+    'какие', 'какой', 'есть', 'можно', 'нужно', 'хочу',
+}
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def stem(word: str) -> str:
+    word = word.lower().replace('ё', 'е')
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_text(text: str) -> str:
+    return ' '.join(stem(word) for word in _WORD_RE.findall(text or ''))
+
+
+def document_text(instance, content_type_name) -> tuple:
+    """(title, body) indexed for a Benefit or CommercialOffer"""
+    if content_type_name == 'benefit':
+        return instance.title, f"{instance.description} {instance.requirements}"
+    return instance.title, f"{instance.description} {instance.partner_name} {instance.discount_description}"
+
+
+class LexicalIndex:
+    """
+    Local full-text index (SQLite FTS5, BM25 ranking) over Benefit/CommercialOffer text,
+    keyed by SearchIndex.id. Needs no network, so keyword search keeps working when the
+    embedding API does not. Stored in its own file (LEXICAL_INDEX_PATH).
+    """
+    _local = threading.local()  # One connection per thread
+    _checked = False
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(settings.LEXICAL_INDEX_PATH), timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5("
+                "title, body, tokenize='unicode61 remove_diacritics 2')"
+            )
+            self._local.connection = connection
+        return connection
+
+    def upsert_many(self, rows):
+        """Index [(search_index_id, title, body), ...], replacing earlier text for those ids"""
+        if not rows:
+            return
+        connection = self._connection()
+        with connection:
+            connection.executemany('DELETE FROM docs WHERE rowid = ?', [(row[0],) for row in rows])
+            connection.executemany(
+                'INSERT INTO docs (rowid, title, body) VALUES (?, ?, ?)',
+                [(search_index_id, stem_text(title), stem_text(body)) for search_index_id, title, body in rows]
+            )
+
+    def remove_ids(self, search_index_ids):
+        if not search_index_ids:
+            return
+        connection = self._connection()
+        with connection:
+            connection.executemany('DELETE FROM docs WHERE rowid = ?', [(i,) for i in search_index_ids])
+
+    def count(self) -> int:
+        return self._connection().execute('SELECT count(*) FROM docs').fetchone()[0]
+
+    def search(self, query: str, limit: int = 100):
+        """[(search_index_id, score)] best first; any stemmed query word may match, as a prefix"""
+        self._ensure_built()
+        terms = list(dict.fromkeys(
+            stem(word) for word in _WORD_RE.findall(query.lower())
+            if word not in STOPWORDS and len(word) > 1
+        ))
+        if not terms:
+            return []
+
+        match = ' OR '.join(f'"{term}"*' for term in terms)
+        rows = self._connection().execute(
+            # bm25() is lower-is-better; titles weigh more than body text
+            'SELECT rowid, -bm25(docs, 4.0, 1.0) FROM docs WHERE docs MATCH ? ORDER BY bm25(docs, 4.0, 1.0) LIMIT ?',
+            (match, limit)
+        ).fetchall()
+        return [(int(search_index_id), float(score)) for search_index_id, score in rows]
+
+    def warm_up(self):
+        """Open the connection and build the index now rather than on the first search"""
+        self._ensure_built()
+
+    def _ensure_built(self):
+        """Build from the database on first use if the index file is new"""
+        if LexicalIndex._checked:
+            return
+        LexicalIndex._checked = True
+        try:
+            if self.count() == 0 and SearchIndex.objects.filter(is_active=True).exists():
+                self.rebuild()
+        except OperationalError:
+            pass  # SearchIndex table not created yet
+
+    def rebuild(self, chunk_size: int = 500):
+        """Re-index every active SearchIndex row from its Benefit/CommercialOffer"""
+        print("Building lexical index from database...")
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM docs')
+
+        for content_type_name, model in (('benefit', Benefit), ('commercial', CommercialOffer)):
+            search_ids = dict(
+                SearchIndex.objects.filter(is_active=True, content_type_name=content_type_name)
+                .values_list('object_id', 'id')
+            )
+            object_ids = list(search_ids)
+            for start in range(0, len(object_ids), chunk_size):
+                instances = model.objects.filter(id__in=object_ids[start:start + chunk_size])
+                self.upsert_many([
+                    (search_ids[instance.id], *document_text(instance, content_type_name))
+                    for instance in instances
+                ])
+        print(f"✓ Lexical index: {self.count()} documents")
@@ -0,0 +1,80 @@
+# search/management/commands/benchmark_startup.py
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+PROJECT_DIR = Path(__file__).resolve().parents[3]  # Where manage.py lives
+
+# Runs in a fresh interpreter: boot the WSGI app the way a web worker does, then optionally warm up
+BOOT_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns  # Imports every view module, as the first request would
+booted = time.perf_counter() - started
+warm_up = {}
+if sys.argv[1]:
+    from search.services import services
+    warm_up = services.warm_up(sys.argv[1].split(','))
+print(json.dumps({
+    'boot': booted,
+    'warm_up': warm_up,
+    'imported': [name for name in ('mistralai', 'faiss') if name in sys.modules],
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Time `manage.py check` and web worker boot (with and without service warm-up) in fresh processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per measurement')
+        parser.add_argument('--warm-up', default='vector_store,lexical_index,query_parser',
+                            help='Comma-separated services to warm up in the second boot measurement')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.pop('SEARCH_WARM_UP', None)  # Warm-up is measured explicitly, not in a background thread
+        runs = options['runs']
+
+        check = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, 'manage.py', 'check'], cwd=PROJECT_DIR, env=env,
+                           check=True, capture_output=True)
+            check.append(time.perf_counter() - started)
+        self._report('manage.py check (process wall time)', check)
+
+        for warm_up in ('', options['warm_up']):
+            boots, totals, services = [], [], {}
+            for _ in range(runs):
+                started = time.perf_counter()
+                output = subprocess.run([sys.executable, '-c', BOOT_SCRIPT, warm_up], cwd=PROJECT_DIR,
+                                        env=env, check=True, capture_output=True, text=True).stdout
+                totals.append(time.perf_counter() - started)
+                result = json.loads(output.strip().splitlines()[-1])
+                boots.append(result['boot'])
+                for name, seconds in result['warm_up'].items():
+                    services.setdefault(name, []).append(seconds)
+
+            label = f'worker boot + warm-up ({warm_up})' if warm_up else 'worker boot (lazy services)'
+            self.stdout.write(self.style.WARNING(f'\n{label}'))
+            self._report('  django setup + URLconf', boots)
+            for name, samples in services.items():
+                self._report(f'  warm-up {name}', samples)
+            self._report('  process wall time', totals)
+            self.stdout.write(f'  heavy modules imported: {", ".join(result["imported"]) or "none"}')
+
+        self.stdout.write(self.style.SUCCESS('\n✓ Startup benchmark complete'))
+
+    def _report(self, label, samples):
+        samples_ms = np.array(samples) * 1000
+        self.stdout.write(f'{label:<40} median {np.median(samples_ms):8.1f} ms   min {samples_ms.min():8.1f} ms')
@@ -0,0 +1,207 @@
+# search/management/commands/benchmark_vector_store.py
+import random
+import time
+
+import faiss
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from benefits.models import Benefit
+from search.models import SearchIndex
+from search.vector_store import InMemoryVectorStore
+
+
+class Command(BaseCommand):
+    help = 'Benchmark filtered vector search latency on synthetic data (nothing is kept in the DB or on disk)'
+
+    REGION_CODES = ['00', '01', '14', '50', '77', '78', 'all']
+    TARGET_GROUPS = [code for code, _ in Benefit.BENEFICIARY_CATEGORIES]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                            help='Number of vectors to benchmark with')
+        parser.add_argument('--queries', type=int, default=50, help='Queries per size')
+        parser.add_argument('--top-k', type=int, default=20)
+        parser.add_argument('--dimension', type=int, default=1024)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--factories', nargs='*', default=[],
+                            help='FAISS factory strings to compare with the flat index, e.g. HNSW32 IVF1024,PQ64')
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64],
+                            help='nprobe values to sweep for IVF factories')
+        parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256],
+                            help='efSearch values to sweep for HNSW factories')
+        parser.add_argument('--train-size', type=int, default=50000, help='Training sample for IVF/PQ')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.rng = np.random.default_rng(options['seed'])
+
+        for size in options['sizes']:
+            self.stdout.write(self.style.WARNING(f'\n=== {size} vectors ==='))
+            with transaction.atomic():
+                self._run(size, options)
+                # Synthetic SearchIndex rows are never committed
+                transaction.set_rollback(True)
+
+    def _run(self, size, options):
+        dimension = options['dimension']
+        top_k = options['top_k']
+
+        started = time.perf_counter()
+        ids, filter_rows = self._create_rows(size)
+        vectors = self._clustered_vectors(size, dimension)
+        store = InMemoryVectorStore.detached(dimension)
+        self._fill(store, ids, vectors, filter_rows)
+        self.stdout.write(f'Prepared in {time.perf_counter() - started:.1f}s')
+
+        # Queries near the data, like real questions near real documents
+        queries = vectors[self.rng.choice(size, options['queries'])] + self._random_vectors(
+            options['queries'], dimension) * 0.5
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        filters = [self._random_filters() for _ in range(options['queries'])]
+
+        timings = {'before (ORM per candidate)': [], 'after (IDSelector bitmap)': []}
+        result_counts = {label: [] for label in timings}
+        for query, query_filters in zip(queries, filters):
+            started = time.perf_counter()
+            results = self._legacy_search(store, query, query_filters, top_k)
+            timings['before (ORM per candidate)'].append(time.perf_counter() - started)
+            result_counts['before (ORM per candidate)'].append(len(results))
+
+            started = time.perf_counter()
+            results = store.search(query, query_filters, top_k=top_k)
+            timings['after (IDSelector bitmap)'].append(time.perf_counter() - started)
+            result_counts['after (IDSelector bitmap)'].append(len(results))
+
+        for label, samples in timings.items():
+            samples_ms = np.array(samples) * 1000
+            self.stdout.write(
+                f'{label:<28} p50 {np.percentile(samples_ms, 50):8.2f} ms   '
+                f'p95 {np.percentile(samples_ms, 95):8.2f} ms   '
+                f'avg results {np.mean(result_counts[label]):5.1f}/{top_k}'
+            )
+
+        if options['factories']:
+            self._compare_factories(store, ids, vectors, filter_rows, queries, filters, options)
+
+    def _compare_factories(self, flat_store, ids, vectors, filter_rows, queries, filters, options):
+        """recall@k against the exact flat index vs latency, for each factory and search breadth"""
+        top_k = options['top_k']
+        truth = [
+            {search_index_id for search_index_id, _ in flat_store.search(query, query_filters, top_k=top_k)}
+            for query, query_filters in zip(queries, filters)
+        ]
+
+        self.stdout.write(f'\n{"index":<24}{"param":<16}{"build":>8}  {"p50":>9}  {"p95":>9}  recall@{top_k}')
+        for factory in ['Flat'] + options['factories']:
+            started = time.perf_counter()
+            store = InMemoryVectorStore.detached(vectors.shape[1], factory)
+            sample = vectors[self.rng.permutation(len(vectors))[:options['train_size']]]
+            store.train(sample)
+            self._fill(store, ids, vectors, filter_rows)
+            build_time = time.perf_counter() - started
+
+            inner = store._inner_index()
+            if isinstance(inner, faiss.IndexIVF):
+                sweep = [('nprobe', value) for value in options['nprobe']]
+            elif isinstance(inner, faiss.IndexHNSW):
+                sweep = [('ef_search', value) for value in options['ef_search']]
+            else:
+                sweep = [(None, None)]
+
+            for param, value in sweep:
+                samples, recalls = [], []
+                for query, query_filters, expected in zip(queries, filters, truth):
+                    started = time.perf_counter()
+                    results = store.search(query, query_filters, top_k=top_k, **({param: value} if param else {}))
+                    samples.append(time.perf_counter() - started)
+                    found = {search_index_id for search_index_id, _ in results}
+                    recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+
+                samples_ms = np.array(samples) * 1000
+                self.stdout.write(
+                    f'{factory:<24}{f"{param}={value}" if param else "-":<16}{build_time:7.1f}s  '
+                    f'{np.percentile(samples_ms, 50):6.2f} ms  {np.percentile(samples_ms, 95):6.2f} ms  '
+                    f'{np.mean(recalls):.3f}'
+                )
+
+    @staticmethod
+    def _fill(store, ids, vectors, filter_rows):
+        for start in range(0, len(ids), 10000):
+            end = start + 10000
+            store._add_vectors(ids[start:end], vectors[start:end], filter_rows[start:end])
+
+    def _create_rows(self, size):
+        content_type = ContentType.objects.get_for_model(Benefit)
+        records = []
+        filter_rows = []
+        for i in range(size):
+            content_type_name = random.choice(['benefit', 'commercial'])
+            target_groups = random.sample(self.TARGET_GROUPS, random.randint(1, 3))
+            regions = random.sample(self.REGION_CODES, random.randint(1, 2))
+            records.append(SearchIndex(
+                content_type=content_type,
+                object_id=i + 1,
+                title=f'Benchmark {i}',
+                content_type_name=content_type_name,
+                target_groups=target_groups,
+                regions=regions,
+            ))
+            filter_rows.append((content_type_name, target_groups, regions))
+
+        created = SearchIndex.objects.bulk_create(records, batch_size=2000)
+        return [record.id for record in created], filter_rows
+
+    def _random_vectors(self, count, dimension):
+        vectors = self.rng.standard_normal((count, dimension), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def _clustered_vectors(self, count, dimension):
+        """Unit vectors grouped around topics, closer to real embeddings than uniform noise"""
+        centers = self._random_vectors(max(count // 200, 1), dimension)
+        vectors = centers[self.rng.integers(len(centers), size=count)]
+        vectors += self._random_vectors(count, dimension) * 0.7
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def _random_filters(self):
+        filters = {'content_type': [random.choice(['benefit', 'commercial'])]}
+        if random.random() < 0.7:
+            filters['target_groups'] = random.sample(self.TARGET_GROUPS, random.randint(1, 2))
+        if random.random() < 0.3:
+            filters['regions'] = [random.choice(self.REGION_CODES)]
+        if random.random() < 0.2:
+            # Narrow filter, e.g. one target group in one region
+            filters['target_groups'] = [random.choice(self.TARGET_GROUPS)]
+            filters['regions'] = [random.choice(self.REGION_CODES)]
+        return filters
+
+    @staticmethod
+    def _legacy_search(store, query, filters, top_k):
+        """The previous implementation: one SearchIndex query per FAISS candidate"""
+        distances, labels = store._index.search(query.reshape(1, -1), top_k * 3)
+        # FAISS labels are positions in the label table, mapped to SearchIndex ids as search() does
+        found = labels[0] >= 0
+        results = []
+        for distance, search_index_id in zip(distances[0][found], store._labels.ids(labels[0][found]).tolist()):
+            if search_index_id == -1:
+                continue
+            try:
+                record = SearchIndex.objects.get(id=search_index_id)
+            except SearchIndex.DoesNotExist:
+                continue
+            if (content_types := filters.get('content_type')) and record.content_type_name not in content_types:
+                continue
+            if (target_groups := filters.get('target_groups')) and not any(
+                    tg in record.target_groups for tg in target_groups):
+                continue
+            if (region_codes := filters.get('regions')) and not any(
+                    str(r) in record.regions for r in region_codes):
+                continue
+            results.append((record.id, float(distance)))
+            if len(results) >= top_k:
+                break
+        return results
@@ -0,0 +1,93 @@
+# search/management/commands/compact_index.py
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from benefits.models import Benefit, CommercialOffer
+from search.models import SearchIndex
+from search.vector_store import InMemoryVectorStore
+
+
+class Command(BaseCommand):
+    help = (
+        'Report and remove orphaned or duplicate search index entries. '
+        'Safe to run periodically (e.g. from cron).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report, change nothing')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        store = InMemoryVectorStore()
+
+        duplicate_rows = self._duplicate_rows()
+        orphan_rows = self._orphan_rows()
+        stale_rows = set(duplicate_rows) | set(orphan_rows)
+
+        # Compare what FAISS holds with what SearchIndex says should be searchable
+        indexed_ids = set(store.indexed_ids().tolist())
+        expected = set(SearchIndex.objects.filter(
+            is_active=True,
+            embedding_vector__isnull=False
+        ).values_list('id', flat=True)) - stale_rows
+        orphan_vectors = sorted(indexed_ids - expected)
+        missing_vectors = sorted(expected - indexed_ids)
+
+        self.stdout.write(f'Vectors in FAISS:            {len(indexed_ids)}')
+        self.stdout.write(f'Orphaned vectors:            {len(orphan_vectors)}')
+        self.stdout.write(f'Missing vectors:             {len(missing_vectors)}')
+        self.stdout.write(f'Duplicate SearchIndex rows:  {len(duplicate_rows)}')
+        self.stdout.write(f'Orphaned SearchIndex rows:   {len(orphan_rows)}')
+
+        self.stdout.write(f'Stale (replaced) vectors:    {store.stale_vectors()}')
+        self.stdout.write(f'Zero embeddings (skipped):   {len(store.zero_vector_ids())}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN - nothing changed'))
+            return
+
+        if stale_rows:
+            SearchIndex.objects.filter(id__in=stale_rows).delete()
+
+        store.remove_ids(orphan_vectors)
+        self._reindex(store, missing_vectors)
+        # Replaced/removed vectors are only hidden until now (HNSW/IVF indexes are rebuilt)
+        store.compact()
+        store.flush()
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Index compacted: {store.indexed_ids().size} vectors'))
+
+    def _duplicate_rows(self):
+        """SearchIndex rows for the same object except the newest one"""
+        newest = (
+            SearchIndex.objects.values('content_type', 'object_id')
+            .annotate(newest_id=Max('id'))
+            .values_list('newest_id', flat=True)
+        )
+        return list(SearchIndex.objects.exclude(id__in=newest).values_list('id', flat=True))
+
+    def _orphan_rows(self):
+        """SearchIndex rows whose Benefit or CommercialOffer no longer exists"""
+        orphans = []
+        for content_type_name, model in (('benefit', Benefit), ('commercial', CommercialOffer)):
+            existing = model.objects.values('id')
+            orphans.extend(
+                SearchIndex.objects.filter(content_type_name=content_type_name)
+                .exclude(object_id__in=existing)
+                .values_list('id', flat=True)
+            )
+        return orphans
+
+    def _reindex(self, store, search_index_ids):
+        if not search_index_ids:
+            return
+        ids, vectors, facet_rows = [], [], []
+        for record in SearchIndex.objects.filter(id__in=search_index_ids):
+            vector = record.get_embedding()
+            if vector is not None:
+                ids.append(record.id)
+                vectors.append(vector)
+                facet_rows.append((record.content_type_name, record.target_groups, record.regions))
+        if ids:
+            store.upsert_many(ids, np.array(vectors, dtype=np.float32), facet_rows)
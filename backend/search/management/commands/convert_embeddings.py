@@ -0,0 +1,62 @@
+# search/management/commands/convert_embeddings.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from search.models import SearchIndex, EMBEDDING_DTYPES, decode_embedding, encode_embedding
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert SearchIndex embeddings between float32/float16/int8 (and any JSON text '
+        'left over from before the search migrations). Safe to re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dtype', default=settings.SEARCH_EMBEDDING_DTYPE, choices=EMBEDDING_DTYPES)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only report, change nothing')
+
+    def handle(self, *args, **options):
+        dtype = options['dtype']
+        batch_size = options['batch_size']
+
+        if not self._has_dtype_column():
+            raise CommandError('search_index.embedding_dtype column is missing; run `manage.py migrate search` first')
+
+        ids = list(SearchIndex.objects.filter(embedding_vector__isnull=False).values_list('id', flat=True))
+        converted = 0
+        bytes_before = bytes_after = 0
+
+        for start in range(0, len(ids), batch_size):
+            rows = SearchIndex.objects.filter(id__in=ids[start:start + batch_size]).values_list(
+                'id', 'embedding_vector', 'embedding_dtype'
+            )
+            updates = []
+            for search_index_id, data, current_dtype in rows:
+                bytes_before += len(data)
+                if not isinstance(data, str) and current_dtype == dtype:
+                    bytes_after += len(data)
+                    continue
+                packed = encode_embedding(decode_embedding(data, current_dtype), dtype)
+                bytes_after += len(packed)
+                updates.append(SearchIndex(id=search_index_id, embedding_vector=packed, embedding_dtype=dtype))
+
+            converted += len(updates)
+            if updates and not options['dry_run']:
+                with transaction.atomic():
+                    SearchIndex.objects.bulk_update(updates, ['embedding_vector', 'embedding_dtype'])
+            self.stdout.write(f'  {min(start + batch_size, len(ids))}/{len(ids)} rows checked')
+
+        self.stdout.write(f'Rows converted to {dtype}: {converted}')
+        self.stdout.write(f'Embedding storage: {bytes_before / 1e6:.1f} MB -> {bytes_after / 1e6:.1f} MB')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN - nothing changed'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✓ Embeddings converted'))
+
+    @staticmethod
+    def _has_dtype_column():
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, SearchIndex._meta.db_table)
+        return any(column.name == 'embedding_dtype' for column in columns)
@@ -1,14 +1,22 @@
 import csv
+import hashlib
 import os
 import json
 from django.core.management.base import BaseCommand
 from django.db import connection, OperationalError, transaction
 from benefits.models import Benefit, Region, Category
+from search.services import services
+from search.signals import index_instances
 
 
 class Command(BaseCommand):
     help = 'Import benefits from CSV file into database with auto-indexing'
 
+    # Rows from an incremental crawl have a `change` column: 'added' and 'changed' rows are
+    # created or updated (and re-indexed), 'removed' rows are deleted. Those rows are matched
+    # by source URL, since a new crawl state numbers pages from 1 again. Without the column,
+    # rows are added and existing ids are skipped.
+
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='Path to CSV file')
         parser.add_argument('--clear', action='store_true', help='Clear existing CSV-imported benefits first')
@@ -56,20 +64,37 @@ class Command(BaseCommand):
 
         # Process CSV
         count = 0
+        updated = 0
+        removed = 0
         errors = 0
+        services.embedding_service.reset_cache_stats()
 
         with open(csv_path, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
             benefits_to_create = []
+            benefits_to_update = []
 
             for row in reader:
                 try:
                     benefit_id = f"sfr_{row['id']}"
-
-                    # Skip if exists
-                    if Benefit.objects.filter(benefit_id=benefit_id).exists():
-                        self.stdout.write(f"⚠️ Skipping existing: {benefit_id}")
-                        continue
+                    change = row.get('change')
+
+                    if change:
+                        existing = self._crawled_benefit(row['url'][:200])
+                        if change == 'removed':
+                            if existing is not None:
+                                existing.delete()  # post_delete removes it from the search index
+                                removed += 1
+                            continue
+                        if existing is None and Benefit.objects.filter(benefit_id=benefit_id).exists():
+                            # Page numbers of an earlier crawl state - key the new page on its URL
+                            benefit_id = self._url_benefit_id(row['url'])
+                    else:
+                        existing = None
+                        # Skip if exists
+                        if Benefit.objects.filter(benefit_id=benefit_id).exists():
+                            self.stdout.write(f"⚠️ Skipping existing: {benefit_id}")
+                            continue
 
                     # Get or create category from CSV if available
                     if 'category' in row and row['category']:
@@ -83,6 +108,17 @@ class Command(BaseCommand):
                     else:
                         category = default_category
 
+                    if existing is not None:
+                        existing.title = row['header'][:255]
+                        existing.description = row['text'][:4000]
+                        existing.source_url = row['url'][:200]
+                        benefits_to_update.append((existing, category))
+                        updated += 1
+                        if len(benefits_to_update) >= batch_size:
+                            self._update_batch(benefits_to_update)
+                            benefits_to_update = []
+                        continue
+
                     # Create benefit
                     benefit = Benefit(
                         benefit_id=benefit_id,
@@ -116,13 +152,21 @@ class Command(BaseCommand):
             # Create remaining
             if benefits_to_create:
                 self._create_batch(benefits_to_create, default_region)
+            if benefits_to_update:
+                self._update_batch(benefits_to_update)
+        services.vector_store.flush()
 
         # Summary
         if errors > 0:
             self.stdout.write(self.style.WARNING(f'\nCompleted with {errors} errors'))
 
         self.stdout.write(self.style.SUCCESS(f'\n✓ Imported {count} benefits'))
-        self.stdout.write(self.style.SUCCESS('✓ Embeddings will auto-generate via signals'))
+        if updated or removed:
+            self.stdout.write(self.style.SUCCESS(f'✓ Updated {updated}, removed {removed} benefits'))
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Embedding cache: {services.embedding_service.cache_hits} hits, '
+            f'{services.embedding_service.cache_misses} misses (API calls)'
+        ))
 
         # Show final counts
         benefit_count = Benefit.objects.filter(benefit_id__startswith='sfr_').count()
@@ -140,4 +184,31 @@ class Command(BaseCommand):
             benefit.regions.add(region)
             benefit.categories.add(category)
 
-        self.stdout.write(self.style.SUCCESS(f'✓ Created batch of {len(created_benefits)} benefits'))
\ No newline at end of file
+        # bulk_create skips post_save, so index the batch here (one batched embedding call)
+        index_instances([(benefit, 'benefit') for benefit in created_benefits])
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Created batch of {len(created_benefits)} benefits'))
+
+    def _update_batch(self, benefits_with_categories):
+        """Save changed benefits in bulk and re-index them"""
+        # A page listed twice in one batch is saved once, with its last row
+        benefits_with_categories = list({item[0].pk: item for item in benefits_with_categories}.values())
+        benefits = [item[0] for item in benefits_with_categories]
+        Benefit.objects.bulk_update(benefits, ['title', 'description', 'source_url'])
+
+        for benefit, category in benefits_with_categories:
+            benefit.categories.set([category])
+
+        # bulk_update skips post_save as well
+        index_instances([(benefit, 'benefit') for benefit in benefits])
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Updated batch of {len(benefits)} benefits'))
+
+    @staticmethod
+    def _crawled_benefit(url):
+        """CSV-imported benefit for a crawled page, whichever crawl state numbered it"""
+        return Benefit.objects.filter(benefit_id__startswith='sfr_', source_url=url).order_by('id').first()
+
+    @staticmethod
+    def _url_benefit_id(url):
+        return f"sfr_u{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}"
@@ -0,0 +1,41 @@
+# search/management/commands/process_indexing_queue.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.models import IndexingTask
+from search.signals import process_queue
+
+
+class Command(BaseCommand):
+    help = 'Index queued Benefit/CommercialOffer changes (run with --loop as the indexing worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=64,
+                            help='Queued objects per batched embedding pass')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty (with --loop)')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Give up on a task after this many failed batches')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_attempts = options['max_attempts']
+
+        while True:
+            indexed, removed, failed = process_queue(batch_size, max_attempts)
+            if indexed or removed or failed:
+                self.stdout.write(f'Indexed {indexed}, removed {removed}, failed {failed}')
+
+            # A full batch means the queue is probably not drained yet
+            if indexed + removed + failed >= batch_size and not failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        stuck = IndexingTask.objects.filter(attempts__gte=max_attempts).count()
+        if stuck:
+            self.stdout.write(self.style.WARNING(f'⚠️ {stuck} tasks exceeded {max_attempts} attempts'))
+        self.stdout.write(self.style.SUCCESS('✓ Indexing queue processed'))
@@ -1,12 +1,132 @@
 # search/management/commands/rebuild_index.py
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
 from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from benefits.models import Benefit, CommercialOffer
+from search.models import SearchIndex, encode_embedding
+from search.services import services
+from search.signals import index_instances
 from search.vector_store import InMemoryVectorStore
 
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
 
 class Command(BaseCommand):
     help = 'Rebuild vector search index'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--reembed', action='store_true',
+                            help='Regenerate embeddings for all active benefits and offers first')
+        parser.add_argument('--batch-size', type=int, default=256,
+                            help='Objects per batched embedding pass (with --reembed)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Rows streamed and added to FAISS per block')
+        parser.add_argument('--benchmark', type=int, metavar='N',
+                            help='Time a rebuild over N synthetic rows instead (nothing is kept)')
+
     def handle(self, *args, **options):
+        if options['benchmark']:
+            self._benchmark(options['benchmark'], options['chunk_size'])
+            return
+
         store = InMemoryVectorStore()
-        store._rebuild_index()
-        self.stdout.write(self.style.SUCCESS('✓ Index rebuilt!'))
\ No newline at end of file
+
+        if options['reembed']:
+            # The index on disk may hold another model's vectors; it is rebuilt below anyway
+            store.start_empty()
+            self._reembed(options['batch_size'])
+
+        store._rebuild_index(chunk_size=options['chunk_size'])
+        services.lexical_index.rebuild()
+        self.stdout.write(self.style.SUCCESS('✓ Index rebuilt!'))
+
+    def _reembed(self, batch_size):
+        services.embedding_service.reset_cache_stats()
+        failed = []
+        for model, content_type_name in ((Benefit, 'benefit'), (CommercialOffer, 'commercial')):
+            batch = []
+            for instance in model.objects.exclude(status='expired').prefetch_related('regions').iterator(
+                    chunk_size=batch_size):
+                batch.append((instance, content_type_name))
+                if len(batch) >= batch_size:
+                    failed.extend(index_instances(batch))
+                    batch = []
+            failed.extend(index_instances(batch))
+
+        if failed:
+            # Their rows still hold vectors of the previous model - keep those out of the rebuilt index
+            for model in (Benefit, CommercialOffer):
+                object_ids = [instance.id for instance, _ in failed if isinstance(instance, model)]
+                SearchIndex.objects.filter(
+                    content_type=ContentType.objects.get_for_model(model), object_id__in=object_ids
+                ).update(embedding_vector=None)
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ {len(failed)} objects could not be embedded and are left out of the vector index - '
+                f'run --reembed again to retry them'
+            ))
+
+        self.stdout.write(
+            f'Embedding cache: {services.embedding_service.cache_hits} hits, '
+            f'{services.embedding_service.cache_misses} misses (API calls)'
+        )
+
+    def _benchmark(self, size, chunk_size):
+        with transaction.atomic():
+            self.stdout.write(f'Creating {size} synthetic SearchIndex rows...')
+            self._create_rows(size, chunk_size)
+
+            store = InMemoryVectorStore.detached()
+            peak_rss_before = self._peak_rss_mb()
+            tracemalloc.start()
+            started = time.perf_counter()
+            store._rebuild_index(chunk_size=chunk_size)
+            elapsed = time.perf_counter() - started
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak_rss_after = self._peak_rss_mb()
+
+            # Synthetic SearchIndex rows are never committed
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Rebuilt {store._index.ntotal} vectors in {elapsed:.2f}s '
+                          f'({store._index.ntotal / elapsed:.0f} rows/s)')
+        self.stdout.write(f'Peak Python/numpy allocations during rebuild: {traced_peak / 2 ** 20:.1f} MB')
+        if peak_rss_after is not None:
+            self.stdout.write(f'Peak process RSS: {peak_rss_after:.1f} MB '
+                              f'(+{peak_rss_after - peak_rss_before:.1f} MB during rebuild, '
+                              f'index itself {store._index.ntotal * store._index.d * 4 / 2 ** 20:.1f} MB)')
+
+    @staticmethod
+    def _create_rows(size, chunk_size):
+        content_type = ContentType.objects.get_for_model(Benefit)
+        rng = np.random.default_rng(42)
+        for start in range(0, size, chunk_size):
+            vectors = rng.standard_normal((min(chunk_size, size - start), 1024), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            SearchIndex.objects.bulk_create([
+                SearchIndex(
+                    content_type=content_type,
+                    object_id=start + i + 1,
+                    title=f'Benchmark {start + i}',
+                    content_type_name='benefit',
+                    target_groups=['pensioner'],
+                    regions=['all'],
+                    embedding_vector=encode_embedding(vector),
+                )
+                for i, vector in enumerate(vectors)
+            ], batch_size=1000)
+
+    @staticmethod
+    def _peak_rss_mb():
+        if resource is None:
+            return None
+        # ru_maxrss is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('embedding_vector', models.TextField(blank=True, null=True)),
+                ('title', models.CharField(max_length=500)),
+                ('content_type_name', models.CharField(max_length=20)),
+                ('target_groups', models.JSONField(default=list)),
+                ('regions', models.JSONField(default=list)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'db_table': 'search_index',
+                'indexes': [models.Index(fields=['content_type', 'object_id'], name='search_inde_content_210845_idx'), models.Index(fields=['content_type_name', 'is_active'], name='search_inde_content_63506e_idx')],
+            },
+        ),
+    ]
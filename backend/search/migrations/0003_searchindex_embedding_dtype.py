@@ -0,0 +1,40 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:10
+
+from django.db import migrations, models
+
+
+def pack_json_embeddings(apps, schema_editor):
+    """Convert embeddings still stored as JSON text into packed float32 bytes"""
+    from search.models import decode_embedding, encode_embedding
+
+    SearchIndex = apps.get_model('search', 'SearchIndex')
+    ids = list(SearchIndex.objects.filter(embedding_vector__isnull=False).values_list('id', flat=True))
+    for start in range(0, len(ids), 500):
+        rows = SearchIndex.objects.filter(id__in=ids[start:start + 500]).values_list('id', 'embedding_vector')
+        updates = [
+            SearchIndex(id=search_index_id, embedding_vector=encode_embedding(decode_embedding(data)),
+                        embedding_dtype='float32')
+            for search_index_id, data in rows if isinstance(data, str)
+        ]
+        SearchIndex.objects.bulk_update(updates, ['embedding_vector', 'embedding_dtype'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_embeddingcache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindex',
+            name='embedding_dtype',
+            field=models.CharField(default='float32', max_length=8),
+        ),
+        migrations.AlterField(
+            model_name='searchindex',
+            name='embedding_vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_json_embeddings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-17 09:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('search', '0003_searchindex_embedding_dtype'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexingTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('content_type_name', models.CharField(max_length=20)),
+                ('action', models.CharField(choices=[('index', 'Index'), ('remove', 'Remove')], max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('enqueued_at', models.DateTimeField(auto_now=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'db_table': 'search_indexing_queue',
+                'ordering': ['enqueued_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='indexingtask',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='unique_indexing_task'),
+        ),
+    ]
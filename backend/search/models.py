@@ -1,7 +1,48 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 import json
+import numpy as np
+
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+
+def encode_embedding(vector, dtype: str = 'float32') -> bytes:
+    """
+    Pack an embedding into bytes: raw float32 (4 KB for 1024 dims), float16 (2 KB),
+    or int8 (1 KB plus a float32 scale in front).
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if dtype == 'float32':
+        return vector.tobytes()
+    if dtype == 'float16':
+        return vector.astype(np.float16).tobytes()
+    if dtype == 'int8':
+        scale = np.float32(np.abs(vector).max() / 127) if vector.size else np.float32(0)
+        codes = np.round(vector / scale) if scale else np.zeros_like(vector)
+        return scale.tobytes() + codes.astype(np.int8).tobytes()
+    raise ValueError(f"Unknown embedding dtype: {dtype}")
+
+
+def decode_embedding(data, dtype: str = 'float32') -> np.ndarray:
+    """Unpack encode_embedding() bytes into float32 (zero-copy for float32). Legacy JSON text is accepted too."""
+    if isinstance(data, str):
+        return np.array(json.loads(data), dtype=np.float32)
+    if dtype == 'float32':
+        return np.frombuffer(data, dtype=np.float32)
+    if dtype == 'float16':
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+    if dtype == 'int8':
+        scale = np.frombuffer(data, dtype=np.float32, count=1)[0]
+        return np.frombuffer(data, dtype=np.int8, offset=4).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding dtype: {dtype}")
+
+
+def is_missing_table(error) -> bool:
+    """True if a database error only means a table hasn't been created yet (before migrate)"""
+    message = str(error).lower()
+    return 'no such table' in message or ('relation' in message and 'does not exist' in message)
 
 
 class SearchIndex(models.Model):
@@ -13,8 +54,9 @@ class SearchIndex(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
-    # Store embedding as JSON in SQLite
-    embedding_vector = models.TextField(null=True, blank=True)  # JSON serialized
+    # Store embedding as packed bytes (see encode_embedding); older rows may still hold JSON text
+    embedding_vector = models.BinaryField(null=True, blank=True)
+    embedding_dtype = models.CharField(max_length=8, default='float32')
 
     # Denormalized fields for fast filtering
     title = models.CharField(max_length=500)
@@ -32,11 +74,51 @@ class SearchIndex(models.Model):
         ]
 
     def get_embedding(self):
-        """Deserialize embedding vector"""
+        """Deserialize embedding vector as a float32 numpy array"""
         if self.embedding_vector:
-            return json.loads(self.embedding_vector)
+            return decode_embedding(self.embedding_vector, self.embedding_dtype)
         return None
 
-    def set_embedding(self, vector):
-        """Serialize embedding vector"""
-        self.embedding_vector = json.dumps(vector)
\ No newline at end of file
+    def set_embedding(self, vector, dtype: str = None):
+        """Serialize embedding vector (dtype defaults to SEARCH_EMBEDDING_DTYPE)"""
+        self.embedding_dtype = dtype or settings.SEARCH_EMBEDDING_DTYPE
+        self.embedding_vector = encode_embedding(vector, self.embedding_dtype)
+
+
+class EmbeddingCache(models.Model):
+    """
+    Embeddings keyed by a hash of the exact input text and the model name,
+    so unchanged documents never hit the embedding API again.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)  # sha256 hex of model + text
+    model = models.CharField(max_length=50)
+    vector = models.BinaryField()  # raw float32 bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'search_embedding_cache'
+
+
+class IndexingTask(models.Model):
+    """
+    Pending search index change for one Benefit/CommercialOffer.
+    Repeated saves of the same object coalesce into a single row.
+    """
+    ACTION_CHOICES = [
+        ('index', 'Index'),
+        ('remove', 'Remove'),
+    ]
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_type_name = models.CharField(max_length=20)  # 'benefit' or 'commercial'
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    attempts = models.IntegerField(default=0)
+    enqueued_at = models.DateTimeField(auto_now=True)  # Bumped on every coalesced save
+
+    class Meta:
+        db_table = 'search_indexing_queue'
+        ordering = ['enqueued_at']
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_indexing_task'),
+        ]
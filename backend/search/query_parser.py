@@ -1,29 +1,89 @@
 import os
+import re
+import copy
 import json
+from django.conf import settings
+from django.db import OperationalError
 from mistralai import Mistral
-from benefits.models import Benefit
+from benefits.models import Benefit, Region
+from .caching import LRUCache, normalize_query
+from .lexical_index import STOPWORDS, stem
 
 # API key
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 
+_WORD_RE = re.compile(r'\w+')
+
+# Word prefixes that name a beneficiary category on their own
+GROUP_PREFIXES = {
+    'pensioner': ('пенсионер', 'пенсионн', 'пожил'),
+    'large_family': ('многодет',),
+    'veteran': ('ветеран',),
+    'low_income': ('малоимущ', 'малообеспеч'),
+}
+DISABILITY_GROUPS = {
+    '1': 'disability_1', 'i': 'disability_1', 'перв': 'disability_1',
+    '2': 'disability_2', 'ii': 'disability_2', 'втор': 'disability_2',
+    '3': 'disability_3', 'iii': 'disability_3', 'трет': 'disability_3',
+}
+FAMILY_PREFIXES = ('семь', 'семе', 'жен', 'вдов', 'дет', 'родител', 'супруг', 'мат', 'отц', 'сын', 'доч')
+COMMERCIAL_PREFIXES = ('скидк', 'акци', 'промокод', 'кэшбэк', 'кешбэк', 'партнер', 'магазин', 'аптек')
+BENEFIT_PREFIXES = ('льгот', 'пособи', 'выплат', 'компенсац', 'субсиди', 'вычет', 'мер поддержк')
+NEGATIONS = {'не', 'кроме', 'без', 'исключая', 'помимо'}
+REGION_ALIASES = {'мск': '77', 'спб': '78', 'питер': '78'}
+
+
+def _same_stem(a: str, b: str) -> bool:
+    """Stems of one word in different cases ("якути"/"якут", "област"/"облас")"""
+    return a == b or (min(len(a), len(b)) >= 4 and (a.startswith(b) or b.startswith(a)))
+
+
 class QueryParser:
     """
     Parses natural language queries into structured search filters using Mistral LLM.
+    Queries that the local rules resolve unambiguously (a beneficiary category or region
+    is plainly named) skip the LLM; parsed results are cached per normalized query.
     """
 
-    def __init__(self):
-        self.client = Mistral(api_key=MISTRAL_API_KEY)
+    def __init__(self, client=None):
+        self.client = client or Mistral(api_key=MISTRAL_API_KEY)
         
         # Extract beneficiary categories for the prompt
         self.beneficiary_map = {label.lower(): code for code, label in Benefit.BENEFICIARY_CATEGORIES}
         self.beneficiary_desc = ", ".join([f"'{label}' ({code})" for code, label in Benefit.BENEFICIARY_CATEGORIES])
 
+        self.cache = LRUCache(settings.QUERY_PARSE_CACHE_SIZE, settings.QUERY_PARSE_CACHE_TTL)
+        self.rule_parses = 0
+        self.llm_parses = 0
+        self.llm_failures = 0
+        self._regions = None  # [(stemmed name words, code)], loaded on first use
+
     def parse(self, query: str, user_region: str = None) -> dict:
         """
-        Parses the query using Mistral LLM to extract intent, keywords, and filters.
+        Parses the query into intent, keywords and filters: from the cache, from the local
+        rules when they are confident, otherwise with the LLM.
         """
-        try:
-            system_prompt = f"""You are a search query parser for a Russian social benefits portal.
+        key = normalize_query(query)
+        parsed = self.cache.get(key)
+        if parsed is None:
+            parsed, confident = self._rule_parse(query)
+            if confident:
+                self.rule_parses += 1
+            else:
+                try:
+                    parsed = self._llm_parse(query)
+                    self.llm_parses += 1
+                except Exception as e:
+                    print(f"Error parsing query with LLM: {e}")
+                    self.llm_failures += 1
+                    # Fallback to rule-based parsing; not cached, so the LLM is tried again next time
+                    return parsed
+            self.cache.set(key, parsed)
+        return copy.deepcopy(parsed)
+
+    def _llm_parse(self, query: str) -> dict:
+        """Parses the query using Mistral LLM to extract intent, keywords, and filters"""
+        system_prompt = f"""You are a search query parser for a Russian social benefits portal.
 Your goal is to extract structured data from the user's search query.
 
 VALID BENEFICIARY CATEGORIES (target_groups):
@@ -53,59 +113,138 @@ Return ONLY a valid JSON object. Do not include markdown formatting or explanati
     }}
 }}
 """
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": query}
-            ]
-
-            response = self.client.chat.complete(
-                model="open-mistral-nemo",
-                messages=messages,
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
-
-            content = response.choices[0].message.content
-            parsed_data = json.loads(content)
-            
-            # Ensure required fields exist
-            if 'filters' not in parsed_data:
-                parsed_data['filters'] = {}
-            
-            # Add user region if not present and relevant
-            if user_region and not parsed_data['filters'].get('regions'):
-                # We don't automatically add user region to search filters unless we want strict filtering
-                # But for now, let's leave it to the search engine to boost local results
-                pass
-
-            return parsed_data
-
-        except Exception as e:
-            print(f"Error parsing query with LLM: {e}")
-            # Fallback to simple keyword parsing
-            return self._fallback_parse(query)
-
-    def _fallback_parse(self, query: str) -> dict:
-        """Simple fallback parsing if LLM fails"""
-        keywords = query.lower().split()
-        filters = {
-            'content_type': ['benefit', 'commercial'],
-            'target_groups': [],
-            'regions': []
-        }
         
-        # Simple keyword matching for categories
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": query}
+        ]
+
+        response = self.client.chat.complete(
+            model="open-mistral-nemo",
+            messages=messages,
+            temperature=0.1,
+            response_format={"type": "json_object"},
+            timeout_ms=int(settings.SEARCH_API_TIMEOUT * 1000)
+        )
+
+        content = response.choices[0].message.content
+        parsed_data = json.loads(content)
+
+        # Ensure required fields exist
+        filters = parsed_data.setdefault('filters', {})
+
+        # Keep only known category codes; region names become the region codes the index uses
+        valid_groups = set(self.beneficiary_map.values())
+        filters['target_groups'] = [g for g in filters.get('target_groups') or [] if g in valid_groups]
+        filters['regions'] = self._region_codes(filters.get('regions') or [])
+
+        return parsed_data
+
+    def parse_rules(self, query: str) -> dict:
+        """Keyword-rule parse only, never calls the LLM (for callers that can't wait for it)"""
+        return self._rule_parse(query)[0]
+
+    def _rule_parse(self, query: str) -> tuple:
+        """
+        Keyword-rule parse. Returns (parsed, confident): confident when a category or region
+        was found and nothing in the query (negation, mixed SVO wording) needs the LLM.
+        """
+        words = _WORD_RE.findall(query.lower().replace('ё', 'е'))
+        text = ' '.join(words)
+        ambiguous = any(word in NEGATIONS for word in words)
+
+        target_groups = []
         for code, label in Benefit.BENEFICIARY_CATEGORIES:
             if label.lower() in query.lower() or code in query.lower():
-                filters['target_groups'].append(code)
-                
-        # Handle generic "disabled" term
-        if 'инвалид' in query.lower() and not filters['target_groups']:
-             filters['target_groups'].extend(['disability_1', 'disability_2', 'disability_3'])
-
-        return {
-            'intent': 'mixed',
-            'keywords': keywords[:10],
-            'filters': filters
-        }
\ No newline at end of file
+                target_groups.append(code)
+        for code, prefixes in GROUP_PREFIXES.items():
+            if any(word.startswith(prefixes) for word in words):
+                target_groups.append(code)
+
+        # Disability: the group number sits next to "группа" ("1 группы", "группа II", "первой группы")
+        if any(word.startswith('инвалид') for word in words):
+            groups = [
+                DISABILITY_GROUPS[number]
+                for i, word in enumerate(words) if word.startswith('групп')
+                for near in words[max(i - 2, 0):i] + words[i + 1:i + 2]
+                for number in DISABILITY_GROUPS if near == number or (len(number) > 3 and near.startswith(number))
+            ]
+            target_groups.extend(groups or ['disability_1', 'disability_2', 'disability_3'])
+
+        if 'сво' in words or any(word.startswith('мобилизов') for word in words):
+            family = any(word.startswith(FAMILY_PREFIXES) for word in words)
+            participant = any(word.startswith('участник') for word in words)
+            ambiguous = ambiguous or (family and participant)
+            target_groups.append('svo_family' if family else 'svo_participant')
+
+        regions = self._find_regions(words)
+
+        commercial = any(word.startswith(COMMERCIAL_PREFIXES) for word in words)
+        benefit = any(f' {prefix}' in f' {text}' for prefix in BENEFIT_PREFIXES)
+        if commercial and not benefit:
+            intent, content_type = 'find_commercial', ['commercial']
+        elif benefit and not commercial:
+            intent, content_type = 'find_benefits', ['benefit']
+        else:
+            intent, content_type = 'mixed', ['benefit', 'commercial']
+
+        parsed = {
+            'intent': intent,
+            'keywords': [word for word in words if word not in STOPWORDS][:10],
+            'filters': {
+                'content_type': content_type,
+                'target_groups': list(dict.fromkeys(target_groups)),
+                'regions': regions,
+            }
+        }
+        confident = bool(target_groups or regions) and not ambiguous
+        return parsed, confident
+
+    def warm_up(self):
+        """Load the region names before the first query needs them"""
+        self._region_index()
+
+    def _region_index(self) -> list:
+        """[(stemmed name words, code)] for every Region, plus the part in brackets as an alias"""
+        if self._regions is None:
+            try:
+                regions = list(Region.objects.values_list('name', 'code'))
+            except OperationalError:
+                return []  # Table not created yet
+            index = []
+            for name, code in regions:
+                for variant in re.split(r'[()]', name):
+                    words = tuple(stem(word) for word in _WORD_RE.findall(variant))
+                    if words:
+                        index.append((words, code))
+            self._regions = index
+        return self._regions
+
+    def _find_regions(self, words: list) -> list:
+        """Region codes named in the query words, plus 'all' (benefits valid in every region)"""
+        stems = [stem(word) for word in words]
+        codes = [REGION_ALIASES[word] for word in words if word in REGION_ALIASES]
+        for name_stems, code in self._region_index():
+            size = len(name_stems)
+            if any(all(map(_same_stem, stems[i:i + size], name_stems)) for i in range(len(stems) - size + 1)):
+                codes.append(code)
+        codes = list(dict.fromkeys(codes))
+        return codes + ['all'] if codes else []
+
+    def _region_codes(self, regions: list) -> list:
+        """Map region names (or codes) from the LLM to region codes; unknown names are dropped"""
+        known = {code for _, code in self._region_index()}
+        codes = []
+        for region in regions:
+            region = str(region)
+            if region in known:
+                codes.append(region)
+            else:
+                codes.extend(code for code in self._find_regions(_WORD_RE.findall(region.lower())) if code != 'all')
+        codes = list(dict.fromkeys(codes))
+        return codes + ['all'] if codes else []
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        stats.update(rule_parses=self.rule_parses, llm_parses=self.llm_parses, llm_failures=self.llm_failures)
+        return stats
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+
+
+class ServiceRegistry:
+    """
+    Process-wide search services, each created on first use (`services.vector_store`).
+    Factories import their modules lazily, so management commands and `manage.py check`
+    don't load mistralai/faiss or need MISTRAL_API_KEY unless they use a service.
+    """
+
+    def __init__(self):
+        self._factories = {}  # name -> (factory, warm)
+        self._instances = {}
+        self._lock = threading.RLock()  # Factories may use other services
+
+    def register(self, name: str, factory, warm=None):
+        """Register a zero-argument factory; warm(instance) does the expensive loading on warm_up()"""
+        self._factories[name] = (factory, warm)
+
+    def get(self, name: str):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    factory, _ = self._factories[name]
+                    instance = self._instances[name] = factory()
+        return instance
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._factories:
+            raise AttributeError(name)
+        return self.get(name)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def warm_up(self, names) -> dict:
+        """Create and warm the named services now. Returns {name: seconds}"""
+        timings = {}
+        for name in names:
+            started = time.perf_counter()
+            try:
+                instance = self.get(name)
+                _, warm = self._factories[name]
+                if warm is not None:
+                    warm(instance)
+            except Exception as e:
+                print(f"⚠️ Warm-up of {name} failed: {e}")
+                continue
+            timings[name] = time.perf_counter() - started
+        return timings
+
+    def warm_up_in_background(self, names):
+        """Warm up without delaying startup; requests that arrive first wait for the service they need"""
+        thread = threading.Thread(target=self.warm_up, args=(list(names),), name='search-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+
+def _mistral_client():
+    from mistralai import Mistral
+    return Mistral(api_key=os.getenv('MISTRAL_API_KEY'))
+
+
+def _embedding_service():
+    from django.conf import settings
+    from .embedding_service import EMBEDDING_BACKENDS, MistralEmbeddingService
+    backend = EMBEDDING_BACKENDS[settings.EMBEDDING_BACKEND]
+    if backend is MistralEmbeddingService:
+        return backend(client=services.mistral_client)
+    return backend()
+
+
+def _vector_store():
+    from .vector_store import InMemoryVectorStore
+    return InMemoryVectorStore()
+
+
+def _lexical_index():
+    from .lexical_index import LexicalIndex
+    return LexicalIndex()
+
+
+def _query_parser():
+    from .query_parser import QueryParser
+    return QueryParser(client=services.mistral_client)
+
+
+services = ServiceRegistry()
+services.register('mistral_client', _mistral_client)
+services.register('embedding_service', _embedding_service)
+services.register('vector_store', _vector_store, warm=lambda store: store.ensure_initialized())
+services.register('lexical_index', _lexical_index, warm=lambda index: index.warm_up())
+services.register('query_parser', _query_parser, warm=lambda parser: parser.warm_up())
@@ -1,82 +1,296 @@
+from django.db.models import F
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
-from django.db import OperationalError
-import json  # Add this
+from django.db import OperationalError, transaction
+from django.conf import settings
+import threading
+from contextlib import contextmanager
+import numpy as np
 from benefits.models import Benefit, CommercialOffer
-from .models import SearchIndex
-from .embedding_service import MistralEmbeddingService
-from .vector_store import InMemoryVectorStore
+from .models import SearchIndex, IndexingTask, encode_embedding, is_missing_table
+from .lexical_index import document_text
+from .services import services
 
-# Global singletons
-embedding_service = MistralEmbeddingService()
-vector_store = InMemoryVectorStore()
+# Per-thread buffer used by bulk_indexing()
+_bulk = threading.local()
+
+
+# Fields that feed the embedding text or the search filters. Saves that touch
+# none of them (e.g. views_count on every page view) leave the index alone.
+INDEXED_FIELDS = {
+    'benefit': {'title', 'description', 'requirements', 'target_groups', 'status', 'applies_to_all_regions'},
+    'commercial': {'title', 'description', 'partner_name', 'discount_description', 'target_groups', 'status',
+                   'applies_to_all_regions'},
+}
+
+
+def affects_search_index(update_fields, content_type_name):
+    return update_fields is None or bool(set(update_fields) & INDEXED_FIELDS[content_type_name])
 
 
 def create_or_update_search_index(instance, content_type_name):
     """Create/update SearchIndex - now with error handling"""
     try:
-        content_type = ContentType.objects.get_for_model(instance.__class__)
-
-        # Get regions as codes
-        regions = [r.code for r in instance.regions.all()[:5]]  # Limit to 5 regions for speed
-        if not regions and instance.applies_to_all_regions:
-            regions = ['all']
-        # Generate embedding
-        if content_type_name == 'benefit':
-            embedding = embedding_service.generate_for_benefit(instance)
-        else:
-            embedding = embedding_service.generate_for_offer(instance)
-
-        # Create/update SearchIndex
-        search_index, created = SearchIndex.objects.update_or_create(
-            content_type=content_type,
-            object_id=instance.id,
-            defaults={
-                'title': instance.title,
-                'content_type_name': content_type_name,
-                'target_groups': instance.target_groups,
-                'regions': regions,
-                'is_active': instance.status in ['active', 'expiring_soon'],
-                'embedding_vector': json.dumps(embedding)
-            }
-        )
-
-        # Add to FAISS index
-        vector_store.add_item(search_index.id, embedding)
-
-    except OperationalError:
+        if index_instances([(instance, content_type_name)]):
+            print(f"Embedding failed for {content_type_name} {instance.id}, not indexed")
+    except OperationalError as e:
+        if not is_missing_table(e):
+            raise  # e.g. a missing column: the search migrations haven't been applied
         # Table doesn't exist yet - silently skip (will be indexed after migrations)
         print(f"SearchIndex table not ready for {content_type_name} {instance.id}")
-        pass
     except Exception as e:
         print(f"Error indexing {content_type_name}: {e}")
 
 
+def index_instances(items):
+    """
+    Create/update SearchIndex rows and FAISS vectors for [(instance, content_type_name), ...].
+    Embeddings for all items are requested in batches. Returns the items whose embedding
+    failed (zero vector); they are left as they were so a retry can index them.
+    """
+    if not items:
+        return []
+
+    texts = [
+        services.embedding_service.text_for_benefit(instance) if content_type_name == 'benefit'
+        else services.embedding_service.text_for_offer(instance)
+        for instance, content_type_name in items
+    ]
+    embeddings = services.embedding_service.generate_batch_cached(texts)
+
+    upsert_ids, upsert_vectors, facet_rows, inactive_ids, failed = [], [], [], [], []
+    lexical_rows = []
+    for (instance, content_type_name), embedding in zip(items, embeddings):
+        if not any(embedding):
+            failed.append((instance, content_type_name))
+            continue
+        search_index = save_search_index(instance, content_type_name, embedding)
+        if search_index is None:
+            continue
+        if search_index.is_active:
+            upsert_ids.append(search_index.id)
+            upsert_vectors.append(embedding)
+            lexical_rows.append((search_index.id, *document_text(instance, content_type_name)))
+            facet_rows.append((search_index.content_type_name, search_index.target_groups, search_index.regions))
+        else:
+            inactive_ids.append(search_index.id)
+
+    # Replace the vectors for these SearchIndex ids (never appends duplicates)
+    if upsert_ids:
+        services.vector_store.upsert_many(upsert_ids, np.array(upsert_vectors, dtype=np.float32), facet_rows)
+    services.vector_store.remove_ids(inactive_ids)
+    services.lexical_index.upsert_many(lexical_rows)
+    services.lexical_index.remove_ids(inactive_ids)
+    return failed
+
+
+def save_search_index(instance, content_type_name, embedding):
+    """Write the SearchIndex row for an object; returns None if nothing changed"""
+    content_type = ContentType.objects.get_for_model(instance.__class__)
+
+    # Get regions as codes
+    regions = [r.code for r in instance.regions.all()[:5]]  # Limit to 5 regions for speed
+    if not regions and instance.applies_to_all_regions:
+        regions = ['all']
+
+    defaults = {
+        'title': instance.title,
+        'content_type_name': content_type_name,
+        'target_groups': instance.target_groups,
+        'regions': regions,
+        'is_active': instance.status in ['active', 'expiring_soon'],
+        'embedding_vector': encode_embedding(embedding, settings.SEARCH_EMBEDDING_DTYPE),
+        'embedding_dtype': settings.SEARCH_EMBEDDING_DTYPE,
+    }
+
+    # Nothing to do if the indexed row would not change
+    existing = SearchIndex.objects.filter(content_type=content_type, object_id=instance.id).first()
+    if existing and all(getattr(existing, field) == value for field, value in defaults.items()):
+        return None
+
+    # Create/update SearchIndex
+    search_index, created = SearchIndex.objects.update_or_create(
+        content_type=content_type,
+        object_id=instance.id,
+        defaults=defaults
+    )
+    return search_index
+
+
+@contextmanager
+def bulk_indexing(flush_size=256):
+    """
+    Defer signal-driven indexing inside the block and index the collected objects
+    with batched embedding calls (every `flush_size` objects and on exit).
+    """
+    if getattr(_bulk, 'pending', None) is not None:
+        yield  # Already inside a bulk block
+        return
+
+    _bulk.pending = {}
+    _bulk.flush_size = flush_size
+    try:
+        yield
+    finally:
+        _flush_bulk()
+        _bulk.pending = None
+        services.vector_store.flush()
+
+
+def _flush_bulk():
+    pending, _bulk.pending = _bulk.pending, {}
+    if pending:
+        try:
+            if failed := index_instances(list(pending.values())):
+                print(f"Embedding failed for {len(failed)} objects, not indexed")
+        except OperationalError as e:
+            if not is_missing_table(e):
+                raise
+            print(f"SearchIndex table not ready, skipped indexing {len(pending)} objects")
+        except Exception as e:
+            print(f"Error indexing {len(pending)} objects: {e}")
+
+
+def _queue_mode():
+    return getattr(settings, 'SEARCH_INDEXING_MODE', 'sync') == 'queue'
+
+
+def enqueue(instance, content_type_name, action):
+    """
+    Record a pending index change for an object. A single upsert query, so saves return
+    immediately; repeated saves of the same object overwrite one IndexingTask row.
+    """
+    task = IndexingTask(
+        content_type=ContentType.objects.get_for_model(instance.__class__),
+        object_id=instance.id,
+        content_type_name=content_type_name,
+        action=action,
+    )
+    # No fallback: a missing queue table must fail the save, not drop the change silently
+    IndexingTask.objects.bulk_create(
+        [task],
+        update_conflicts=True,
+        unique_fields=['content_type', 'object_id'],
+        update_fields=['content_type_name', 'action', 'attempts', 'enqueued_at'],
+    )
+
+
+def process_queue(batch_size=64, max_attempts=5):
+    """
+    Apply up to `batch_size` queued index changes: one batched embedding pass for the
+    objects to index and one grouped write for the removals. Returns (indexed, removed, failed).
+    """
+    tasks = list(IndexingTask.objects.filter(attempts__lt=max_attempts)[:batch_size])
+    if not tasks:
+        return 0, 0, 0
+
+    models_by_name = {'benefit': Benefit, 'commercial': CommercialOffer}
+    to_index, to_remove = [], []
+    for content_type_name, model in models_by_name.items():
+        wanted = {task.object_id: task for task in tasks
+                  if task.content_type_name == content_type_name and task.action == 'index'}
+        instances = model.objects.filter(id__in=wanted).prefetch_related('regions') if wanted else []
+        found = set()
+        for instance in instances:
+            found.add(instance.id)
+            if instance.status != 'expired':
+                to_index.append((instance, content_type_name))
+            else:
+                to_remove.append(wanted[instance.id])
+        # Deleted since it was queued
+        to_remove.extend(task for object_id, task in wanted.items() if object_id not in found)
+    to_remove.extend(task for task in tasks if task.action == 'remove')
+
+    try:
+        failed = index_instances(to_index)
+        remove_many_from_search_index([(task.content_type_id, task.object_id) for task in to_remove])
+    except Exception as e:
+        print(f"Error processing {len(tasks)} indexing tasks: {e}")
+        IndexingTask.objects.filter(id__in=[task.id for task in tasks]).update(attempts=F('attempts') + 1)
+        return 0, 0, len(tasks)
+
+    services.vector_store.flush()
+
+    # Failed embeddings stay queued for another attempt
+    failed_keys = {(content_type_name, instance.id) for instance, content_type_name in failed}
+    failed_tasks = [task for task in tasks if (task.content_type_name, task.object_id) in failed_keys
+                    and task.action == 'index']
+    IndexingTask.objects.filter(id__in=[task.id for task in failed_tasks]).update(attempts=F('attempts') + 1)
+
+    # Tasks re-enqueued while we worked have a newer timestamp and stay queued
+    with transaction.atomic():
+        for task in tasks:
+            if task not in failed_tasks:
+                IndexingTask.objects.filter(id=task.id, enqueued_at=task.enqueued_at).delete()
+    return len(to_index) - len(failed), len(to_remove), len(failed)
+
+
+def _index_or_defer(instance, content_type_name):
+    pending = getattr(_bulk, 'pending', None)
+    if pending is None:
+        if _queue_mode():
+            enqueue(instance, content_type_name, 'index')
+        else:
+            create_or_update_search_index(instance, content_type_name)
+        return
+
+    # Repeated saves of one object inside the block are indexed once
+    pending[(content_type_name, instance.id)] = (instance, content_type_name)
+    if len(pending) >= _bulk.flush_size:
+        _flush_bulk()
+
+
+def _remove_or_defer(instance, content_type_name):
+    pending = getattr(_bulk, 'pending', None)
+    if pending is None and _queue_mode():
+        enqueue(instance, content_type_name, 'remove')
+        return
+
+    if pending is not None:
+        pending.pop((content_type_name, instance.id), None)
+    remove_from_search_index(instance.__class__, instance.id)
+
+
+def remove_many_from_search_index(keys):
+    """Delete SearchIndex rows for [(content_type_id, object_id), ...] and drop their vectors in one write"""
+    search_index_ids = []
+    for content_type_id in {content_type_id for content_type_id, _ in keys}:
+        object_ids = [object_id for ct_id, object_id in keys if ct_id == content_type_id]
+        for start in range(0, len(object_ids), 500):
+            search_records = SearchIndex.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=object_ids[start:start + 500]
+            )
+            search_index_ids.extend(search_records.values_list('id', flat=True))
+            search_records.delete()
+    services.vector_store.remove_ids(search_index_ids)
+    services.lexical_index.remove_ids(search_index_ids)
+
+
+def remove_from_search_index(model, object_id):
+    """Delete SearchIndex rows for an object and drop it from the vector and lexical indexes"""
+    remove_many_from_search_index([(ContentType.objects.get_for_model(model).id, object_id)])
+
+
 @receiver(post_save, sender=Benefit)
-def handle_benefit_save(sender, instance, created, **kwargs):
+def handle_benefit_save(sender, instance, created, update_fields=None, **kwargs):
+    if not affects_search_index(update_fields, 'benefit'):
+        return
     if instance.status != 'expired':
-        create_or_update_search_index(instance, 'benefit')
+        _index_or_defer(instance, 'benefit')
     else:
-        content_type = ContentType.objects.get_for_model(Benefit)
-        SearchIndex.objects.filter(
-            content_type=content_type,
-            object_id=instance.id
-        ).delete()
-        vector_store.remove_document(instance.id)
+        _remove_or_defer(instance, 'benefit')
 
 
 @receiver(post_save, sender=CommercialOffer)
-def handle_offer_save(sender, instance, created, **kwargs):
+def handle_offer_save(sender, instance, created, update_fields=None, **kwargs):
+    if not affects_search_index(update_fields, 'commercial'):
+        return
     if instance.status != 'expired':
-        create_or_update_search_index(instance, 'commercial')
+        _index_or_defer(instance, 'commercial')
     else:
-        content_type = ContentType.objects.get_for_model(CommercialOffer)
-        SearchIndex.objects.filter(
-            content_type=content_type,
-            object_id=instance.id
-        ).delete()
-        vector_store.remove_document(instance.id)
+        _remove_or_defer(instance, 'commercial')
 
 
 @receiver(post_delete, sender=Benefit)
@@ -84,11 +298,6 @@ def handle_offer_save(sender, instance, created, **kwargs):
 def handle_content_delete(sender, instance, **kwargs):
     """Clean up search index when content is deleted"""
     try:
-        content_type = ContentType.objects.get_for_model(sender)
-        SearchIndex.objects.filter(
-            content_type=content_type,
-            object_id=instance.id
-        ).delete()
-        vector_store.remove_document(instance.id)
+        _remove_or_defer(instance, 'benefit' if sender is Benefit else 'commercial')
     except OperationalError:
-        pass  # Table might not exist during migrations
\ No newline at end of file
+        pass  # Table might not exist during migrations
@@ -1,3 +1,730 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import get_commands, load_command_class
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from benefits.models import Benefit, CommercialOffer, Region
+from .embedding_service import MistralEmbeddingService
+from .caching import LRUCache, QueryEmbeddingCache
+from .hybrid import hybrid_search, reciprocal_rank_fusion
+from .hydration import hydrate
+from .lexical_index import LexicalIndex
+from .query_parser import QueryParser
+from .models import (
+    EMBEDDING_DTYPES, EmbeddingCache, IndexingTask, SearchIndex, decode_embedding, encode_embedding,
+)
+from .services import ServiceRegistry, services
+from .signals import process_queue
+from .vector_store import InMemoryVectorStore
+
+
+def unit_vector(*dimensions, size=1024):
+    vector = np.zeros(size, dtype=np.float32)
+    vector[list(dimensions)] = 1.0
+    return vector / np.linalg.norm(vector)
+
+
+def result_ids(results):
+    return [search_index_id for search_index_id, _ in results]
+
+
+class FakeEmbeddingsAPI:
+    """Stands in for client.embeddings: one deterministic vector per text, every request recorded"""
+
+    def __init__(self, errors=()):
+        self.requests = []
+        self.errors = list(errors)  # Raised by the first requests, one each
+
+    def create(self, model, inputs, **kwargs):
+        self.requests.append(list(inputs))
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=self.vector(text)) for text in inputs])
+
+    @staticmethod
+    def vector(text):
+        rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+        return rng.standard_normal(1024, dtype=np.float32).tolist()
+
+
+def mistral_service(api):
+    with mock.patch.dict(os.environ, MISTRAL_API_KEY='test'):
+        return MistralEmbeddingService(client=SimpleNamespace(embeddings=api))
+
+
+class SearchTestCase(TestCase):
+    """Each test gets its own index files, the local embedding backend and fresh services"""
+    factory = 'Flat'
+
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overrides = override_settings(
+            VECTOR_INDEX_PATH=directory / 'search_index.faiss',
+            VECTOR_MAPPING_PATH=directory / 'search_mapping.json',
+            VECTOR_IDS_PATH=directory / 'search_ids.npy',
+            LEXICAL_INDEX_PATH=directory / 'search_lexical.sqlite3',
+            VECTOR_INDEX_FACTORY=self.factory,
+            VECTOR_INDEX_MMAP=False,
+            VECTOR_PERSIST_INTERVAL=0,  # Every change is written at once
+            VECTOR_MIN_SIMILARITY=0.0,
+            EMBEDDING_BACKEND='local',
+            SEARCH_INDEXING_MODE='queue',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.reset_services()
+        self.addCleanup(self.reset_services)
+
+    @staticmethod
+    def reset_services():
+        """Forget the loaded services, as a new process would"""
+        InMemoryVectorStore._instance = None
+        connection = getattr(LexicalIndex._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            LexicalIndex._local.connection = None
+        LexicalIndex._checked = False
+        for name in ('embedding_service', 'vector_store', 'lexical_index'):
+            services._instances.pop(name, None)
+
+    def add_record(self, vector, content_type_name='benefit', target_groups=(), regions=('all',)):
+        return SearchIndex.objects.create(
+            content_type=ContentType.objects.get_for_model(Benefit),
+            object_id=SearchIndex.objects.count() + 1,
+            title='Запись',
+            content_type_name=content_type_name,
+            target_groups=list(target_groups),
+            regions=list(regions),
+            embedding_vector=encode_embedding(vector),
+        )
+
+
+class VectorStoreTests(SearchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Twelve records close to dimension 1000, each also pointing its own way
+        self.records = [
+            self.add_record(
+                unit_vector(i, 1000),
+                content_type_name='commercial' if i % 3 == 0 else 'benefit',
+                target_groups=['pensioner'] if i % 2 else ['disability_1'],
+                regions=['77'] if i < 6 else ['all'],
+            )
+            for i in range(12)
+        ]
+        self.store = services.vector_store
+        self.store.ensure_initialized()
+
+    def search(self, vector, filters=None, top_k=20, min_similarity=0.0):
+        return result_ids(self.store.search(vector, filters or {}, top_k=top_k, min_similarity=min_similarity))
+
+    def test_rebuild_indexes_every_record(self):
+        self.assertEqual(sorted(self.store.indexed_ids().tolist()), [record.id for record in self.records])
+
+    def test_filtered_search_returns_exactly_the_matching_records(self):
+        pensioners = {record.id for record in self.records if record.target_groups == ['pensioner']}
+        self.assertEqual(set(self.search(unit_vector(1000), {'target_groups': ['pensioner']})), pensioners)
+
+        moscow_benefits = {
+            record.id for record in self.records
+            if record.content_type_name == 'benefit' and record.regions == ['77']
+        }
+        found = self.search(unit_vector(1000), {'content_type': 'benefit', 'regions': ['77']})
+        self.assertEqual(set(found), moscow_benefits)
+
+        self.assertEqual(self.search(unit_vector(1000), {'regions': ['01']}), [])
+
+    def test_filters_apply_to_keyword_hits(self):
+        ids = [record.id for record in self.records]
+        expected = [record.id for record in self.records if record.target_groups == ['pensioner']]
+        self.assertEqual(self.store.matching_ids(ids, {'target_groups': ['pensioner']}), expected)
+
+    def test_upsert_replaces_the_vector(self):
+        record = self.records[1]
+        self.store.upsert_many([record.id], np.array([unit_vector(1005)]), [('benefit', ['pensioner'], ['all'])])
+
+        # The old embedding no longer finds the record, the new one does
+        self.assertNotIn(record.id, self.search(unit_vector(1, 1000), min_similarity=0.9))
+        self.assertEqual(self.search(unit_vector(1005), top_k=1), [record.id])
+        self.assertEqual(sorted(self.store.indexed_ids().tolist()), [r.id for r in self.records])
+
+    def test_remove_ids(self):
+        removed = self.records[4]
+        self.store.remove_ids([removed.id])
+
+        self.assertNotIn(removed.id, self.search(unit_vector(1000)))
+        self.assertNotIn(removed.id, self.store.indexed_ids().tolist())
+        self.assertEqual(self.store.matching_ids([removed.id], {'target_groups': ['disability_1']}), [])
+
+    def test_reload_from_disk(self):
+        replaced, removed = self.records[1], self.records[4]
+        self.store.upsert_many([replaced.id], np.array([unit_vector(1005)]), [('benefit', ['pensioner'], ['all'])])
+        self.store.remove_ids([removed.id])
+        self.store.flush()
+
+        self.reset_services()
+        store = services.vector_store
+        store.ensure_initialized()
+        self.assertIsNot(store, self.store)
+        self.assertEqual(
+            sorted(store.indexed_ids().tolist()),
+            sorted(record.id for record in self.records if record != removed)
+        )
+        results = result_ids(store.search(unit_vector(1000), {}, top_k=20))
+        self.assertNotIn(removed.id, results)
+        self.assertNotIn(replaced.id, result_ids(store.search(unit_vector(1, 1000), {}, min_similarity=0.9)))
+        self.assertEqual(result_ids(store.search(unit_vector(1005), {}, top_k=1)), [replaced.id])
+
+    def test_picks_up_changes_written_by_another_process(self):
+        reader = self.store
+        record = self.records[7]
+
+        # Another process: its own store instance writing the same files
+        self.reset_services()
+        services.vector_store.remove_ids([record.id])
+        services.vector_store.flush()
+
+        self.assertNotIn(record.id, result_ids(reader.search(unit_vector(1000), {}, top_k=20)))
+
+    def test_debounced_change_is_written_when_the_interval_ends(self):
+        record = self.records[7]
+        with self.settings(VECTOR_PERSIST_INTERVAL=0.3):
+            self.store.remove_ids([record.id])
+            self.assertIsNotNone(self.store._flush_timer)
+            self.assertTrue(self.store._dirty)
+            time.sleep(0.6)
+        self.assertFalse(self.store._dirty)
+
+        self.reset_services()
+        self.assertNotIn(record.id, services.vector_store.indexed_ids().tolist())
+
+    def test_searches_during_upserts_in_other_threads(self):
+        known_ids = {record.id for record in self.records}
+        errors, seen = [], set()
+
+        def searcher():
+            try:
+                for _ in range(50):
+                    seen.update(self.search(unit_vector(1000)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=searcher) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(50):
+            record = self.records[i % len(self.records)]
+            self.store.upsert_many([record.id], np.array([unit_vector(i % 12, 1000)]), [('benefit', [], ['all'])])
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(seen, known_ids)
+
+
+class HNSWVectorStoreTests(VectorStoreTests):
+    """HNSW cannot delete vectors: replaced and removed ones must stay out of results anyway"""
+    factory = 'HNSW32'
+
+
+class FlatFallbackTests(SearchTestCase):
+    """Too few records to train IVF64: the rebuild falls back to Flat storage"""
+    factory = 'IVF64,Flat'
+
+    def test_zero_embedding_ids_survive_the_fallback(self):
+        records = [self.add_record(unit_vector(i)) for i in range(6)]
+        failed = self.add_record(np.zeros(1024, dtype=np.float32))
+
+        store = services.vector_store
+        store.ensure_initialized()
+        self.assertIsInstance(store._inner_index(), faiss.IndexFlat)
+        self.assertEqual(store.zero_vector_ids(), [failed.id])
+        self.assertEqual(sorted(store.indexed_ids().tolist()), [record.id for record in records])
+
+
+class IndexingQueueTests(SearchTestCase):
+
+    def create_benefit(self, title='Пенсия по старости'):
+        return Benefit.objects.create(
+            benefit_id=f'test_{Benefit.objects.count() + 1}',
+            title=title,
+            description='Ежемесячная выплата пенсионерам',
+            benefit_type='federal',
+            target_groups=['pensioner'],
+            applies_to_all_regions=True,
+            valid_from='2024-01-01',
+            requirements='Паспорт',
+            how_to_get='Через Госуслуги',
+            source_url='https://sfr.gov.ru/',
+        )
+
+    def search_for(self, benefit):
+        embedding = services.embedding_service.generate_for_benefit(benefit)
+        return result_ids(services.vector_store.search(embedding, {}, top_k=1, min_similarity=0.9))
+
+    def test_save_is_queued_and_indexed_by_the_worker(self):
+        benefit = self.create_benefit()
+        self.assertEqual(IndexingTask.objects.filter(object_id=benefit.id, action='index').count(), 1)
+        self.assertFalse(SearchIndex.objects.filter(object_id=benefit.id).exists())
+
+        self.assertEqual(process_queue(), (1, 0, 0))
+        record = SearchIndex.objects.get(object_id=benefit.id, content_type_name='benefit')
+        self.assertFalse(IndexingTask.objects.exists())
+        self.assertEqual(self.search_for(benefit), [record.id])
+
+    def test_delete_is_queued_and_removed_by_the_worker(self):
+        benefit = self.create_benefit()
+        process_queue()
+        record = SearchIndex.objects.get(object_id=benefit.id)
+
+        benefit.delete()
+        self.assertEqual(IndexingTask.objects.get().action, 'remove')
+        self.assertEqual(process_queue(), (0, 1, 0))
+        self.assertFalse(SearchIndex.objects.filter(id=record.id).exists())
+        self.assertNotIn(record.id, services.vector_store.indexed_ids().tolist())
+
+    def test_failed_embedding_stays_queued_for_a_retry(self):
+        benefit = self.create_benefit()
+        service = services.embedding_service
+        zero_vectors = lambda texts: [[0.0] * service.dimension for _ in texts]
+
+        with mock.patch.object(service, 'generate_batch_cached', side_effect=zero_vectors):
+            self.assertEqual(process_queue(), (0, 0, 1))
+        task = IndexingTask.objects.get()
+        self.assertEqual(task.attempts, 1)
+        self.assertFalse(SearchIndex.objects.filter(object_id=benefit.id).exists())
+
+        self.assertEqual(process_queue(), (1, 0, 0))
+        self.assertFalse(IndexingTask.objects.exists())
+        self.assertEqual(len(self.search_for(benefit)), 1)
+
+    def test_tasks_past_max_attempts_are_left_alone(self):
+        self.create_benefit()
+        IndexingTask.objects.update(attempts=5)
+        self.assertEqual(process_queue(max_attempts=5), (0, 0, 0))
+        self.assertEqual(IndexingTask.objects.count(), 1)
+
+
+class EmbeddingCacheTests(TestCase):
+
+    def setUp(self):
+        self.api = FakeEmbeddingsAPI()
+        self.service = mistral_service(self.api)
+
+    def test_unchanged_text_is_not_embedded_again(self):
+        texts = ['Пенсия по старости', 'Компенсация ЖКУ']
+        first = self.service.generate_batch_cached(texts)
+        second = self.service.generate_batch_cached(texts)
+
+        self.assertEqual(len(self.api.requests), 1)
+        self.assertTrue(first == second == [FakeEmbeddingsAPI.vector(text) for text in texts])
+        self.assertEqual((self.service.cache_hits, self.service.cache_misses), (2, 2))
+
+    def test_repeated_text_in_one_batch_is_embedded_once(self):
+        self.service.generate_batch_cached(['Пенсия', 'Пенсия', 'Пособие'])
+        self.assertEqual(self.api.requests, [['Пенсия', 'Пособие']])
+
+    def test_cache_is_per_model(self):
+        self.service.generate_cached('Пенсия')
+        self.service.model = 'mistral-embed-v2'
+        self.service.generate_cached('Пенсия')
+        self.assertEqual(len(self.api.requests), 2)
+        self.assertEqual(EmbeddingCache.objects.count(), 2)
+
+    def test_failed_embedding_is_not_cached(self):
+        with mock.patch.object(self.service, 'generate_batch', return_value=[[0.0] * 1024]):
+            self.assertFalse(any(self.service.generate_cached('Пенсия')))
+        self.assertFalse(EmbeddingCache.objects.exists())
+
+        self.assertTrue(any(self.service.generate_cached('Пенсия')))
+        self.assertEqual(len(self.api.requests), 1)
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+@mock.patch.object(MistralEmbeddingService, 'RETRY_BACKOFF', 0)
+class EmbeddingBatchTests(SimpleTestCase):
+
+    def test_texts_are_packed_into_few_requests(self):
+        api = FakeEmbeddingsAPI()
+        service = mistral_service(api)
+        texts = [f'Льгота номер {i}' for i in range(300)]
+
+        embeddings = service.generate_batch(texts)
+        self.assertEqual([len(request) for request in api.requests], [128, 128, 44])
+        self.assertEqual(embeddings, [FakeEmbeddingsAPI.vector(text) for text in texts])
+
+    def test_request_token_limit_starts_a_new_batch(self):
+        api = FakeEmbeddingsAPI()
+        service = mistral_service(api)
+        long_text = 'а' * (MistralEmbeddingService.MAX_TOKENS_PER_REQUEST // 2 * MistralEmbeddingService.CHARS_PER_TOKEN)
+
+        # Two inputs at the per-input cap fill a request exactly; the next one starts another
+        service.generate_batch([long_text, long_text + 'б', 'короткий'])
+        self.assertEqual([len(request) for request in api.requests], [2, 1])
+
+    def test_rejected_input_is_isolated_by_splitting(self):
+        texts = ['один', 'два', 'плохой', 'четыре']
+
+        class RejectingAPI(FakeEmbeddingsAPI):
+            def create(self, model, inputs, **kwargs):
+                if 'плохой' in inputs:
+                    self.requests.append(list(inputs))
+                    raise APIError(400)
+                return super().create(model, inputs, **kwargs)
+
+        api = RejectingAPI()
+        embeddings = mistral_service(api).generate_batch(texts)
+        # Halves until the bad input is alone; the rest are still embedded, and nothing is retried as is
+        self.assertEqual(api.requests, [texts, ['один', 'два'], ['плохой', 'четыре'], ['плохой'], ['четыре']])
+        self.assertFalse(any(embeddings[2]))
+        self.assertEqual([embeddings[i] for i in (0, 1, 3)], [FakeEmbeddingsAPI.vector(texts[i]) for i in (0, 1, 3)])
+
+    def test_rate_limit_and_server_errors_retry_the_whole_batch(self):
+        api = FakeEmbeddingsAPI(errors=[APIError(429), APIError(503)])
+        service = mistral_service(api)
+        texts = ['один', 'два', 'три']
+
+        embeddings = service.generate_batch(texts)
+        self.assertEqual(api.requests, [texts, texts, texts])
+        self.assertEqual(embeddings, [FakeEmbeddingsAPI.vector(text) for text in texts])
+
+    def test_batch_failing_every_retry_keeps_zero_vectors(self):
+        api = FakeEmbeddingsAPI(errors=[TimeoutError()] * (MistralEmbeddingService.MAX_RETRIES + 1))
+        service = mistral_service(api)
+
+        embeddings = service.generate_batch(['один', 'два'])
+        self.assertEqual(len(api.requests), MistralEmbeddingService.MAX_RETRIES + 1)
+        self.assertFalse(any(any(embedding) for embedding in embeddings))
+
+
+class EmbeddingEncodingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vector = np.random.default_rng(0).standard_normal(1024).astype(np.float32)
+
+    def test_float32_round_trip_is_exact(self):
+        data = encode_embedding(self.vector, 'float32')
+        self.assertEqual(len(data), 4096)
+        np.testing.assert_array_equal(decode_embedding(data, 'float32'), self.vector)
+
+    def test_lossy_dtypes_round_trip_closely(self):
+        for dtype, size, tolerance in [('float16', 2048, 1e-2), ('int8', 1028, 0.02)]:
+            with self.subTest(dtype=dtype):
+                data = encode_embedding(self.vector, dtype)
+                decoded = decode_embedding(data, dtype)
+                self.assertEqual(len(data), size)
+                self.assertEqual(decoded.dtype, np.float32)
+                self.assertLess(np.abs(decoded - self.vector).max(), tolerance * np.abs(self.vector).max())
+                cosine = decoded @ self.vector / np.linalg.norm(decoded) / np.linalg.norm(self.vector)
+                self.assertGreater(cosine, 0.999)
+
+    def test_zero_vector_round_trips_in_every_dtype(self):
+        for dtype in EMBEDDING_DTYPES:
+            with self.subTest(dtype=dtype):
+                decoded = decode_embedding(encode_embedding(np.zeros(8), dtype), dtype)
+                np.testing.assert_array_equal(decoded, np.zeros(8, dtype=np.float32))
+
+    def test_legacy_json_text_is_decoded(self):
+        decoded = decode_embedding(json.dumps([0.5, -1.0, 2.0]))
+        np.testing.assert_array_equal(decoded, np.array([0.5, -1.0, 2.0], dtype=np.float32))
+
+    def test_unknown_dtype_is_rejected(self):
+        with self.assertRaises(ValueError):
+            encode_embedding(self.vector, 'float64')
+        with self.assertRaises(ValueError):
+            decode_embedding(b'', 'float64')
+
+    @override_settings(SEARCH_EMBEDDING_DTYPE='float16')
+    def test_search_index_packs_with_the_configured_dtype(self):
+        record = SearchIndex()
+        record.set_embedding(self.vector.tolist())
+        self.assertEqual(record.embedding_dtype, 'float16')
+        self.assertEqual(len(record.embedding_vector), 2048)
+        np.testing.assert_allclose(record.get_embedding(), self.vector, atol=1e-2)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+
+    def test_ids_ranked_by_both_lists_come_first(self):
+        # 3: 1/63 + 1/61; 1: 1/61; 2 and 4: 1/62 each, tied in first-seen order
+        self.assertEqual(reciprocal_rank_fusion([[1, 2, 3], [3, 4]]), [3, 1, 2, 4])
+
+    def test_known_scores(self):
+        fused = reciprocal_rank_fusion([['a', 'b'], ['b', 'c'], ['c', 'b']], k=1)
+        # b: 1/3 + 1/2 + 1/3, c: 1/3 + 1/2, a: 1/2
+        self.assertEqual(fused, ['b', 'c', 'a'])
+
+    def test_single_and_empty_lists(self):
+        self.assertEqual(reciprocal_rank_fusion([[5, 6, 7]]), [5, 6, 7])
+        self.assertEqual(reciprocal_rank_fusion([[], [8]]), [8])
+        self.assertEqual(reciprocal_rank_fusion([]), [])
+
+
+class HybridSearchTests(SearchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pension = self.add_record(unit_vector(1), target_groups=['pensioner'])
+        self.discount = self.add_record(unit_vector(2), target_groups=['disability_1'])
+        self.transport = self.add_record(unit_vector(3), target_groups=['pensioner'])
+        services.lexical_index.upsert_many([
+            (self.pension.id, 'Страховая пенсия по старости', 'Выплата пенсионерам'),
+            (self.discount.id, 'Скидка на лекарства', 'Для инвалидов и пенсионеров'),
+            (self.transport.id, 'Бесплатный проезд', 'Общественный транспорт'),
+        ])
+
+    def test_keyword_hit_joins_the_vector_results(self):
+        results = hybrid_search('проезд', unit_vector(1), {}, top_k=5)
+        ids = result_ids(results)
+        self.assertEqual(set(ids[:2]), {self.pension.id, self.transport.id})
+        self.assertEqual(dict(results)[self.pension.id], 1.0)
+
+    def test_id_found_by_both_ranks_first(self):
+        ids = result_ids(hybrid_search('проезд', unit_vector(3, 1), {}, top_k=5))
+        self.assertEqual(ids[0], self.transport.id)
+
+    def test_keyword_results_alone_without_an_embedding(self):
+        for embedding in (None, np.zeros(1024)):
+            with self.subTest(embedding=embedding):
+                results = hybrid_search('пенсионеров', embedding, {}, top_k=5)
+                self.assertEqual(set(result_ids(results)), {self.pension.id, self.discount.id})
+                self.assertEqual({score for _, score in results}, {0.0})
+
+    def test_filters_apply_to_keyword_hits(self):
+        results = hybrid_search('пенсионеров', None, {'target_groups': ['pensioner']}, top_k=5)
+        self.assertEqual(result_ids(results), [self.pension.id])
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' is now the least recently used
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = LRUCache(ttl=10)
+        with mock.patch('search.caching.time.monotonic', return_value=100.0):
+            cache.set('a', 1)
+        with mock.patch('search.caching.time.monotonic', return_value=109.0):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('search.caching.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_hit_rate(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.api = FakeEmbeddingsAPI()
+        service = mistral_service(self.api)
+        patcher = mock.patch.object(QueryEmbeddingCache, 'service', new_callable=mock.PropertyMock,
+                                    return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_queries_differing_in_case_and_spaces_share_an_entry(self):
+        cache = QueryEmbeddingCache()
+        first = cache.get('Льготы  пенсионерам')
+        second = cache.get('льготы пенсионерам ')
+        self.assertEqual(first, second)
+        self.assertEqual(self.api.requests, [['query: льготы пенсионерам']])
+
+    def test_failed_embedding_is_not_cached(self):
+        cache = QueryEmbeddingCache()
+        self.api.errors = [APIError(503)]
+        self.assertFalse(any(cache.get('пенсия')))
+        self.assertTrue(any(cache.get('пенсия')))
+        self.assertEqual(len(self.api.requests), 2)
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search-tests'}},
+        QUERY_EMBEDDING_CACHE_BACKEND='search',
+    )
+    def test_shared_cache_serves_other_workers(self):
+        QueryEmbeddingCache().get('пенсия')
+        other_worker = QueryEmbeddingCache()
+        embedding = other_worker.get('пенсия')
+
+        self.assertEqual(len(self.api.requests), 1)
+        self.assertEqual(embedding, FakeEmbeddingsAPI.vector('query: пенсия'))
+        self.assertEqual(other_worker.stats()['shared_hits'], 1)
+
+
+class FakeChatAPI:
+    """Stands in for client.chat: answers every request with `answer` as the JSON message"""
+
+    def __init__(self, answer=None, error=None):
+        self.answer = answer or {'intent': 'find_benefits', 'keywords': [], 'filters': {}}
+        self.error = error
+        self.requests = 0
+
+    def complete(self, **kwargs):
+        self.requests += 1
+        if self.error:
+            raise self.error
+        message = SimpleNamespace(content=json.dumps(self.answer, ensure_ascii=False))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class QueryParserTests(TestCase):
+
+    def setUp(self):
+        Region.objects.create(code='77', name='Москва')
+        Region.objects.create(code='14', name='Республика Саха (Якутия)')
+        self.chat = FakeChatAPI({
+            'intent': 'find_benefits',
+            'keywords': ['жилье'],
+            'filters': {'target_groups': ['pensioner', 'unknown'], 'regions': ['Москва']},
+        })
+        self.parser = QueryParser(client=SimpleNamespace(chat=self.chat))
+
+    def test_plain_query_is_parsed_by_the_rules(self):
+        parsed = self.parser.parse('Льготы пенсионерам в Якутии')
+        self.assertEqual(self.chat.requests, 0)
+        self.assertEqual(parsed['intent'], 'find_benefits')
+        self.assertEqual(parsed['filters']['target_groups'], ['pensioner'])
+        self.assertEqual(parsed['filters']['regions'], ['14', 'all'])
+
+    def test_ambiguous_query_goes_to_the_llm_once(self):
+        parsed = self.parser.parse('помощь с оплатой жилья, но не для пенсионеров')
+        self.parser.parse('Помощь с оплатой  жилья, но не для пенсионеров')
+
+        self.assertEqual(self.chat.requests, 1)
+        # Unknown group codes are dropped and region names become codes
+        self.assertEqual(parsed['filters']['target_groups'], ['pensioner'])
+        self.assertEqual(parsed['filters']['regions'], ['77', 'all'])
+        self.assertEqual(self.parser.stats()['hits'], 1)
+
+    def test_llm_failure_falls_back_without_caching(self):
+        self.chat.error = TimeoutError()
+        parsed = self.parser.parse('помощь с оплатой жилья')
+        self.assertEqual(parsed['keywords'], ['помощь', 'оплатой', 'жилья'])
+
+        self.chat.error = None
+        self.parser.parse('помощь с оплатой жилья')
+        self.assertEqual(self.chat.requests, 2)
+        self.assertEqual(self.parser.stats()['llm_failures'], 1)
+
+    def test_cached_result_is_not_changed_by_callers(self):
+        parsed = self.parser.parse('льготы пенсионерам')
+        parsed['filters']['target_groups'].append('veteran')
+        self.assertEqual(self.parser.parse('льготы пенсионерам')['filters']['target_groups'], ['pensioner'])
+
+
+class HydrationTests(SearchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.benefits = [
+            Benefit.objects.create(
+                benefit_id=f'hydration_{i}', title=f'Льгота {i}', description='Описание', benefit_type='federal',
+                valid_from='2024-01-01', requirements='Паспорт', how_to_get='Через Госуслуги',
+                source_url='https://sfr.gov.ru/',
+            )
+            for i in range(3)
+        ]
+        self.offer = CommercialOffer.objects.create(
+            offer_id='hydration_offer', title='Скидка в аптеке', description='Описание',
+            discount_description='Скидка 10%', partner_name='Аптека', partner_category='Аптека',
+            valid_from='2024-01-01', how_to_use='Показать удостоверение',
+        )
+        self.rows = [self.index_row(benefit, 'benefit') for benefit in self.benefits]
+        self.offer_row = self.index_row(self.offer, 'commercial')
+
+    @staticmethod
+    def index_row(instance, content_type_name):
+        return SearchIndex.objects.create(
+            content_type=ContentType.objects.get_for_model(instance), object_id=instance.id,
+            title=instance.title, content_type_name=content_type_name,
+        )
+
+    def test_ranking_order_and_similarity_are_kept(self):
+        ranking = [(self.rows[2].id, 0.9), (self.offer_row.id, 0.8), (self.rows[0].id, 0.7), (self.rows[1].id, 0.6)]
+        hydrated = hydrate(ranking)
+
+        self.assertEqual(hydrated, [self.benefits[2], self.offer, self.benefits[0], self.benefits[1]])
+        self.assertEqual([obj.search_similarity for obj in hydrated], [0.9, 0.8, 0.7, 0.6])
+
+    def test_missing_rows_and_objects_are_dropped(self):
+        self.benefits[1].delete()
+        ranking = [(self.rows[1].id, 0.9), (999999, 0.8), (self.rows[2].id, 0.7), (self.rows[0].id, 0.6)]
+        self.assertEqual(hydrate(ranking), [self.benefits[2], self.benefits[0]])
+
+    def test_query_count_does_not_grow_with_the_results(self):
+        ranking = [(row.id, 0.5) for row in self.rows + [self.offer_row]]
+        # SearchIndex rows, benefits, offers
+        with self.assertNumQueries(3):
+            hydrate(ranking, prefetch=())
+        # ... plus one regions query per content type
+        with self.assertNumQueries(5):
+            hydrated = hydrate(ranking)
+        with self.assertNumQueries(0):
+            [list(obj.regions.all()) for obj in hydrated]
+
+    def test_no_results(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(hydrate([]), [])
+
+
+class ServiceRegistryTests(SimpleTestCase):
+
+    def test_service_is_created_once_on_first_use(self):
+        registry = ServiceRegistry()
+        factory = mock.Mock(side_effect=object)
+        registry.register('client', factory)
+
+        self.assertFalse(registry.is_loaded('client'))
+        self.assertIs(registry.client, registry.get('client'))
+        self.assertEqual(factory.call_count, 1)
+        with self.assertRaises(AttributeError):
+            registry.missing
+
+    def test_failed_warm_up_is_reported_not_raised(self):
+        registry = ServiceRegistry()
+        registry.register('good', object, warm=mock.Mock())
+        registry.register('bad', mock.Mock(side_effect=RuntimeError('no key')))
+        self.assertEqual(list(registry.warm_up(['good', 'bad'])), ['good'])
+
+    def test_every_management_command_imports(self):
+        # Commands import the shared services, not instances that used to live in other modules
+        for name, app in get_commands().items():
+            if app in ('benefits', 'search'):
+                with self.subTest(command=name):
+                    load_command_class(app, name)
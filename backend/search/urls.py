@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('api/search/', views.NaturalLanguageSearchAPI.as_view(), name='natural-search'),
     path('api/search/details/', views.MixedSearchResultsView.as_view(), name='search-details'),
+    path('api/search/cache-stats/', views.SearchCacheStatsView.as_view(), name='search-cache-stats'),
 
     # Pages
     path('', views.DocumentListView.as_view(), name='document-list'),
@@ -1,142 +1,869 @@
+import atexit
 import faiss
+import hashlib
+import io
 import numpy as np
 import json
 import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from django.conf import settings
-from django.db import OperationalError  # Import this to catch table errors
-from .models import SearchIndex
+from django.db import OperationalError, connection  # Import this to catch table errors
+from .models import SearchIndex, decode_embedding, is_missing_table
+from .services import services
+
+try:
+    import fcntl  # Not available on Windows
+except ImportError:
+    fcntl = None
+
+
+def _set_bits(bitmap: np.ndarray, ids: np.ndarray, value: bool):
+    """Set or clear bits for `ids` in a packed little-endian bitmap (FAISS IDSelectorBitmap layout)"""
+    if not len(ids):
+        return
+    masks = np.left_shift(1, ids & 7).astype(np.uint8)
+    if value:
+        np.bitwise_or.at(bitmap, ids >> 3, masks)
+    else:
+        np.bitwise_and.at(bitmap, ids >> 3, ~masks)
+
+
+class FacetBitmaps:
+    """
+    Per-facet ID bitmaps kept next to the FAISS index: one bitmap per content type,
+    per target group code and per region code, with one bit per FAISS label.
+    Filters are resolved to a single bitmap that FAISS uses as an IDSelector,
+    so filtered search is exact no matter how selective the filter is.
+    """
+    FACETS = ('content_type', 'target_groups', 'regions')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._present = np.zeros(0, dtype=np.uint8)  # labels indexed with a known SearchIndex row
+        self._bitmaps = {facet: {} for facet in self.FACETS}
+        self._missing = set()  # labels indexed without a SearchIndex row, or replaced/removed
+
+    def assign(self, ids, rows):
+        """Set facets for ids from rows of (content_type_name, target_groups, regions); None marks a missing record"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        self._grow(int(ids.max()) + 1)
+        self.discard(ids)
+
+        present = []
+        members = {}
+        for search_index_id, row in zip(ids.tolist(), rows):
+            if row is None:
+                self._missing.add(search_index_id)
+                continue
+            content_type_name, target_groups, regions = row
+            present.append(search_index_id)
+            members.setdefault(('content_type', content_type_name), []).append(search_index_id)
+            for group in target_groups or []:
+                members.setdefault(('target_groups', group), []).append(search_index_id)
+            for region in regions or []:
+                members.setdefault(('regions', str(region)), []).append(search_index_id)
+
+        _set_bits(self._present, np.array(present, dtype=np.int64), True)
+        for (facet, value), member_ids in members.items():
+            _set_bits(self._bitmap(facet, value), np.array(member_ids, dtype=np.int64), True)
+
+    def discard(self, ids):
+        """Clear every facet bit for ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[ids < len(self._present) * 8]
+        _set_bits(self._present, ids, False)
+        for bitmaps in self._bitmaps.values():
+            for bitmap in bitmaps.values():
+                _set_bits(bitmap, ids, False)
+        self._missing.difference_update(ids.tolist())
+
+    def hide(self, ids):
+        """Keep ids out of every selection while FAISS still holds their vectors"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.discard(ids)
+        self._missing.update(ids.tolist())
+
+    def selection(self, filters: dict):
+        """
+        Packed bitmap of ids matching the filters (OR within a facet, AND across facets).
+        Returns None when nothing has to be excluded.
+        """
+        selected = None
+        for facet in self.FACETS:
+            if values := filters.get(facet):
+                values = [values] if isinstance(values, str) else values
+                facet_bitmap = np.zeros_like(self._present)
+                for value in values:
+                    if (bitmap := self._bitmaps[facet].get(str(value))) is not None:
+                        facet_bitmap |= bitmap
+                selected = facet_bitmap if selected is None else selected & facet_bitmap
+
+        if selected is None:
+            return self._present.copy() if self._missing else None
+        return selected & self._present
+
+    def compact(self, keep: np.ndarray):
+        """Renumber after dropping labels: the labels in `keep` (ascending) become 0..len(keep)-1"""
+        def compacted(bitmap):
+            bits = np.unpackbits(bitmap, bitorder='little')[keep]
+            return self._resized(np.packbits(bits, bitorder='little'), max(len(bitmap), 1024))
+
+        self._present = compacted(self._present)
+        for bitmaps in self._bitmaps.values():
+            for value, bitmap in bitmaps.items():
+                bitmaps[value] = compacted(bitmap)
+        new_labels = {old: new for new, old in enumerate(keep.tolist())}
+        self._missing = {new_labels[label] for label in self._missing if label in new_labels}
+
+    def _bitmap(self, facet, value):
+        bitmaps = self._bitmaps[facet]
+        if value not in bitmaps:
+            bitmaps[value] = np.zeros_like(self._present)
+        return bitmaps[value]
+
+    def _grow(self, id_limit):
+        """Make room for ids below `id_limit`, doubling capacity to keep appends amortized O(1)"""
+        size = (id_limit + 7) // 8
+        if size > len(self._present):
+            capacity = max(size, len(self._present) * 2, 1024)
+            self._present = self._resized(self._present, capacity)
+            for bitmaps in self._bitmaps.values():
+                for value, bitmap in bitmaps.items():
+                    bitmaps[value] = self._resized(bitmap, capacity)
+
+    @staticmethod
+    def _resized(bitmap, capacity):
+        resized = np.zeros(capacity, dtype=np.uint8)
+        resized[:len(bitmap)] = bitmap
+        return resized
+
+
+class EmbeddingModelMismatch(Exception):
+    """The index on disk holds vectors of another embedding model than the one configured"""
+
+
+def _fit(array: np.ndarray, size: int, fill: int) -> np.ndarray:
+    """`array` with room for `size` items, doubling capacity so appends stay amortized O(1)"""
+    if size <= len(array):
+        return array
+    resized = np.full(max(size, len(array) * 2, 1024), fill, dtype=array.dtype)
+    resized[:len(array)] = array
+    return resized
+
+
+class LabelTable:
+    """
+    FAISS labels <-> SearchIndex ids. A label is the vector's position in the FAISS index, so
+    every vector added gets a label of its own: when a record is re-embedded its old vector
+    keeps a label that no longer maps to the record and is left out of every search.
+    The label -> id array is the id file on disk (memory-mapped along with the index).
+    """
+
+    def __init__(self, label_ids: np.ndarray = None):
+        self._label_ids = np.zeros(0, dtype=np.int64) if label_ids is None else label_ids  # -1: replaced/removed
+        self._count = len(self._label_ids)
+        live = np.flatnonzero(np.asarray(self._label_ids) >= 0)
+        ids = np.asarray(self._label_ids)[live]
+        self._id_labels = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int64)
+        self._id_labels[ids] = live
+
+    def label_ids(self) -> np.ndarray:
+        """SearchIndex id per label, -1 where the vector was replaced or removed"""
+        return self._label_ids[:self._count]
+
+    def assign(self, ids: np.ndarray) -> np.ndarray:
+        """New labels for ids (whose old labels must have been retired)"""
+        labels = np.arange(self._count, self._count + len(ids), dtype=np.int64)
+        if len(ids):
+            self._label_ids = _fit(self._label_ids, self._count + len(ids), -1)
+            self._label_ids[labels] = ids
+            self._id_labels = _fit(self._id_labels, int(ids.max()) + 1, -1)
+            self._id_labels[ids] = labels
+            self._count += len(ids)
+        return labels
+
+    def retire(self, ids: np.ndarray) -> np.ndarray:
+        """Unlink ids from their current labels; returns those labels"""
+        labels = self.labels(ids)
+        labels = labels[labels >= 0]
+        self._label_ids[labels] = -1
+        ids = ids[(ids >= 0) & (ids < len(self._id_labels))]
+        self._id_labels[ids] = -1
+        return labels
+
+    def labels(self, ids) -> np.ndarray:
+        """Current label per id, -1 for ids without a vector"""
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = np.full(len(ids), -1, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self._id_labels))
+        labels[known] = self._id_labels[ids[known]]
+        return labels
+
+    def ids(self, labels) -> np.ndarray:
+        return self._label_ids[np.asarray(labels, dtype=np.int64)]
+
+    def make_writable(self):
+        """Private copy of a memory-mapped label array"""
+        self._label_ids = np.array(self._label_ids)
+
+    def compact(self) -> np.ndarray:
+        """Drop retired labels and renumber the rest. Returns the old labels that were kept"""
+        keep = np.flatnonzero(self.label_ids() >= 0)
+        self.__init__(np.array(self.label_ids()[keep]))
+        return keep
+
+
+def _atomic_write(path: str, data: bytes):
+    """Write to a temp file next to `path` and rename it over `path`, so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
 class InMemoryVectorStore:
-    """Singleton FAISS index with lazy loading"""
+    """
+    Singleton FAISS index over SearchIndex records, with lazy loading. FAISS labels are vector
+    positions and a LabelTable maps them to SearchIndex ids; no per-process id map is built.
+    The inner index comes from settings.VECTOR_INDEX_FACTORY ('Flat', 'HNSW32', 'IVF1024,PQ64', ...).
+    Vectors and queries are L2-normalized, so scores are cosine similarities in [-1, 1].
+
+    Several processes share the files on disk (web workers, the indexing queue worker,
+    management commands). Each one reloads when another has written a newer index, and
+    writers hold a lock file while they merge their unflushed changes into it, so no
+    process overwrites what another wrote.
+    """
+    # search_mapping.json layout; version 1 was a bare list of ids, 4 = unit-length vectors,
+    # 6 = plain FAISS index (labels are positions) with the label -> SearchIndex id table in the id file,
+    # 7 = embedding model recorded
+    FORMAT_VERSION = 7
+    COMPACT_RATIO = 0.25  # Flat storage drops retired vectors once they are this share of the index
+
     _instance = None
     _index = None
-    _index_map = []
+    _mmapped = False  # Index and label table are read-only memory maps
+    _loaded_signature = None  # stat of the mapping file the index was loaded from
     _initialized = False  # Add initialization flag
+    _persist = True
+    _dirty = False  # Changes not written to disk yet
+    _last_flush = 0.0
+    _flush_timer = None  # Pending trailing flush for a write that arrived inside the interval
+    _factory = 'Flat'
+    _stale = 0  # Replaced/removed vectors an HNSW/IVF index still holds (hidden) until the next rebuild
+    _lock_depth = 0
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._lock = threading.RLock()
             cls._instance._create_empty_index()  # Create empty index, don't load
+            atexit.register(cls._instance.flush)
         return cls._instance
 
-    def _create_empty_index(self):
+    @classmethod
+    def detached(cls, dimension: int = 1024, factory: str = 'Flat'):
+        """Standalone in-memory store outside the singleton, never written to disk (benchmarks)"""
+        store = super().__new__(cls)
+        store._lock = threading.RLock()
+        store._create_empty_index(dimension, factory)
+        store._initialized = True
+        store._persist = False
+        return store
+
+    def _create_empty_index(self, dimension: int = 1024, factory: str = None):
         """Create empty FAISS index without touching database"""
-        dimension = 1024
-        self._index = faiss.IndexFlatIP(dimension)
-        self._index_map = []
+        self._index = self._new_index(dimension, factory)
+        self._facets = FacetBitmaps()
         self._initialized = False
 
+    def _new_index(self, dimension: int, factory: str = None):
+        """Empty index built from the factory string (inner product metric)"""
+        self._factory = factory or settings.VECTOR_INDEX_FACTORY
+        self._stale = 0
+        self._labels = LabelTable()
+        self._mmapped = False
+        self._untrained = []
+        self._pending = []  # Changes since the last load/flush, re-applied on top of a newer index from disk
+        self._zero_ids = set()  # ids whose embedding was all zeros (failed API call), not indexed; saved in the mapping
+        return faiss.index_factory(dimension, self._factory, faiss.METRIC_INNER_PRODUCT)
+
+    def _inner_index(self):
+        return faiss.downcast_index(self._index)
+
+    def _can_compact(self) -> bool:
+        """Flat storage can drop retired vectors in place; HNSW/IVF are rebuilt from the database"""
+        return isinstance(self._inner_index(), faiss.IndexFlat)
+
     def ensure_initialized(self):
         """Load from disk or rebuild from DB (safe to call after migrations)"""
-        if not self._initialized:
-            self._load_or_rebuild()
-            self._initialized = True
+        with self._lock:
+            if not self._initialized:
+                self._load_or_rebuild()
+                self._initialized = True
+
+    def start_empty(self):
+        """Use an empty index instead of the one on disk, for callers that rebuild it (rebuild_index --reembed)"""
+        self._create_empty_index(services.embedding_service.dimension)
+        self._initialized = True
+
+    @staticmethod
+    def _paths():
+        return str(settings.VECTOR_INDEX_PATH), str(settings.VECTOR_MAPPING_PATH), str(settings.VECTOR_IDS_PATH)
+
+    @contextmanager
+    def _disk_lock(self, shared: bool = False):
+        """
+        Hold the index lock file: shared while reading the files, exclusive while merging and
+        writing them. Re-entrant within the process, whose threads it also serializes.
+        """
+        with self._lock:
+            if not self._persist or fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            with open(self._paths()[1] + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
 
     def _load_or_rebuild(self):
         """Load existing index or rebuild from database if table exists"""
-        index_path = os.path.join(settings.BASE_DIR, 'search_index.faiss')
-        mapping_path = os.path.join(settings.BASE_DIR, 'search_mapping.json')
+        index_path, mapping_path, _ = self._paths()
 
         # Try to load from disk first
         if os.path.exists(index_path) and os.path.exists(mapping_path):
             try:
-                self._index = faiss.read_index(index_path)
-                with open(mapping_path, 'r') as f:
-                    self._index_map = json.load(f)
-                print(f"✓ Loaded {len(self._index_map)} vectors from disk")
+                with self._disk_lock(shared=True):
+                    self._read_from_disk()
+                self._load_facets()
+                print(f"✓ Loaded {self._index.ntotal} vectors from disk")
                 return
+            except EmbeddingModelMismatch:
+                raise  # A rebuild from SearchIndex rows would mix the models as well
             except Exception as e:
                 print(f"⚠️ Could not load from disk: {e}")
 
         # Try to rebuild from database (only if table exists)
         try:
             self._rebuild_index()
-        except OperationalError:
+        except OperationalError as e:
+            if not is_missing_table(e):
+                raise  # e.g. a missing column: starting empty would hide it and return no results
             print("⚠️ SearchIndex table doesn't exist yet. Will rebuild after migrations.")
             self._create_empty_index()
 
-    def _rebuild_index(self):
-        """Rebuild from database - only called when table exists"""
+    def _read_from_disk(self):
+        """
+        Load the index and check it against the mapping. With VECTOR_INDEX_MMAP the index and
+        label table are memory-mapped read-only, so workers share one page-cache copy and only
+        the small id file is hashed; otherwise the whole index is read and its checksum verified.
+        """
+        index_path, mapping_path, ids_path = self._paths()
+        signature = self._disk_signature()
+        with open(mapping_path, 'r') as f:
+            mapping = json.load(f)
+
+        if isinstance(mapping, list):
+            # Legacy unversioned pair - nothing to verify against, built with the Mistral API
+            if settings.VECTOR_INDEX_FACTORY != 'Flat':
+                raise ValueError(f"legacy flat index, settings ask for {settings.VECTOR_INDEX_FACTORY}")
+            index = faiss.read_index(index_path)
+            self._check_embedding_model('mistral-embed', index.d)
+            self._index, label_ids = self._from_legacy(index, mapping)
+            self._labels = LabelTable(label_ids)
+            self._zero_ids = set()
+            self._mmapped = False
+            self._factory = 'Flat'
+            self._loaded_signature = signature
+            return
+
+        if mapping.get('version') != self.FORMAT_VERSION:
+            raise ValueError(f"unsupported mapping version {mapping.get('version')}")
+        self._check_embedding_model(mapping.get('embedding_model'), mapping.get('dimension'))
+        if mapping.get('factory') != settings.VECTOR_INDEX_FACTORY:
+            raise ValueError(f"index was built as {mapping.get('factory')}, settings ask for {settings.VECTOR_INDEX_FACTORY}")
+        if os.path.getsize(index_path) != mapping.get('index_size'):
+            raise ValueError("index file does not match the size in the mapping")
+        with open(ids_path, 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() != mapping.get('ids_sha256'):
+                raise ValueError("id file does not match the checksum in the mapping")
+
+        mmapped = getattr(settings, 'VECTOR_INDEX_MMAP', False)
+        if mmapped:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            label_ids = np.load(ids_path, mmap_mode='r')
+        else:
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() != mapping.get('index_sha256'):
+                raise ValueError("index file does not match the checksum in the mapping")
+            index = faiss.deserialize_index(np.frombuffer(data, dtype=np.uint8))
+            label_ids = np.load(ids_path)
+
+        if index.ntotal != mapping.get('ntotal') or len(label_ids) != index.ntotal:
+            raise ValueError(f"mapping expects {mapping.get('ntotal')} vectors, "
+                             f"index has {index.ntotal} and {len(label_ids)} labels")
+        self._index, self._mmapped, self._loaded_signature = index, mmapped, signature
+        self._labels = LabelTable(label_ids)
+        self._zero_ids = set(mapping.get('zero_ids', []))
+        self._factory = mapping['factory']
+
+    @staticmethod
+    def _check_embedding_model(model: str, dimension: int):
+        """Refuse an index whose vectors the configured embedding service would not match"""
+        service = services.embedding_service
+        if (model, dimension) != (service.model, service.dimension):
+            raise EmbeddingModelMismatch(
+                f"search index was built with {model} ({dimension} dimensions), EMBEDDING_BACKEND "
+                f"uses {service.model} ({service.dimension}) - run `manage.py rebuild_index --reembed`"
+            )
+
+    def _disk_signature(self):
+        """Identity of the mapping file, which is replaced last on every flush"""
+        try:
+            stat = os.stat(self._paths()[1])
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload_if_changed(self):
+        """Pick up a newer index written by another process, keeping the changes not flushed here yet"""
+        if not self._persist or self._disk_signature() == self._loaded_signature:
+            return
+        try:
+            with self._disk_lock(shared=True):
+                self._sync_from_disk()
+            print(f"✓ Reloaded {self._index.ntotal} vectors from disk")
+        except Exception as e:
+            # Keep serving the current index and retry on the next search
+            print(f"⚠️ Could not reload from disk: {e}")
+
+    def _sync_from_disk(self):
+        """Load the index on disk and re-apply the upserts/removals made here since the last flush"""
+        pending = self._pending
+        self._read_from_disk()
+        self._load_facets()
+        self._pending = []
+        for action, *args in pending:
+            if action == 'upsert':
+                self._add_vectors(*args)
+            else:
+                self._remove_vectors(*args)
+        self._dirty = bool(self._pending)
+
+    def _make_writable(self):
+        """Replace a read-only mmap'd index with a private in-memory copy before changing it"""
+        if self._mmapped:
+            self._index = faiss.deserialize_index(faiss.serialize_index(self._index))
+            self._labels.make_writable()
+            self._mmapped = False
+
+    @staticmethod
+    def _from_legacy(index, mapping: list):
+        """
+        Convert a legacy positional index + id list: last duplicate wins, vectors are normalized.
+        Returns (index, SearchIndex id per label)
+        """
+        ids = np.array(mapping, dtype=np.int64)
+        if len(ids) != index.ntotal:
+            raise ValueError(f"mapping has {len(ids)} ids for {index.ntotal} vectors")
+        _, last_from_end = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last_from_end)
+
+        converted = faiss.IndexFlatIP(index.d)
+        if len(keep):
+            vectors = index.reconstruct_n(0, index.ntotal)[keep]
+            faiss.normalize_L2(vectors)  # Legacy files hold raw dot-product vectors
+            converted.add(vectors)
+        print(f"✓ Converted legacy index ({index.ntotal - len(keep)} duplicates dropped)")
+        return converted, ids[keep]
+
+    def _held_labels(self) -> np.ndarray:
+        """Labels of the vectors FAISS holds, retired ones included"""
+        return np.arange(self._index.ntotal, dtype=np.int64)
+
+    def _load_facets(self):
+        """Fill the facet bitmaps for an index loaded from disk with a single query"""
+        self._facets.reset()
+        try:
+            rows = {
+                row[0]: row[1:]
+                for row in SearchIndex.objects.filter(is_active=True).values_list(
+                    'id', 'content_type_name', 'target_groups', 'regions'
+                )
+            }
+        except OperationalError as e:
+            if not is_missing_table(e):
+                raise
+            rows = {}
+        labels = self._held_labels()
+        ids = self._labels.ids(labels)
+        # Inactive and deleted records stay out of every selection, and so do retired labels
+        self._facets.assign(labels, [rows.get(search_index_id) for search_index_id in ids.tolist()])
+        retired = labels[ids < 0]
+        self._facets.hide(retired)
+        self._stale = len(retired)
+
+    def _rebuild_index(self, chunk_size: int = 5000):
+        """
+        Rebuild from database - only called when table exists.
+        Rows are streamed in chunks, decoded into a reused float32 block and added one block at a time.
+        """
+        with self._disk_lock():
+            self._rebuild_locked(chunk_size)
+
+    def _rebuild_locked(self, chunk_size: int):
+        # Holding the lock: other writers merge their changes into this index once it is written
         print("Building vector index from database...")
-        self._index.reset()
-        self._index_map = []
+        started = time.perf_counter()
+        dimension = self._index.d
+        self._index = self._new_index(dimension)
+        self._facets.reset()
 
         # This is safe now because we know the table exists
-        for search_record in SearchIndex.objects.filter(
-                is_active=True,
-                embedding_vector__isnull=False
-        ):
-            vector = search_record.get_embedding()
-            if vector:
-                self._index.add(np.array(vector, dtype=np.float32).reshape(1, -1))
-                self._index_map.append(search_record.id)
-
-        self._persist_to_disk()
-        print(f"✓ Indexed {len(self._index_map)} documents")
-
-    def add_item(self, search_index_id: int, embedding: list):
-        """Add single item to index"""
-        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
-        self._index.add(vector)
-        self._index_map.append(search_index_id)
-        self._persist_to_disk()
+        rows = SearchIndex.objects.filter(is_active=True, embedding_vector__isnull=False)
+        total = rows.count()
+        block = np.empty((chunk_size, dimension), dtype=np.float32)
+        block_ids = np.empty(chunk_size, dtype=np.int64)
+        facet_rows = []
+        skipped = 0
+
+        for search_index_id, data, dtype, content_type_name, target_groups, regions in rows.values_list(
+                'id', 'embedding_vector', 'embedding_dtype', 'content_type_name', 'target_groups', 'regions'
+        ).iterator(chunk_size=chunk_size):
+            vector = decode_embedding(data, dtype)
+            if vector.shape != (dimension,):
+                skipped += 1
+                continue
+            block[len(facet_rows)] = vector
+            block_ids[len(facet_rows)] = search_index_id
+            facet_rows.append((content_type_name, target_groups, regions))
+
+            if len(facet_rows) == chunk_size:
+                self._append_block(block_ids, block, facet_rows)
+                facet_rows = []
+                print(f"  {self._index.ntotal}/{total} vectors ({time.perf_counter() - started:.1f}s)")
+
+        if facet_rows:
+            self._append_block(block_ids[:len(facet_rows)], block[:len(facet_rows)], facet_rows)
+        if self._untrained:
+            self._train_and_add_pending()  # Fewer rows than VECTOR_TRAIN_SIZE
+        if skipped:
+            print(f"⚠️ Skipped {skipped} embeddings that are not {dimension}-dimensional")
+        if self._zero_ids:
+            print(f"⚠️ Skipped {len(self._zero_ids)} zero embeddings (failed API calls) - re-embed them")
+
+        self._dirty = True
+        self._write_to_disk()  # Built from the database as a whole - nothing on disk to merge
+        print(f"✓ Indexed {self._index.ntotal} documents in {time.perf_counter() - started:.1f}s")
+
+    def _prepare(self, ids: np.ndarray, vectors: np.ndarray, facet_rows: list):
+        """Unit-length copy of a block with zero (failed) embeddings dropped and remembered"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.array(vectors, dtype=np.float32, order='C')  # Copy - normalize_L2 works in place
+        faiss.normalize_L2(vectors)  # Zero rows stay zero
+        nonzero = vectors.any(axis=1)
+        if not nonzero.all():
+            self._zero_ids.update(ids[~nonzero].tolist())
+            ids, vectors = ids[nonzero], vectors[nonzero]
+            facet_rows = [row for row, keep in zip(facet_rows, nonzero) if keep]
+        self._zero_ids.difference_update(ids.tolist())
+        return ids, vectors, facet_rows
+
+    def _append_block(self, ids: np.ndarray, vectors: np.ndarray, facet_rows: list):
+        """Add vectors for ids that are not in the index yet (rebuild only - no upsert check)"""
+        ids, vectors, facet_rows = self._prepare(ids, vectors, facet_rows)
+        if not self._index.is_trained:
+            # IVF/PQ need training first: hold blocks back until there is a big enough sample
+            self._untrained.append((ids, vectors, facet_rows))
+            if sum(len(pending_ids) for pending_ids, _, _ in self._untrained) >= settings.VECTOR_TRAIN_SIZE:
+                self._train_and_add_pending()
+            return
+        labels = self._labels.assign(ids)
+        self._index.add(vectors)  # Appended at positions `labels`
+        self._facets.assign(labels, facet_rows)
 
-    def search(self, query_embedding: list, filters: dict, top_k: int = 20):
-        """Search - ensures initialization first"""
+    def _train_and_add_pending(self):
+        """Train on the held-back blocks, then add them; falls back to Flat when there is too little data"""
+        pending, self._untrained = self._untrained, []
+        sample = np.concatenate([vectors for _, vectors, _ in pending])
+        try:
+            self.train(sample)
+        except RuntimeError as e:
+            print(f"⚠️ Could not train {self._factory} on {len(sample)} vectors ({e}), using Flat")
+            # Not _new_index(): that would also reset the zero-vector ids recorded so far. _factory keeps
+            # the requested type so the next load does not rebuild again
+            self._index = faiss.index_factory(self._index.d, 'Flat', faiss.METRIC_INNER_PRODUCT)
+        for ids, vectors, facet_rows in pending:
+            self._append_block(ids, vectors, facet_rows)
+
+    def train(self, sample: np.ndarray):
+        """Train an IVF/PQ index on a representative sample (no-op for Flat/HNSW)"""
+        if not self._index.is_trained:
+            print(f"Training {self._factory} on {len(sample)} vectors...")
+            self._index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+    def _retire(self, ids: np.ndarray) -> int:
+        """
+        Take the current vectors of ids out of search: they stay in FAISS under retired labels,
+        cleared from every selection bitmap, until compact(). Returns how many there were.
+        """
+        labels = self._labels.retire(ids)
+        self._stale += len(labels)
+        self._facets.hide(labels)
+        return len(labels)
+
+    def compact(self):
+        """Drop retired vectors: in place for Flat storage, by a rebuild from the database otherwise"""
         self.ensure_initialized()
+        if not self._stale:
+            return
+        if not self._can_compact():
+            self._rebuild_index()
+            return
+        self._make_writable()
+        vectors = self._index.reconstruct_n(0, self._index.ntotal)
+        keep = self._labels.compact()
+        self._index.reset()
+        self._index.add(vectors[keep])
+        self._facets.compact(keep)
+        self._stale = 0
+        self._dirty = True
 
-        # NEW: Rebuild if index is empty
-        if self._index.ntotal == 0:
-            print("⚠️ Index is empty, rebuilding...")
+    def _add_vectors(self, search_index_ids: list, vectors: np.ndarray, facet_rows: list):
+        """Upsert a block of vectors with their facet metadata (no disk write)"""
+        ids = np.asarray(search_index_ids, dtype=np.int64)
+        self._make_writable()
+        if not self._index.is_trained:
+            # Incremental writes before the first training rebuild: train on what the DB has
             self._rebuild_index()
+        self._pending.append(('upsert', ids, vectors, facet_rows))
+        # The old vector of an id whose new embedding failed is dropped too - it no longer matches the record
+        self._retire(ids)
 
-        # Rest of search code
-        query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
-        distances, indices = self._index.search(query_vector, top_k * 3)
+        ids, vectors, facet_rows = self._prepare(ids, vectors, facet_rows)
+        labels = self._labels.assign(ids)
+        self._index.add(vectors)  # Appended at positions `labels`
+        self._facets.assign(labels, facet_rows)
 
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx != -1 and idx < len(self._index_map):
-                search_index_id = self._index_map[idx]
-                if self._matches_filters(search_index_id, filters):
-                    results.append((search_index_id, float(distances[0][i])))
-                    if len(results) >= top_k:
-                        break
+    def upsert(self, search_index_id: int, embedding: list, content_type_name: str = None,
+               target_groups: list = None, regions: list = None):
+        """Add a vector or replace the existing one for this SearchIndex id"""
+        if content_type_name is None:
+            # Callers that don't pass filter metadata get it from the record
+            record = SearchIndex.objects.filter(id=search_index_id).values_list(
+                'content_type_name', 'target_groups', 'regions'
+            ).first()
+        else:
+            record = (content_type_name, target_groups or [], regions or [])
 
-        return results
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        self.upsert_many([search_index_id], vector, [record])
 
-    def _matches_filters(self, search_index_id: int, filters: dict) -> bool:
-        """Check if SearchIndex record matches filters"""
-        try:
-            record = SearchIndex.objects.get(id=search_index_id)
+    def upsert_many(self, search_index_ids: list, vectors: np.ndarray, facet_rows: list):
+        """Upsert a block of vectors with facet rows of (content_type_name, target_groups, regions)"""
+        with self._lock:
+            self.ensure_initialized()
+            self._add_vectors(search_index_ids, vectors, facet_rows)
+            self._persist_to_disk()
+
+    def indexed_ids(self) -> np.ndarray:
+        """SearchIndex ids that currently have a vector, in label order"""
+        with self._lock:
+            self.ensure_initialized()
+            label_ids = self._labels.label_ids()
+            return np.asarray(label_ids[label_ids >= 0])
+
+    def remove_ids(self, search_index_ids: list):
+        """Remove vectors by SearchIndex id without touching the database"""
+        if not search_index_ids:
+            return
+        with self._lock:
+            self.ensure_initialized()
+            if self._remove_vectors(np.asarray(search_index_ids, dtype=np.int64)):
+                self._persist_to_disk()
+
+    def _remove_vectors(self, ids: np.ndarray) -> int:
+        """Drop the vectors of ids (no disk write). Returns how many the index held"""
+        self._pending.append(('remove', ids))
+        self._zero_ids.difference_update(ids.tolist())
+        self._make_writable()
+        return self._retire(ids)
+
+    def matching_ids(self, search_index_ids: list, filters: dict) -> list:
+        """The ids (order kept) that pass the facet filters and are searchable"""
+        with self._lock:
+            self.ensure_initialized()
+            selection = self._facets.selection(filters or {})
+            if selection is None:
+                return list(search_index_ids)
+            labels = self._labels.labels(search_index_ids).tolist()
+            return [
+                search_index_id for search_index_id, label in zip(search_index_ids, labels)
+                if 0 <= label and label >> 3 < len(selection) and selection[label >> 3] >> (label & 7) & 1
+            ]
 
-            if content_types := filters.get('content_type'):
-                if record.content_type_name not in content_types:
-                    return False
+    def zero_vector_ids(self) -> list:
+        """SearchIndex ids skipped because their embedding was all zeros"""
+        return sorted(self._zero_ids)
 
-            if target_groups := filters.get('target_groups'):
-                if not any(tg in record.target_groups for tg in target_groups):
-                    return False
+    def stale_vectors(self) -> int:
+        """Vectors kept (hidden) for replaced/removed ids until compact()"""
+        return self._stale
 
-            if region_codes := filters.get('regions'):
-                if not any(str(r) in record.regions for r in region_codes):
-                    return False
+    def search(self, query_embedding: list, filters: dict, top_k: int = 20,
+               nprobe: int = None, ef_search: int = None, min_similarity: float = None):
+        """
+        Search - ensures initialization first. Returns [(search_index_id, cosine similarity)].
+        nprobe (IVF) and ef_search (HNSW) trade recall for speed; results below min_similarity
+        are dropped. Defaults come from settings.
+        """
+        # Reloads, flushes and upserts in other threads replace or change the index, label table
+        # and bitmaps in place: hold the lock so one query sees them all in a single state
+        with self._lock:
+            self.ensure_initialized()
+            self._reload_if_changed()
 
-            return True
-        except SearchIndex.DoesNotExist:
-            return False
+            # NEW: Rebuild if index is empty
+            if self._index.ntotal == 0:
+                print("⚠️ Index is empty, rebuilding...")
+                self._rebuild_index()
+
+            # Resolve filters to an ID bitmap and let FAISS search only inside it
+            selector = None
+            selection = self._facets.selection(filters or {})
+            if selection is not None:
+                if not selection.any():
+                    return []
+                selector = faiss.IDSelectorBitmap(selection)
+            params = self._search_params(selector, nprobe, ef_search)
+
+            query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+            faiss.normalize_L2(query_vector)
+            if not query_vector.any():
+                return []  # Failed query embedding - nothing is similar to it
+            distances, labels = self._index.search(query_vector, top_k, params=params)
+
+            if min_similarity is None:
+                min_similarity = settings.VECTOR_MIN_SIMILARITY
+            found = labels[0] != -1
+            ids = self._labels.ids(labels[0][found])
+            return [
+                (int(search_index_id), float(score))
+                for search_index_id, score in zip(ids, distances[0][found])
+                if search_index_id >= 0 and score >= min_similarity
+            ]
+
+    def _search_params(self, selector, nprobe: int = None, ef_search: int = None):
+        inner = self._inner_index()
+        if isinstance(inner, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF(nprobe=nprobe or settings.VECTOR_NPROBE)
+        elif isinstance(inner, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=ef_search or settings.VECTOR_EF_SEARCH)
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if selector is not None:
+            params.sel = selector  # Caller keeps `selector` referenced for the duration of the search
+        return params
 
     def _persist_to_disk(self):
-        """Save index and mapping to disk"""
-        index_path = os.path.join(settings.BASE_DIR, 'search_index.faiss')
-        mapping_path = os.path.join(settings.BASE_DIR, 'search_mapping.json')
+        """
+        Mark the index as changed; writes are debounced to one per VECTOR_PERSIST_INTERVAL seconds.
+        A change inside the interval arms a timer, so it reaches disk (and other workers) even if
+        no further write follows.
+        """
+        self._dirty = True
+        wait = self._last_flush + settings.VECTOR_PERSIST_INTERVAL - time.monotonic()
+        if wait <= 0:
+            self.flush()
+        elif self._persist and self._flush_timer is None:
+            self._flush_timer = threading.Timer(wait, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
 
-        faiss.write_index(self._index, index_path)
-        with open(mapping_path, 'w') as f:
-            json.dump(self._index_map, f)
+    def _timed_flush(self):
+        with self._lock:
+            self._flush_timer = None
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Could not write the index to disk: {e}")
+            finally:
+                connection.close()  # Merging may have queried the database from this thread
 
-    def remove_document(self, doc_id: int):
-        """Remove from index (rebuild for simplicity)"""
-        self.ensure_initialized()
-        self._rebuild_index()  # Clean rebuild
\ No newline at end of file
+    def flush(self):
+        """
+        Write pending changes to disk. If another process wrote the index since it was loaded
+        here, its version is loaded first and the changes made here are applied on top.
+        """
+        if not self._persist or not self._dirty:
+            return
+
+        with self._disk_lock():
+            if self._disk_signature() != self._loaded_signature:
+                try:
+                    self._sync_from_disk()
+                except EmbeddingModelMismatch:
+                    pass  # Vectors of the previous model, replaced by this index
+                except Exception as e:
+                    print(f"⚠️ Could not merge with the index on disk, overwriting it: {e}")
+            if self._can_compact() and self._stale > self.COMPACT_RATIO * self._index.ntotal:
+                self.compact()
+            self._write_to_disk()
+
+    def _write_to_disk(self):
+        """
+        Every file is replaced atomically and the mapping, written last, records checksums
+        of the others, so a mixed set is rejected on load.
+        """
+        if not self._persist:
+            return
+
+        index_path, mapping_path, ids_path = self._paths()
+        data = faiss.serialize_index(self._index).tobytes()
+        ids_buffer = io.BytesIO()
+        np.save(ids_buffer, np.asarray(self._labels.label_ids()))
+        ids_data = ids_buffer.getvalue()
+        mapping = {
+            'version': self.FORMAT_VERSION,
+            'ntotal': int(self._index.ntotal),
+            'dimension': int(self._index.d),
+            'factory': self._factory,
+            'embedding_model': services.embedding_service.model,
+            'index_size': len(data),
+            'index_sha256': hashlib.sha256(data).hexdigest(),
+            'ids_sha256': hashlib.sha256(ids_data).hexdigest(),
+            'zero_ids': sorted(self._zero_ids),  # Skipped records, reported by compact_index
+        }
+
+        _atomic_write(ids_path, ids_data)
+        _atomic_write(index_path, data)
+        _atomic_write(mapping_path, json.dumps(mapping).encode('utf-8'))
+        self._loaded_signature = self._disk_signature()
+        self._pending = []
+        self._dirty = False
+        self._last_flush = time.monotonic()
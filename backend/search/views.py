@@ -1,24 +1,18 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from django.contrib.contenttypes.models import ContentType
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 import json
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from .query_parser import QueryParser
-from .embedding_service import MistralEmbeddingService
-from .vector_store import InMemoryVectorStore
-from .models import SearchIndex
+from .hybrid import hybrid_search, prepare_query
+from .hydration import hydrate
+from .caching import query_embeddings
+from .services import services
 from benefits.models import Benefit, CommercialOffer
 
-# Global services
-query_parser = QueryParser()
-embedding_service = MistralEmbeddingService()
-vector_store = InMemoryVectorStore()
-
 
 class DocumentListView(LoginRequiredMixin, TemplateView):
     """Main page showing initial list of active benefits/offers"""
@@ -194,36 +188,23 @@ class NaturalLanguageSearchAPI(APIView):
         user_profile = getattr(request.user, 'userprofile', None)
         user_region = user_profile.region if user_profile else None
 
-        # 1. Parse natural language query
-        parsed = query_parser.parse(query_text, user_region)
-
-        # 2. Generate embedding
-        query_embedding = embedding_service.generate(f"query: {query_text}")
+        # 1-2. Parse the query and generate its embedding concurrently (each with a timeout)
+        parsed, query_embedding = prepare_query(services.query_parser, query_text, user_region)
 
-        # 3. Search in FAISS
-        search_results = vector_store.search(
+        # 3. Search in FAISS, fused with local keyword search (still works if the embedding failed)
+        search_results = hybrid_search(
+            query_text,
             query_embedding,
             filters=parsed['filters'],
             top_k=20
         )
 
-        # 4. Fetch full objects from database
-        search_ids = [sid for sid, _ in search_results]
-        search_records = SearchIndex.objects.filter(id__in=search_ids)
-
-        # 5. Attach similarity scores
-        similarity_dict = {sid: sim for sid, sim in search_results}
-
-        benefits = []
-        offers = []
+        # 4. Fetch full objects from database, in ranking order (a fixed number of queries)
+        results = hydrate(search_results)
 
-        for record in search_records:
-            record.search_similarity = similarity_dict.get(record.id, 0)
-
-            if record.content_type_name == 'benefit':
-                benefits.append(record.content_object)
-            elif record.content_type_name == 'commercial':
-                offers.append(record.content_object)
+        # 5. Split by type; each object carries its search_similarity
+        benefits = [obj for obj in results if isinstance(obj, Benefit)]
+        offers = [obj for obj in results if isinstance(obj, CommercialOffer)]
 
         # 6. Log search history
         if user_profile:
@@ -239,12 +220,7 @@ class NaturalLanguageSearchAPI(APIView):
                 'requirements': b.requirements,
                 'how_to_get': b.how_to_get,
                 'regions': [r.name for r in b.regions.all()[:3]],
-                'similarity': similarity_dict.get(
-                    SearchIndex.objects.get(
-                        content_type=ContentType.objects.get_for_model(Benefit),
-                        object_id=b.id
-                    ).id, 0
-                )
+                'similarity': b.search_similarity
             } for b in benefits[:10]],
             'offers': [{
                 'id': o.id,
@@ -254,12 +230,7 @@ class NaturalLanguageSearchAPI(APIView):
                 'discount_description': o.discount_description,
                 'how_to_use': o.how_to_use,
                 'regions': [r.name for r in o.regions.all()[:3]],
-                'similarity': similarity_dict.get(
-                    SearchIndex.objects.get(
-                        content_type=ContentType.objects.get_for_model(CommercialOffer),
-                        object_id=o.id
-                    ).id, 0
-                )
+                'similarity': o.search_similarity
             } for o in offers[:10]],
             'total_benefits': len(benefits),
             'total_offers': len(offers)
@@ -386,4 +357,21 @@ class MixedSearchResultsView(APIView):
             except Exception as e:
                 continue  # Skip invalid items
 
-        return Response(results)
\ No newline at end of file
+        return Response(results)
+
+
+class SearchCacheStatsView(APIView):
+    """Hit rates of this worker's search caches"""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary='Статистика кэшей поиска',
+        operation_description='Размер и доля попаданий кэшей эмбеддингов и разбора запросов в текущем процессе',
+        responses={200: openapi.Response(description='Статистика кэшей')},
+        tags=['Поиск']
+    )
+    def get(self, request):
+        return Response({
+            'query_embeddings': query_embeddings.stats(),
+            'query_parser': services.query_parser.stats(),
+        })
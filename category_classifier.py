@@ -0,0 +1,114 @@
+"""
+Local first-pass classifier for preprocess_categories.py
+
+Scores each document against a keyword lexicon per category (word-prefix matches, header
+words count triple) and returns the best category with a confidence in [0, 1]. The seed
+lexicon is extended by train() from rows the LLM has already categorized. Only documents
+below the confidence threshold need an LLM call.
+"""
+import csv
+import re
+import sys
+from collections import Counter, defaultdict
+
+csv.field_size_limit(sys.maxsize)
+
+_WORD_RE = re.compile(r'\w+')
+
+# Word prefixes that point to a category; matched against lowercased words
+SEED_LEXICON = {
+    "Пенсионное обеспечение": ['пенси', 'стаж', 'накопительн', 'досрочн', 'выслуг', 'пфр'],
+    "Технические средства реабилитации": ['тср', 'реабилит', 'протез', 'коляск', 'слухов', 'тифло', 'сурдо',
+                                          'ортопед', 'абилитац', 'подгузник'],
+    "Медицинская помощь": ['медицин', 'лекарств', 'санатор', 'лечени', 'лечебн', 'врач', 'больниц', 'здоровь'],
+    "Социальные выплаты": ['выплат', 'пособи', 'компенсац', 'едв', 'доплат', 'материнск', 'капитал', 'нсу'],
+    "Образование": ['образован', 'обучени', 'учеб', 'студент', 'школ', 'вуз', 'колледж'],
+    "Жилищные льготы": ['жиль', 'жилищ', 'жилом', 'квартир', 'коммунальн', 'жку', 'ипотек'],
+    "Транспортные льготы": ['транспорт', 'проезд', 'автомоб', 'парков', 'билет', 'поезд', 'авиа', 'такси'],
+    "Налоговые льготы": ['налог', 'вычет', 'ндфл'],
+    "Трудоустройство": ['трудоустр', 'работодател', 'занятост', 'вакан', 'квотирован', 'безработ'],
+    "Юридическая помощь": ['юрид', 'правов', 'адвокат', 'нотари', 'суд'],
+}
+
+HEADER_WEIGHT = 3.0
+EVIDENCE_DAMPING = 1.0  # Added to the total, so a single weak hit is never fully confident
+MAX_HITS_PER_WORD = 3  # A word repeated all over a long text shouldn't decide alone
+TEXT_CHARS = 2000
+
+
+class CategoryClassifier:
+    def __init__(self, lexicon: dict = None, fallback: str = "Другое"):
+        # category -> {prefix: weight}
+        self.lexicon = defaultdict(dict)
+        for category, prefixes in (lexicon or SEED_LEXICON).items():
+            for prefix in prefixes:
+                self.lexicon[category][prefix] = 1.0
+        self.fallback = fallback
+        self.learned = 0
+
+    def _words(self, text: str) -> Counter:
+        return Counter(_WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+    def scores(self, header: str, text: str) -> dict:
+        header_words = self._words(header or '')
+        text_words = self._words((text or '')[:TEXT_CHARS])
+        scores = {}
+        for category, prefixes in self.lexicon.items():
+            score = 0.0
+            for words, weight in ((header_words, HEADER_WEIGHT), (text_words, 1.0)):
+                for word, count in words.items():
+                    for prefix, prefix_weight in prefixes.items():
+                        if word.startswith(prefix):
+                            score += weight * prefix_weight * min(count, MAX_HITS_PER_WORD)
+                            break
+            if score:
+                scores[category] = score
+        return scores
+
+    def classify(self, header: str, text: str) -> tuple:
+        """
+        (category, confidence). Confidence is the winner's share of all evidence, damped
+        when there is little evidence at all; no matching words gives (fallback, 0.0).
+        """
+        scores = self.scores(header, text)
+        if not scores:
+            return self.fallback, 0.0
+        category = max(scores, key=scores.get)
+        return category, scores[category] / (sum(scores.values()) + EVIDENCE_DAMPING)
+
+    def train(self, rows, min_count: int = 3, min_share: float = 0.8) -> int:
+        """
+        Learn extra words from categorized rows ({'header', 'text', 'category'}): a word seen
+        in at least `min_count` documents, `min_share` of them in one category, is added to
+        that category's lexicon. Returns the number of words learned.
+        """
+        documents = defaultdict(Counter)  # word -> category -> documents
+        for row in rows:
+            category = row.get('category')
+            if category not in self.lexicon:
+                continue
+            words = self._words(f"{row.get('header', '')} {(row.get('text') or '')[:TEXT_CHARS]}")
+            for word in words:
+                if len(word) > 4:
+                    documents[word][category] += 1
+
+        learned = 0
+        for word, categories in documents.items():
+            total = sum(categories.values())
+            category, count = categories.most_common(1)[0]
+            if total >= min_count and count / total >= min_share:
+                if not any(word.startswith(prefix) for prefix in self.lexicon[category]):
+                    self.lexicon[category][word] = 0.5 * count / total
+                    learned += 1
+        self.learned += learned
+        return learned
+
+    def train_from_csv(self, path: str, sources=('llm', '')) -> int:
+        """
+        train() on a categorized CSV, e.g. an earlier preprocess_categories.py output.
+        Only rows whose category_source is in `sources` are used ('' = files without the column),
+        so the classifier doesn't learn from its own guesses.
+        """
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = [row for row in csv.DictReader(f) if (row.get('category_source') or '') in sources]
+        return self.train(rows)
@@ -1,19 +1,33 @@
 """
 Script to preprocess sfr_invalidam_data.csv and categorize documents using Mistral API
+
+Documents are streamed through a bounded number of concurrent requests, several documents
+per prompt, paced by a token bucket that slows down on 429 responses. Every finished batch
+is appended to the output CSV, which doubles as the checkpoint: rerunning the script skips
+documents that are already there.
+
+    python preprocess_categories.py                 # categorize (resumes if interrupted)
+    python preprocess_categories.py --test          # first 5 documents only
+    python preprocess_categories.py --dry-run       # local stub client, measures throughput
+
+A local keyword classifier (category_classifier.py) categorizes documents it is confident
+about without an API call; a sample of those is still sent to the LLM to measure agreement.
 """
+import argparse
+import asyncio
 import csv
+import json
 import os
+import random
+import re
+import sys
 import time
 from dotenv import load_dotenv
-from mistralai import Mistral
+from category_classifier import CategoryClassifier
 
 # Load environment variables
 load_dotenv()
 
-# Get API key and initialize Mistral client
-mistral_api_key = os.getenv('MISTRAL_API_KEY')
-mistral_client = Mistral(api_key=mistral_api_key)
-
 # Define possible categories
 CATEGORIES = [
     "Пенсионное обеспечение",
@@ -29,93 +43,358 @@ CATEGORIES = [
     "Другое"
 ]
 
-def categorize_document(header: str, text: str) -> str:
-    """
-    Use Mistral API to categorize a document based on header and text
-    """
-    prompt = f"""Определи категорию для следующего документа о льготах для инвалидов.
+# category_source: 'local' (keyword classifier, with its confidence) or 'llm'
+# change: carried over from an incremental sfr_parser.py crawl ('added', 'changed' or 'removed')
+FIELDNAMES = ['id', 'url', 'header', 'text', 'category', 'category_source', 'confidence', 'change']
+
+csv.field_size_limit(sys.maxsize)
 
-Заголовок: {header}
-Текст: {text[:500]}...
 
-Выбери ОДНУ наиболее подходящую категорию из списка:
+def match_category(answer: str) -> str:
+    """Map a model answer to one of CATEGORIES"""
+    answer = answer.strip().strip('."\'')
+    if answer in CATEGORIES:
+        return answer
+    # Try to find closest match
+    for cat in CATEGORIES:
+        if cat.lower() in answer.lower() or answer.lower() in cat.lower():
+            return cat
+    return "Другое"
+
+
+def build_prompt(documents: list) -> str:
+    """One prompt for a batch of documents; the answer is a JSON object {number: category}"""
+    parts = [
+        f"Документ {number}\nЗаголовок: {row['header']}\nТекст: {row['text'][:500]}..."
+        for number, row in enumerate(documents, 1)
+    ]
+    return f"""Определи категорию для каждого из следующих документов о льготах для инвалидов.
+
+{chr(10).join(parts)}
+
+Для каждого документа выбери ОДНУ наиболее подходящую категорию из списка:
 {', '.join(CATEGORIES)}
 
-Ответь ТОЛЬКО названием категории, без дополнительных объяснений."""
+Ответь ТОЛЬКО JSON-объектом вида {{"1": "категория", "2": "категория"}}, без дополнительных объяснений."""
 
+
+def parse_answer(content: str, count: int) -> list:
+    """Categories for `count` documents from the model's JSON answer; unreadable entries become "Другое" """
+    match = re.search(r'\{.*\}', content, re.DOTALL)
     try:
-        # Call Mistral API (using small model for categorization to save on rate limits)
-        response = mistral_client.chat.complete(
-            model="mistral-small-latest",  # Cheaper and faster for simple categorization
-            messages=[
-                {'role': 'user', 'content': prompt}
-            ],
-            temperature=0.3,
-            max_tokens=50
-        )
-
-        category = response.choices[0].message.content.strip()
-
-        # Validate that the category is in our list
-        if category in CATEGORIES:
-            return category
-        else:
-            # Try to find closest match
-            for cat in CATEGORIES:
-                if cat.lower() in category.lower() or category.lower() in cat.lower():
-                    return cat
-            return "Другое"
-
-    except Exception as e:
-        print(f"Error categorizing: {e}")
-        return "Другое"
-
-
-def preprocess_csv(input_file: str, output_file: str):
+        answer = json.loads(match.group(0)) if match else {}
+    except json.JSONDecodeError:
+        answer = {}
+    categories = []
+    for number in range(1, count + 1):
+        category = str(answer.get(str(number), '')).strip()
+        # match_category() would match an empty answer to the first category
+        categories.append(match_category(category) if category else "Другое")
+    return categories
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__('429 Too Many Requests')
+        self.retry_after = retry_after
+
+
+def rate_limit_info(error):
+    """(is_429, Retry-After seconds or None) for an API error"""
+    response = getattr(error, 'raw_response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if isinstance(error, RateLimited):
+        return True, error.retry_after
+    if status != 429:
+        return False, None
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        return True, float(retry_after) if retry_after else None
+    except ValueError:
+        return True, None
+
+
+class TokenBucket:
     """
-    Read CSV, categorize each document, and save to new CSV with category column
+    Request pacing: `rate` requests per second with bursts up to `capacity`.
+    Halves the rate on a 429 and creeps back up by `recovery` (default 5% of the starting
+    rate) per successful request - additive increase, multiplicative decrease - never above
+    the starting rate.
     """
-    print(f"Reading {input_file}...")
 
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        reader = csv.DictReader(infile)
-        rows = list(reader)
+    def __init__(self, rate: float, capacity: float = 1.0, min_rate: float = 0.05, recovery: float = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.recovery = recovery if recovery is not None else rate * 0.05
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_rate_limited(self, retry_after=None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or 1 / self.rate))
+
+
+class StubClient:
+    """
+    Offline stand-in for the Mistral client (--dry-run): answers after `latency` seconds,
+    returns 429 above `limit` requests per second, picks categories by keywords.
+    """
+    KEYWORDS = {
+        'пенси': "Пенсионное обеспечение", 'реабилит': "Технические средства реабилитации",
+        'медицин': "Медицинская помощь", 'выплат': "Социальные выплаты", 'образован': "Образование",
+        'жиль': "Жилищные льготы", 'транспорт': "Транспортные льготы", 'налог': "Налоговые льготы",
+        'работ': "Трудоустройство", 'юрид': "Юридическая помощь",
+    }
+
+    def __init__(self, latency: float = 0.5, limit: float = 5.0):
+        self.latency = latency
+        self.limit = limit
+        self.calls = []
+        self.chat = self
+
+    async def complete_async(self, model, messages, **kwargs):
+        now = time.monotonic()
+        self.calls = [t for t in self.calls if now - t < 1.0]
+        if len(self.calls) >= self.limit:
+            raise RateLimited(retry_after=None)
+        self.calls.append(now)
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        documents = re.split(r'\nДокумент \d+\n', '\n' + messages[0]['content'])[1:]
+        answer = {}
+        for number, document in enumerate(documents, 1):
+            text = document.lower()
+            answer[str(number)] = next((cat for key, cat in self.KEYWORDS.items() if key in text), "Другое")
+        message = type('Message', (), {'content': json.dumps(answer, ensure_ascii=False)})
+        return type('Response', (), {'choices': [type('Choice', (), {'message': message})]})
+
+
+class CategorizationPipeline:
+    def __init__(self, client, bucket: TokenBucket, concurrency: int, batch_size: int, max_retries: int = 5,
+                 classifier: CategoryClassifier = None, min_confidence: float = 0.7, audit_rate: float = 0.1):
+        self.client = client
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.classifier = classifier
+        self.min_confidence = min_confidence
+        self.audit_rate = audit_rate
+        self._audit_random = random.Random(0)
+        self.requests = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.local = 0  # Categorized by the classifier alone
+        self.sent_to_llm = 0
+        # (agreeing, total) between the classifier and the LLM
+        self.audited = [0, 0]  # Confident rows also sent to the LLM
+        self.uncertain = [0, 0]  # Rows below min_confidence
+
+    def _route(self, row) -> bool:
+        """Classify locally; True if the row still needs the LLM"""
+        if self.classifier is None:
+            return True
+        category, confidence = self.classifier.classify(row['header'], row['text'])
+        row['_local'] = category
+        row['_confident'] = confidence >= self.min_confidence
+        if row['_confident'] and self._audit_random.random() >= self.audit_rate:
+            row.update(category=category, category_source='local', confidence=f'{confidence:.2f}')
+            return False
+        return True
+
+    def report(self, total: int) -> list:
+        """Summary lines: classifier/LLM split, API calls saved, agreement"""
+        calls_without_classifier = -(-total // self.batch_size)
+        calls_needed = -(-self.sent_to_llm // self.batch_size)
+        lines = [
+            f"Classified locally: {self.local}, sent to LLM: {self.sent_to_llm}",
+            f"API calls saved: {calls_without_classifier - calls_needed} of {calls_without_classifier}",
+        ]
+        for label, (agreeing, count) in (('confident, audited', self.audited),
+                                         ('below threshold', self.uncertain)):
+            if count:
+                lines.append(f"Classifier/LLM agreement ({label}): {agreeing}/{count} = {agreeing / count:.0%}")
+        return lines
 
-    print(f"Found {len(rows)} documents to categorize")
+    async def categorize_batch(self, documents: list):
+        """
+        Categories for a batch of rows, or None after max_retries errors. 429s are not
+        counted as errors: the bucket slows down and the request is retried.
+        """
+        prompt = build_prompt(documents)
+        errors = 0
+        while errors < self.max_retries:
+            await self.bucket.acquire()
+            self.requests += 1
+            try:
+                # Call Mistral API (using small model for categorization to save on rate limits)
+                response = await self.client.chat.complete_async(
+                    model="mistral-small-latest",  # Cheaper and faster for simple categorization
+                    messages=[
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    temperature=0.3,
+                    max_tokens=30 * len(documents) + 20
+                )
+                self.bucket.on_success()
+                return parse_answer(response.choices[0].message.content, len(documents))
+            except Exception as e:
+                is_429, retry_after = rate_limit_info(e)
+                if is_429:
+                    self.rate_limited += 1
+                    self.bucket.on_rate_limited(retry_after)
+                else:
+                    errors += 1
+                    print(f"Error categorizing (attempt {errors}): {e}")
+                    await asyncio.sleep(2 ** errors)
+        return None
 
-    # Process each row
-    categorized_rows = []
-    for i, row in enumerate(rows, 1):
-        print(f"\nProcessing document {i}/{len(rows)}: {row['header'][:50]}...")
+    async def run(self, rows, writer, outfile):
+        """Categorize an iterable of rows, appending each finished batch to writer"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)  # Bounded: rows are read as workers free up
+        done = 0
+        started = time.monotonic()
 
-        category = categorize_document(row['header'], row['text'])
-        print(f"  Category: {category}")
+        def write(batch):
+            for row in batch:
+                writer.writerow({field: row.get(field, '') for field in FIELDNAMES})
+            outfile.flush()
+            os.fsync(outfile.fileno())
 
-        # Add category to row
-        row['category'] = category
-        categorized_rows.append(row)
+        async def worker():
+            nonlocal done
+            while (batch := await queue.get()) is not None:
+                categories = await self.categorize_batch(batch)
+                if categories is None:
+                    # Left out of the output, so the next run retries them
+                    self.failed += len(batch)
+                    continue
+                for row, category in zip(batch, categories):
+                    row.update(category=category, category_source='llm', confidence='')
+                    if '_local' in row:
+                        agreement = self.audited if row['_confident'] else self.uncertain
+                        agreement[0] += row['_local'] == category
+                        agreement[1] += 1
+                write(batch)
+                done += len(batch)
+                elapsed = time.monotonic() - started
+                print(f"  {done} documents categorized ({done / elapsed:.2f} docs/s, "
+                      f"rate {self.bucket.rate:.2f} req/s, {self.rate_limited} x 429)")
 
-        # Add delay to avoid rate limits (Mistral free tier has limits)
-        if i < len(rows):
-            print("  Waiting 2 seconds to avoid rate limit...")
-            time.sleep(2)
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        batch = []
+        for row in rows:
+            if row.get('change') == 'removed':
+                write([row])  # Nothing to categorize; passed on so the import deletes it
+                done += 1
+                continue
+            if not self._route(row):
+                write([row])
+                self.local += 1
+                done += 1
+                continue
+            self.sent_to_llm += 1
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                await queue.put(batch)
+                batch = []
+        if batch:
+            await queue.put(batch)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        return done, time.monotonic() - started
 
-    # Write to output CSV
-    print(f"\nSaving categorized data to {output_file}...")
-    fieldnames = ['id', 'url', 'header', 'text', 'category']
 
-    with open(output_file, 'w', encoding='utf-8', newline='') as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+def load_checkpoint(output_file: str) -> set:
+    """
+    Ids already categorized in output_file. The file is rewritten without a row cut off
+    by a crash, so appending can continue from a clean state.
+    """
+    if not os.path.exists(output_file):
+        return set()
+    with open(output_file, 'r', encoding='utf-8', newline='') as f:
+        rows = [row for row in csv.DictReader(f)
+                if row.get('category') in CATEGORIES or row.get('change') == 'removed']
+
+    temp_file = f"{output_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
         writer.writeheader()
-        writer.writerows(categorized_rows)
+        writer.writerows(rows)
+    os.replace(temp_file, output_file)
+    return {row['id'] for row in rows}
+
 
-    print(f"\n✓ Successfully preprocessed {len(categorized_rows)} documents")
+def pending_rows(input_file: str, done_ids: set, limit: int = None):
+    """Stream input rows that are not categorized yet"""
+    with open(input_file, 'r', encoding='utf-8', newline='') as infile:
+        for i, row in enumerate(csv.DictReader(infile)):
+            if limit is not None and i >= limit:
+                break
+            if row['id'] not in done_ids:
+                yield row
+
+
+def preprocess_csv(input_file: str, output_file: str, client, concurrency: int = 4, batch_size: int = 5,
+                   rate: float = 1.0, limit: int = None, classifier: CategoryClassifier = None,
+                   min_confidence: float = 0.7, audit_rate: float = 0.1):
+    """
+    Read CSV, categorize each document, and append it to the output CSV with a category column
+    """
+    print(f"Reading {input_file}...")
+    done_ids = load_checkpoint(output_file)
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} documents already in {output_file}")
+        if classifier is not None:
+            # Earlier LLM answers teach the classifier more words
+            print(f"Classifier learned {classifier.train_from_csv(output_file)} words from {output_file}")
+
+    pipeline = CategorizationPipeline(client, TokenBucket(rate, capacity=max(1.0, rate)), concurrency, batch_size,
+                                      classifier=classifier, min_confidence=min_confidence, audit_rate=audit_rate)
+    with open(output_file, 'a', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=FIELDNAMES)
+        if not done_ids:
+            writer.writeheader()
+        done, elapsed = asyncio.run(pipeline.run(pending_rows(input_file, done_ids, limit), writer, outfile))
+
+    print(f"\n✓ Successfully preprocessed {done} documents in {elapsed:.1f}s "
+          f"({done / elapsed if elapsed else 0:.2f} docs/s)")
+    print(f"  Requests: {pipeline.requests}, rate limited: {pipeline.rate_limited}, "
+          f"failed documents (rerun to retry): {pipeline.failed}")
+    if classifier is not None:
+        for line in pipeline.report(done + pipeline.failed):
+            print(f"  {line}")
 
     # Show category distribution
     category_counts = {}
-    for row in categorized_rows:
-        cat = row['category']
-        category_counts[cat] = category_counts.get(cat, 0) + 1
+    with open(output_file, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            cat = row['category']
+            if cat:
+                category_counts[cat] = category_counts.get(cat, 0) + 1
 
     print("\nCategory distribution:")
     for cat, count in sorted(category_counts.items(), key=lambda x: x[1], reverse=True):
@@ -123,41 +402,55 @@ def preprocess_csv(input_file: str, output_file: str):
 
 
 if __name__ == '__main__':
-    import sys
-
-    input_file = 'sfr_invalidam_data.csv'
-    output_file = 'sfr_invalidam_data_categorized.csv'
+    parser = argparse.ArgumentParser(description='Categorize sfr_invalidam_data.csv documents')
+    parser.add_argument('--input', default='sfr_invalidam_data.csv')
+    parser.add_argument('--output', default=None, help='Output CSV (also the resume checkpoint)')
+    parser.add_argument('--test', action='store_true', help='Process only the first 5 documents')
+    parser.add_argument('--concurrency', type=int, default=4, help='Requests in flight at once')
+    parser.add_argument('--batch-size', type=int, default=5, help='Documents per prompt')
+    parser.add_argument('--rate', type=float, default=1.0, help='Starting (and maximum) requests per second')
+    parser.add_argument('--restart', action='store_true', help='Ignore existing output instead of resuming')
+    parser.add_argument('--no-classifier', action='store_true', help='Send every document to the LLM')
+    parser.add_argument('--min-confidence', type=float, default=0.7,
+                        help='Classifier confidence needed to skip the LLM')
+    parser.add_argument('--audit-rate', type=float, default=0.1,
+                        help='Share of confident documents still sent to the LLM to measure agreement')
+    parser.add_argument('--train-from', action='append', default=[],
+                        help='Categorized CSV to extend the classifier lexicon from (repeatable)')
+    parser.add_argument('--dry-run', action='store_true', help='Use a local stub client instead of the API')
+    parser.add_argument('--stub-latency', type=float, default=0.5, help='Stub response time in seconds')
+    parser.add_argument('--stub-limit', type=float, default=5.0, help='Stub requests per second before 429')
+    args = parser.parse_args()
 
-    if not os.path.exists(input_file):
-        print(f"Error: {input_file} not found!")
+    if not os.path.exists(args.input):
+        print(f"Error: {args.input} not found!")
         exit(1)
 
-    # Check if user wants to test with limited documents
-    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+    output_file = args.output or (
+        'sfr_invalidam_data_categorized_dryrun.csv' if args.dry_run
+        else 'sfr_invalidam_data_categorized_test.csv' if args.test
+        else 'sfr_invalidam_data_categorized.csv'
+    )
+    if args.restart and os.path.exists(output_file):
+        os.remove(output_file)
+
+    if args.dry_run:
+        print(f"DRY RUN: stub client, {args.stub_latency}s latency, 429 above {args.stub_limit} req/s\n")
+        client = StubClient(args.stub_latency, args.stub_limit)
+    else:
+        from mistralai import Mistral
+        client = Mistral(api_key=os.getenv('MISTRAL_API_KEY'))
+
+    if args.test:
         print("TEST MODE: Processing only first 5 documents")
         print("Run without --test flag to process all documents\n")
-        # Modify the function to process only 5 documents in test mode
-        import csv
-        with open(input_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)[:5]  # Only first 5
-
-        categorized_rows = []
-        for i, row in enumerate(rows, 1):
-            print(f"\nProcessing document {i}/5: {row['header'][:50]}...")
-            category = categorize_document(row['header'], row['text'])
-            print(f"  Category: {category}")
-            row['category'] = category
-            categorized_rows.append(row)
-            if i < len(rows):
-                print("  Waiting 2 seconds...")
-                time.sleep(2)
-
-        output_file = 'sfr_invalidam_data_categorized_test.csv'
-        with open(output_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['id', 'url', 'header', 'text', 'category'])
-            writer.writeheader()
-            writer.writerows(categorized_rows)
-        print(f"\nTest complete! Saved to {output_file}")
-    else:
-        preprocess_csv(input_file, output_file)
+
+    classifier = None
+    if not args.no_classifier:
+        classifier = CategoryClassifier()
+        for path in args.train_from:
+            print(f"Classifier learned {classifier.train_from_csv(path)} words from {path}")
+
+    preprocess_csv(args.input, output_file, client, args.concurrency, args.batch_size, args.rate,
+                   limit=5 if args.test else None, classifier=classifier,
+                   min_confidence=args.min_confidence, audit_rate=args.audit_rate)
@@ -0,0 +1,632 @@
+#!/usr/bin/env python
+"""
+Crawler core for sfr_parser.py
+
+Every page is fetched once; its header, text and links come from the same soup. A bounded
+pool of worker threads fetches pages while a per-host rate limiter spaces out requests to
+the same host, instead of sleeping after every page.
+
+A CrawlState (SQLite file) remembers each page's ETag/Last-Modified and content hash, so a
+re-crawl sends conditional requests and reports pages as added, changed, unchanged or removed.
+It also holds the frontier and visited set of the current run: memory stays flat however
+large the crawl, and an interrupted run resumes where it stopped.
+
+    python sfr_crawler.py --serve                 # replay backend/debug_*.html on localhost
+    python sfr_crawler.py --benchmark             # crawl the replayed pages, 1 worker vs N
+    python sfr_crawler.py --resume-benchmark      # memory and stop/resume on a generated site
+
+The fixture server maps /grazhdanam/<name>/ to backend/debug_<name>.html and answers every
+page below it with the same HTML, so crawls of the replayed site are deterministic.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urldefrag, urljoin, urlparse
+
+from bs4 import BeautifulSoup
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'backend'
+TREE_PREFIX = '/grazhdanam/tree/'
+
+
+def normalize_url(url: str) -> str:
+    """Drop the #fragment, which names a place on the same page"""
+    return urldefrag(url)[0]
+
+
+def _paragraphs(container, tags) -> str:
+    parts = []
+    for element in container.find_all(tags):
+        text = element.get_text(strip=True)
+        if text and len(text) > 5:
+            parts.append(text)
+    return "\n".join(parts)
+
+
+def parse_page(html, url: str) -> tuple:
+    """(header, text, links) of a page from a single parse; links are absolute, without fragments"""
+    soup = BeautifulSoup(html, 'lxml')
+
+    header = soup.find('h1', class_='re-container__head-title')
+    header_text = header.get_text(strip=True) if header else "No header"
+
+    content_text = ""
+    content_div = soup.find('div', class_=re.compile(r'section-content collapse show'))
+    if content_div:
+        content_text = _paragraphs(content_div, ['p', 'li', 'div'])
+
+    # If no content found in section-content, try other containers
+    if not content_text:
+        content_div = soup.find('div', class_='re-container__inner-left')
+        if content_div:
+            content_text = _paragraphs(content_div, ['p', 'li'])
+
+    links = {normalize_url(urljoin(url, link['href'])) for link in soup.find_all('a', href=True)}
+    return header_text, content_text, links
+
+
+class HostRateLimiter:
+    """
+    At most `rate` requests per second to each host. Threads reserve the next free slot
+    for their host under the lock and sleep outside it, so other hosts are not held up.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = {}  # host -> monotonic time of the next free slot
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,  -- NULL while the run can be resumed
+    output_path TEXT,
+    output_offset INTEGER NOT NULL DEFAULT 0  -- Bytes of output_path that belong to committed pages
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Stable record id across crawls
+    url TEXT NOT NULL UNIQUE,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT NOT NULL,
+    links TEXT NOT NULL,  -- JSON list of in-scope links, followed again when the page is unchanged
+    crawled_run INTEGER NOT NULL
+);
+-- Frontier and visited set of the current run; a URL leaves the frontier once its page is committed
+CREATE TABLE IF NOT EXISTS frontier (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Queue order
+    url TEXT NOT NULL UNIQUE,
+    scope TEXT NOT NULL  -- Start URL of the crawl that queued it
+);
+CREATE TABLE IF NOT EXISTS visited (
+    url TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+# Responses that mean a page is gone; other failures keep the page's last known state
+GONE_STATUSES = {404, 410}
+
+
+def content_hash(header: str, text: str) -> str:
+    """Hash of the extracted text with whitespace collapsed, so markup-only changes don't count"""
+    normalized = ' '.join(f"{header}\n{text}".split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class MemoryFrontier:
+    """Frontier and visited set in memory, for crawls without a CrawlState"""
+
+    def __init__(self):
+        self.visited = set()
+        self.pending = defaultdict(deque)  # scope -> URLs
+
+    def add(self, url: str, scope: str) -> bool:
+        """Queue url unless it was seen before; True if queued"""
+        if url in self.visited:
+            return False
+        self.visited.add(url)
+        self.pending[scope].append(url)
+        return True
+
+    def pop(self, scope: str):
+        queue = self.pending[scope]
+        return queue.popleft() if queue else None
+
+    def done(self, url: str):
+        pass
+
+    def commit(self):
+        pass
+
+
+class CrawlState:
+    """
+    Crawl state in a SQLite file. Per URL: ETag/Last-Modified for conditional requests, the
+    content hash, the page's links and a stable record id. Per run: the frontier, the visited
+    set and how much of the output file is committed, so an interrupted run resumes exactly
+    where it stopped. Only the thread iterating Crawler.crawl() uses it.
+
+    Changes are committed by commit(): Crawler calls it after the consumer has handled each
+    page, so a page's state, its frontier updates and its output offset land together.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self._migrate()
+        self.run = None
+        self._cursor = {}  # scope -> frontier id of the last URL handed out
+
+    def _migrate(self):
+        """Add the resume columns to state files from before they existed"""
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(runs)")}
+        if 'finished_at' not in columns:
+            with self.db:
+                self.db.execute("ALTER TABLE runs ADD COLUMN finished_at REAL")
+                self.db.execute("ALTER TABLE runs ADD COLUMN output_path TEXT")
+                self.db.execute("ALTER TABLE runs ADD COLUMN output_offset INTEGER NOT NULL DEFAULT 0")
+                self.db.execute("UPDATE runs SET finished_at = started_at")
+
+    def begin_run(self) -> bool:
+        """
+        Resume the unfinished run if there is one (True), otherwise start a new one (False).
+        Pages not crawled again before removed() is called count as removed.
+        """
+        row = self.db.execute("SELECT id FROM runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1").fetchone()
+        self._cursor = {}
+        if row:
+            self.run = row[0]
+            return True
+        with self.db:
+            self.run = self.db.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),)).lastrowid
+            self.db.execute("DELETE FROM frontier")
+            self.db.execute("DELETE FROM visited")
+        return False
+
+    def finish_run(self):
+        with self.db:
+            self.db.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), self.run))
+            self.db.execute("DELETE FROM frontier")
+            self.db.execute("DELETE FROM visited")
+
+    def output(self) -> tuple:
+        """(output_path, committed bytes) of the current run"""
+        return self.db.execute("SELECT output_path, output_offset FROM runs WHERE id = ?", (self.run,)).fetchone()
+
+    def set_output(self, path: str, offset: int):
+        self.db.execute("UPDATE runs SET output_path = ?, output_offset = ? WHERE id = ?", (path, offset, self.run))
+
+    def commit(self):
+        self.db.commit()
+
+    # Frontier
+
+    def add(self, url: str, scope: str) -> bool:
+        """Queue url unless this run has seen it; True if queued"""
+        if self.db.execute("INSERT OR IGNORE INTO visited (url) VALUES (?)", (url,)).rowcount == 0:
+            return False
+        self.db.execute("INSERT INTO frontier (url, scope) VALUES (?, ?)", (url, scope))
+        return True
+
+    def pop(self, scope: str):
+        """Next queued URL of the scope; it stays queued (and is handed out again after a restart) until done()"""
+        row = self.db.execute(
+            "SELECT id, url FROM frontier WHERE scope = ? AND id > ? ORDER BY id LIMIT 1",
+            (scope, self._cursor.get(scope, 0))
+        ).fetchone()
+        if row is None:
+            return None
+        self._cursor[scope] = row[0]
+        return row[1]
+
+    def done(self, url: str):
+        self.db.execute("DELETE FROM frontier WHERE url = ?", (url,))
+
+    # Page state
+
+    def conditional_headers(self, url: str) -> dict:
+        row = self.db.execute("SELECT etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def record(self, page: dict):
+        """
+        Compare a crawled page with its stored state and set page['id'] and page['change']:
+        'added', 'changed', 'unchanged' (304 or same hash) or None (failed). Unchanged and
+        failed pages get their stored links, so the crawl still reaches the pages below them.
+        """
+        row = self.db.execute("SELECT id, content_hash, links FROM pages WHERE url = ?", (page['url'],)).fetchone()
+        page['id'], page['change'] = (row[0] if row else None), None
+
+        if page['error'] or page['status'] == 304:
+            if row is None or page['status'] in GONE_STATUSES:
+                return  # A page that is gone stays unmarked, so removed() reports it
+            if page['status'] == 304:
+                page['change'] = 'unchanged'
+            page['links'] = json.loads(row[2])
+            self.db.execute("UPDATE pages SET crawled_run = ? WHERE id = ?", (self.run, row[0]))
+            return
+
+        digest = content_hash(page['header'], page['text'])
+        values = (page['etag'], page['last_modified'], digest, json.dumps(page['links']), self.run)
+        if row is None:
+            page['id'] = self.db.execute(
+                "INSERT INTO pages (etag, last_modified, content_hash, links, crawled_run, url) "
+                "VALUES (?, ?, ?, ?, ?, ?)", values + (page['url'],)
+            ).lastrowid
+            page['change'] = 'added'
+        else:
+            self.db.execute(
+                "UPDATE pages SET etag = ?, last_modified = ?, content_hash = ?, links = ?, crawled_run = ? "
+                "WHERE id = ?", values + (row[0],)
+            )
+            page['change'] = 'changed' if digest != row[1] else 'unchanged'
+
+    def removed(self, prefix: str):
+        """
+        Yield ({'id', 'url'}) the pages below `prefix` that this run didn't reach, forgetting
+        each one; commit() after handling each makes the removal final.
+        """
+        while True:
+            row = self.db.execute(
+                "SELECT id, url FROM pages WHERE substr(url, 1, ?) = ? AND crawled_run < ? ORDER BY id LIMIT 1",
+                (len(prefix), prefix, self.run)
+            ).fetchone()
+            if row is None:
+                return
+            self.db.execute("DELETE FROM pages WHERE id = ?", (row[0],))
+            yield {'id': row[0], 'url': row[1]}
+
+    def close(self):
+        self.db.close()
+
+
+class Crawler:
+    """
+    Breadth-first crawl below a start URL with `workers` pages in flight.
+
+    fetch(url, headers) returns a requests-style response (status_code, content, headers) and
+    raises on failure. With a CrawlState, requests are conditional, each page is compared
+    with what the last crawl saw, and the frontier and visited set live in the state file;
+    otherwise they are kept in memory. The frontier and state are only touched by the thread
+    iterating crawl(); workers just fetch and parse.
+    """
+
+    def __init__(self, fetch, workers: int = 4, rate: float = 2.0, should_skip=None, state: CrawlState = None,
+                 conditional: bool = True):
+        self.fetch = fetch
+        self.workers = max(1, workers)
+        self.limiter = HostRateLimiter(rate)
+        self.should_skip = should_skip or (lambda url: False)
+        self.state = state
+        self.conditional = conditional
+        self.frontier = state if state is not None else MemoryFrontier()
+
+    def _process(self, url: str, headers: dict) -> dict:
+        self.limiter.wait(url)
+        page = {'url': url, 'header': None, 'text': None, 'links': [], 'error': None, 'status': None,
+                'etag': None, 'last_modified': None, 'id': None, 'change': None}
+        try:
+            response = self.fetch(url, headers)
+            page['status'] = response.status_code
+            if response.status_code == 304:
+                return page
+            page['header'], page['text'], links = parse_page(response.content, url)
+        except Exception as e:
+            page['error'] = str(e)
+            page['status'] = getattr(getattr(e, 'response', None), 'status_code', None)
+            return page
+        page['links'] = sorted(link for link in links if self.follow(url, link))
+        page['etag'] = response.headers.get('ETag')
+        page['last_modified'] = response.headers.get('Last-Modified')
+        return page
+
+    def follow(self, url: str, link: str) -> bool:
+        """Links below the current page are part of the crawl"""
+        return link.startswith(url) and link != url
+
+    def crawl(self, start_url: str):
+        """
+        Yield a page dict per crawled URL, in completion order: 'url', 'header', 'text',
+        'links' (in scope), 'new_links' (queued by this page), 'error', 'status', and with
+        a state 'id' and 'change'. The visited set is shared by all crawls of this crawler
+        (and run), so overlapping sections are fetched once; a crawl whose start URL was
+        already visited only finishes the URLs it had queued, e.g. after a restart.
+        Each page is committed when the consumer asks for the next one.
+        """
+        start_url = normalize_url(start_url)
+        self.frontier.add(start_url, start_url)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawler') as pool:
+            in_flight = set()
+            while True:
+                while len(in_flight) < self.workers and (url := self.frontier.pop(start_url)) is not None:
+                    if self.should_skip(url):
+                        print(f"Skipping problematic URL: {url}")
+                        self.frontier.done(url)
+                        continue
+                    headers = self.state.conditional_headers(url) if self.state and self.conditional else {}
+                    in_flight.add(pool.submit(self._process, url, headers))
+                self.frontier.commit()
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = future.result()
+                    if self.state:
+                        self.state.record(page)
+                    page['new_links'] = [
+                        link for link in page['links']
+                        if not self.should_skip(link) and self.frontier.add(link, start_url)
+                    ]
+                    self.frontier.done(page['url'])
+                    yield page
+                    self.frontier.commit()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    pages = {}  # path prefix -> HTML bytes
+    latency = 0.0
+    requests = 0
+    bytes_sent = 0
+    tree = None  # (depth, fanout) of the generated section under TREE_PREFIX
+    _lock = threading.Lock()
+
+    def _tree_page(self, path):
+        depth, fanout = self.tree
+        parts = path[len(TREE_PREFIX):].strip('/').split('/') if path != TREE_PREFIX else []
+        if len(parts) > depth or not all(part.isdigit() and int(part) < fanout for part in parts):
+            return None
+        links = ''.join(f'<li><a href="{path}{i}/">Раздел {i}</a></li>' for i in range(fanout)) if len(parts) < depth else ''
+        return (f'<html><body><h1 class="re-container__head-title">Страница {path}</h1>'
+                f'<div class="re-container__inner-left"><p>Текст страницы {path}</p><ul>{links}</ul></div>'
+                f'</body></html>').encode('utf-8')
+
+    def do_GET(self):
+        with self._lock:
+            type(self).requests += 1
+        path = urlparse(self.path).path
+        if self.latency:
+            time.sleep(self.latency)
+        if self.tree and path.startswith(TREE_PREFIX):
+            body = self._tree_page(path)
+        else:
+            prefix = max((p for p in self.pages if path.startswith(p)), key=len, default=None)
+            body = self.pages[prefix] if prefix is not None else None
+        if body is None:
+            self.send_error(404)
+            return
+
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        not_modified = self.headers.get('If-None-Match') == etag
+        with self._lock:
+            type(self).bytes_sent += 0 if not_modified else len(body)
+        if not_modified:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fixture_server(port: int = 0, latency: float = 0.0, fixtures_dir: Path = FIXTURES_DIR, tree=None):
+    """
+    A ThreadingHTTPServer replaying fixtures_dir/debug_<name>.html as /grazhdanam/<name>/,
+    each response delayed by `latency` seconds and answered with 304 when the ETag matches.
+    tree=(depth, fanout) adds a generated section of any size under TREE_PREFIX.
+    Serve it with serve_forever() in a thread.
+    """
+    pages = {
+        f"/grazhdanam/{path.stem[len('debug_'):]}/": path.read_bytes()
+        for path in sorted(fixtures_dir.glob('debug_*.html'))
+    }
+    handler = type('Handler', (FixtureHandler,), {'pages': pages, 'latency': latency, 'requests': 0, 'bytes_sent': 0,
+                                                  'tree': tree})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def benchmark(workers: int, latency: float, rate: float):
+    """
+    Crawl the replayed site with one worker and with `workers`, then re-crawl it with a
+    CrawlState: cold, unchanged, and with one section edited. Reports pages/s and traffic.
+    """
+    import tempfile
+    import requests
+
+    server = fixture_server(latency=latency)
+    handler = server.RequestHandlerClass
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    start_urls = [f"{base}{prefix}" for prefix in handler.pages]
+    print(f"Fixture server at {base}: {len(start_urls)} sections, {latency * 1000:.0f} ms latency")
+
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 10)))
+
+    def fetch(url, headers):
+        response = session.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        return response
+
+    def run(label, crawler):
+        handler.requests = handler.bytes_sent = 0
+        if crawler.state:
+            crawler.state.begin_run()
+        pages, changes = 0, {}
+        started = time.perf_counter()
+        for url in start_urls:
+            for page in crawler.crawl(url):
+                pages += 1
+                changes[page['change']] = changes.get(page['change'], 0) + 1
+            if crawler.state:
+                for _ in crawler.state.removed(url):
+                    changes['removed'] = changes.get('removed', 0) + 1
+                crawler.state.commit()
+        if crawler.state:
+            crawler.state.finish_run()
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f"{count} {change}" for change, count in changes.items() if change and count)
+        print(f"  {label:<28} {pages} pages in {elapsed:6.2f}s ({pages / elapsed:6.1f} pages/s, "
+              f"{handler.requests / max(pages, 1):.2f} requests/page, {handler.bytes_sent / 1024:7.0f} KiB)"
+              + (f"  [{summary}]" if summary else ''))
+
+    for pool_size in sorted({1, workers}):
+        run(f"{pool_size} worker(s), no state", Crawler(fetch, workers=pool_size, rate=rate))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = CrawlState(f"{tmp}/state.sqlite3")
+        crawler = Crawler(fetch, workers=workers, rate=rate, state=state)
+        run("first crawl with state", crawler)
+        run("re-crawl, nothing changed", crawler)
+        prefix = next(iter(handler.pages))
+        handler.pages[prefix] = handler.pages[prefix].replace(
+            b'<h1 class="re-container__head-title">', b'<h1 class="re-container__head-title">(2) ', 1)
+        run("re-crawl, one section edited", crawler)
+        state.close()
+
+    server.shutdown()
+    print("✓ Crawler benchmark complete")
+
+
+def benchmark_resume(workers: int, rate: float, depth: int, fanout: int):
+    """
+    Crawl a generated site of 1 + fanout + ... + fanout**depth pages: peak Python memory with
+    the frontier and records in memory vs in a CrawlState and a file, then a run stopped
+    halfway and resumed.
+    """
+    import tempfile
+    import tracemalloc
+    import requests
+
+    server = fixture_server(tree=(depth, fanout))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start_url = f"http://127.0.0.1:{server.server_address[1]}/grazhdanam/tree/"
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 10)))
+
+    def fetch(url, headers):
+        response = session.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        return response
+
+    print(f"Generated site: depth {depth}, fanout {fanout}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Warm up imports, parser and connection pool outside the measurement
+        sum(1 for _ in Crawler(fetch, workers=workers, rate=rate).crawl(f"{start_url}0/0/"))
+        # As SFRRecursiveParser did before (records kept in a list) vs now (records appended to a file)
+        for label in ('in memory', 'CrawlState + file'):
+            state = CrawlState(f"{tmp}/memory.sqlite3") if label.startswith('CrawlState') else None
+            crawler = Crawler(fetch, workers=workers, rate=rate, state=state)
+            if state:
+                state.begin_run()
+            records = []
+            tracemalloc.start()
+            started = time.perf_counter()
+            with open(f"{tmp}/records.csv", 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                for page in crawler.crawl(start_url):
+                    record = [page['id'], page['url'], page['header'], page['text']]
+                    if state:
+                        writer.writerow(record)
+                    else:
+                        records.append(record)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            pages = len(records) or state.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            print(f"  {label:<18} {pages} pages in {elapsed:6.2f}s, peak Python memory {peak / 1024:8.0f} KiB")
+
+        # Stop halfway through as a crash would (no commit for the page in hand), then resume
+        path = f"{tmp}/resume.sqlite3"
+        server.RequestHandlerClass.requests = 0
+        state = CrawlState(path)
+        state.begin_run()
+        crawler = Crawler(fetch, workers=workers, rate=rate, state=state)
+        first = 0
+        for page in crawler.crawl(start_url):
+            first += 1
+            if first == pages // 2:
+                break
+        state.close()
+
+        state = CrawlState(path)
+        resumed = state.begin_run()
+        crawler = Crawler(fetch, workers=workers, rate=rate, state=state)
+        second = sum(1 for _ in crawler.crawl(start_url))
+        state.finish_run()
+        stored = state.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        state.close()
+        print(f"  stopped after {first} pages, resumed={resumed}: {second} more pages, {stored} pages stored, "
+              f"{server.RequestHandlerClass.requests} requests for {pages} pages")
+
+    server.shutdown()
+    print("✓ Resume benchmark complete")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawler fixture server and benchmark')
+    parser.add_argument('--serve', action='store_true', help='Replay the debug_*.html pages until interrupted')
+    parser.add_argument('--benchmark', action='store_true', help='Crawl the replayed pages and report throughput')
+    parser.add_argument('--port', type=int, default=8765, help='Port for --serve')
+    parser.add_argument('--latency', type=float, default=0.2, help='Simulated response time in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='Worker threads for --benchmark')
+    parser.add_argument('--rate', type=float, default=50.0, help='Requests per second per host for --benchmark')
+    parser.add_argument('--resume-benchmark', action='store_true',
+                        help='Memory and stop/resume check on a generated site (no latency)')
+    parser.add_argument('--tree', type=int, nargs=2, default=(3, 12), metavar=('DEPTH', 'FANOUT'),
+                        help='Size of the generated site for --resume-benchmark')
+    args = parser.parse_args()
+
+    if args.serve:
+        server = fixture_server(port=args.port, latency=args.latency)
+        print(f"✓ Replaying {len(server.RequestHandlerClass.pages)} sections at "
+              f"http://127.0.0.1:{args.port}/grazhdanam/<name>/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.benchmark:
+        benchmark(args.workers, args.latency, args.rate)
+    elif args.resume_benchmark:
+        benchmark_resume(args.workers, 1000.0, *args.tree)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
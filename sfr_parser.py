@@ -1,20 +1,38 @@
 #!/usr/bin/env python
 """
 Enhanced SFR parser for multiple base URLs with timeout protection
+
+Pages are crawled by sfr_crawler.Crawler: one request per page, several pages in flight,
+requests to sfr.gov.ru paced by a per-host rate limiter.
+
+The crawl state (sfr_crawl_state.sqlite3) makes re-crawls incremental: requests are
+conditional, and the CSV holds only pages that were added, changed or removed since the
+last crawl (`change` column), under ids that stay the same across crawls.
+
+The state file also holds the frontier and visited set, and records are appended to the CSV
+as pages complete, so memory stays flat. An interrupted crawl (Ctrl+C, crash, error) is
+resumed by running the script again: it continues the same CSV from the last saved page.
+
+    python sfr_parser.py                          # crawl sfr.gov.ru (or resume), only changes since last time
+    python sfr_parser.py --workers 8 --rate 4     # more pages in flight, faster pacing
+    python sfr_parser.py --full                   # refetch every page, still report only changes
 """
+import argparse
+import csv
+import os
 import requests
-from bs4 import BeautifulSoup
-import re
-from urllib.parse import urljoin, urlparse
+from collections import Counter
+from urllib.parse import urlparse
 import pandas as pd
-from collections import deque
 import time
-import random
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from sfr_crawler import Crawler, CrawlState
+
+COLUMNS = ['id', 'url', 'header', 'text', 'category', 'base_url', 'change']
 
 class SFRRecursiveParser:
-    def __init__(self):
+    def __init__(self, workers=4, rate=2.0, state_path="sfr_crawl_state.sqlite3", conditional=True):
         self.base_url = "https://sfr.gov.ru"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -32,20 +50,27 @@ class SFRRecursiveParser:
             backoff_factor=1
         )
         
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=max(workers, 10))
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
         
-        self.visited_urls = set()
-        self.data_records = []
-        self.current_id = 1
+        self.changes = Counter()  # added/changed/removed/unchanged pages in this session
+        self.category_counts = Counter()  # Records written per category in this session
+        self.pages_crawled = 0
         self.failed_urls = []
+        self.output = None
+        self.output_path = None
+
+        # Worker threads share the session; `rate` is requests per second to sfr.gov.ru
+        self.state = CrawlState(state_path)
+        self.crawler = Crawler(self.fetch, workers=workers, rate=rate, should_skip=self.should_skip_url,
+                               state=self.state, conditional=conditional)
 
-    def safe_request(self, url, max_retries=3, timeout=30):
+    def safe_request(self, url, max_retries=3, timeout=30, headers=None):
         """Безопасный запрос с повторными попытками и таймаутом"""
         for attempt in range(max_retries):
             try:
-                response = self.session.get(url, timeout=timeout)
+                response = self.session.get(url, headers=headers, timeout=timeout)
                 response.raise_for_status()
                 return response
                 
@@ -69,84 +94,12 @@ class SFRRecursiveParser:
                 
         return None
 
-    def extract_links_from_page(self, url):
-        """Extract all links from page that start with the given base URL but are not exactly the same"""
-        try:
-            response = self.safe_request(url)
-            if not response:
-                return set()
-                
-            soup = BeautifulSoup(response.content, 'lxml')
-            
-            all_links = soup.find_all('a', href=True)
-            filtered_links = set()
-            
-            for link in all_links:
-                href = link['href']
-                full_url = urljoin(self.base_url, href)
-                
-                # Filter: links that start with the current URL but are not exactly the same
-                if (full_url.startswith(url) and 
-                    full_url != url and 
-                    full_url not in self.visited_urls):
-                    filtered_links.add(full_url)
-            
-            return filtered_links
-            
-        except Exception as e:
-            print(f"Error extracting links from {url}: {str(e)}")
-            self.failed_urls.append({'url': url, 'error': str(e), 'type': 'link_extraction'})
-            return set()
-
-    def extract_content(self, url):
-        """Extract header and content from the page with error handling"""
-        try:
-            response = self.safe_request(url, timeout=45)
-            if not response:
-                return "Error: Request failed", ""
-                
-            soup = BeautifulSoup(response.content, 'lxml')
-            
-            # Extract header
-            header = soup.find('h1', class_='re-container__head-title')
-            header_text = header.get_text(strip=True) if header else "No header"
-            
-            # Extract content from section-content div
-            content_div = soup.find('div', class_=re.compile(r'section-content collapse show'))
-            content_text = ""
-            
-            if content_div:
-                # Extract all text content
-                paragraphs = content_div.find_all(['p', 'li', 'div'])
-                content_parts = []
-                
-                for element in paragraphs:
-                    text = element.get_text(strip=True)
-                    if text and len(text) > 5:
-                        content_parts.append(text)
-                
-                content_text = "\n".join(content_parts)
-            
-            # If no content found in section-content, try other containers
-            if not content_text:
-                content_div = soup.find('div', class_='re-container__inner-left')
-                if content_div:
-                    paragraphs = content_div.find_all(['p', 'li'])
-                    content_parts = []
-                    
-                    for element in paragraphs:
-                        text = element.get_text(strip=True)
-                        if text and len(text) > 5:
-                            content_parts.append(text)
-                    
-                    content_text = "\n".join(content_parts)
-            
-            return header_text, content_text
-            
-        except Exception as e:
-            print(f"Error extracting content from {url}: {str(e)}")
-            self.failed_urls.append({'url': url, 'error': str(e), 'type': 'content_extraction'})
-            return f"Error: {str(e)}", ""
+    def fetch(self, url, headers=None):
+        """Response for the crawler (304 if unchanged); raises if the request fails"""
+        response = self.safe_request(url, timeout=45, headers=headers)
+        if not response:
+            raise requests.exceptions.RequestException("Request failed")
+        return response
 
     def should_skip_url(self, url):
         """Проверяем, нужно ли пропустить URL (внешние ссылки и проблемные домены)"""
@@ -167,61 +120,80 @@ class SFRRecursiveParser:
         return False
 
     def parse_single_category(self, start_url, category_name=""):
-        """Parse a single category recursively"""
+        """Parse a single category recursively, recording pages added, changed or removed since the last crawl"""
         print(f"\n{'='*80}")
         print(f"PARSING CATEGORY: {category_name}")
         print(f"Starting URL: {start_url}")
         print(f"{'='*80}")
         
-        initial_visited_count = len(self.visited_urls)
-        initial_data_count = len(self.data_records)
-        
-        queue = deque([start_url])
-        self.visited_urls.add(start_url)
-        
-        while queue:
-            current_url = queue.popleft()
-            
-            # Пропускаем проблемные URL
-            if self.should_skip_url(current_url):
-                print(f"Skipping problematic URL: {current_url}")
-                continue
-                
-            print(f"Processing: {current_url}")
-            
-            # Extract content from current page
-            header, content = self.extract_content(current_url)
-            
-            # Add to data records
-            self.data_records.append({
-                'id': self.current_id,
-                'url': current_url,
-                'header': header,
-                'text': content,
-                'category': category_name,
-                'base_url': start_url
-            })
-            self.current_id += 1
-            
-            # Extract links from current page
-            new_links = self.extract_links_from_page(current_url)
-            
-            # Add new links to queue
-            for link in new_links:
-                if link not in self.visited_urls and not self.should_skip_url(link):
-                    self.visited_urls.add(link)
-                    queue.append(link)
-            
-            print(f"  Found {len(new_links)} new links, Queue size: {len(queue)}")
-            
-            # Случайная задержка от 1 до 3 секунд
-            time.sleep(random.uniform(1, 3))
-        
-        pages_processed = len(self.data_records) - initial_data_count
-        print(f"✓ Category '{category_name}' completed: {pages_processed} pages processed")
+        initial_records = self.category_counts[category_name]
+        initial_unchanged = self.changes['unchanged']
+
+        for page in self.crawler.crawl(start_url):
+            print(f"Processing: {page['url']} ({page['change'] or 'failed'})")
+            self.pages_crawled += 1
+
+            if page['error']:
+                print(f"Error processing {page['url']}: {page['error']}")
+                self.failed_urls.append({'url': page['url'], 'error': page['error'], 'type': 'fetch'})
+            elif page['change'] == 'unchanged':
+                self.changes['unchanged'] += 1
+            else:
+                self.add_record(page['id'], page['url'], page['header'], page['text'], category_name, start_url,
+                                page['change'])
+
+            print(f"  Found {len(page['new_links'])} new links")
+
+        # Pages below the start URL that weren't reached this time (or are 404/410 now)
+        for page in self.state.removed(start_url):
+            print(f"Removed: {page['url']}")
+            self.add_record(page['id'], page['url'], "", "", category_name, start_url, 'removed')
+            self.state.commit()
+
+        pages_processed = self.category_counts[category_name] - initial_records
+        print(f"✓ Category '{category_name}' completed: {pages_processed} pages added/changed/removed, "
+              f"{self.changes['unchanged'] - initial_unchanged} unchanged")
+
+    def open_output(self, filename):
+        """
+        Open the run's CSV for appending. A resumed run continues its own file, cut back to
+        the last committed page, so no record is lost or written twice.
+        """
+        path, offset = self.state.output()
+        if path is None:
+            path, offset = filename, 0
+            self.state.set_output(path, offset)
+            self.state.commit()
+        else:
+            print(f"Resuming interrupted crawl into {path}")
+        if os.path.exists(path):
+            os.truncate(path, min(offset, os.path.getsize(path)))
 
-    def parse_multiple_categories(self, url_list):
-        """Parse multiple categories from a list of URLs"""
+        self.output_path = path
+        self.output = open(path, 'a', encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.output, fieldnames=COLUMNS)
+        if self.output.tell() == 0:
+            self.writer.writeheader()
+
+    def add_record(self, record_id, url, header, text, category_name, base_url, change):
+        """Append a record; its offset is committed together with the page by the crawler"""
+        self.writer.writerow({
+            'id': record_id,
+            'url': url,
+            'header': header,
+            'text': text,
+            'category': category_name,
+            'base_url': base_url,
+            'change': change,
+        })
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.state.set_output(self.output_path, os.fstat(self.output.fileno()).st_size)
+        self.changes[change] += 1
+        self.category_counts[category_name] += 1
+
+    def parse_multiple_categories(self, url_list, filename="sfr_data.csv"):
+        """Parse multiple categories from a list of URLs into `filename` (or the interrupted run's file)"""
         categories = [
             "https://sfr.gov.ru/grazhdanam/pensionres/",
             "https://sfr.gov.ru/grazhdanam/semyam_s_detmi/",
@@ -242,6 +214,9 @@ class SFRRecursiveParser:
             categories = url_list
         
         total_categories = len(categories)
+        self.state.begin_run()
+        self.open_output(filename)
+        completed = True
         
         for i, category_url in enumerate(categories, 1):
             # Извлекаем название категории из URL
@@ -254,52 +229,44 @@ class SFRRecursiveParser:
             except Exception as e:
                 print(f"❌ Error processing category {category_name}: {e}")
                 self.failed_urls.append({'url': category_url, 'error': str(e), 'type': 'category_processing'})
-            
-            # Задержка между категориями
-            if i < total_categories:
-                delay = random.uniform(2, 5)
-                print(f"Waiting {delay:.1f} seconds before next category...")
-                time.sleep(delay)
+                completed = False
         
+        self.output.close()
+        if not completed:
+            print(f"\n⚠️ Some categories failed; run again to resume this crawl into {self.output_path}")
+            return
+        self.state.finish_run()
+
         print(f"\n{'='*80}")
         print("ALL CATEGORIES COMPLETED")
         print(f"{'='*80}")
 
-    def save_to_dataframe(self):
-        """Convert collected data to pandas DataFrame"""
-        df = pd.DataFrame(self.data_records)
-        return df
+    def save_to_dataframe(self, nrows=None):
+        """Read the records written so far into a pandas DataFrame"""
+        return pd.read_csv(self.output_path, nrows=nrows)
 
-    def save_to_csv(self, filename="sfr_data.csv"):
-        """Save data to CSV file"""
-        df = self.save_to_dataframe()
-        df.to_csv(filename, index=False, encoding='utf-8')
-        print(f"✓ Data saved to {filename}")
-        
-        # Сохраняем список неудачных URL
-        if self.failed_urls:
+    def save_failed(self):
+        """Save the failed URLs of this session next to the records CSV"""
+        if self.failed_urls and self.output_path:
             failed_df = pd.DataFrame(self.failed_urls)
-            failed_filename = filename.replace('.csv', '_failed.csv')
+            failed_filename = self.output_path.replace('.csv', '_failed.csv')
             failed_df.to_csv(failed_filename, index=False, encoding='utf-8')
             print(f"✓ Failed URLs saved to {failed_filename}")
-            
-        return df
 
     def print_statistics(self):
         """Print parsing statistics"""
         print(f"\n{'='*80}")
         print("PARSING STATISTICS")
         print(f"{'='*80}")
-        print(f"Successfully processed: {len(self.data_records)} pages")
+        print(f"Pages crawled in this session: {self.pages_crawled}")
+        for change in ('added', 'changed', 'removed', 'unchanged'):
+            print(f"  - {change}: {self.changes[change]}")
         print(f"Failed URLs: {len(self.failed_urls)}")
-        print(f"Total unique URLs visited: {len(self.visited_urls)}")
         
         # Статистика по категориям
-        if self.data_records:
-            df = pd.DataFrame(self.data_records)
-            category_stats = df['category'].value_counts()
-            print(f"\nPages per category:")
-            for category, count in category_stats.items():
+        if self.category_counts:
+            print(f"\nAdded/changed/removed pages per category:")
+            for category, count in self.category_counts.most_common():
                 print(f"  - {category}: {count} pages")
         
         if self.failed_urls:
@@ -308,7 +275,15 @@ class SFRRecursiveParser:
                 print(f"  - {failed['url']}: {failed['error']}")
 
 def main():
-    parser = SFRRecursiveParser()
+    arg_parser = argparse.ArgumentParser(description='Crawl sfr.gov.ru categories into a CSV')
+    arg_parser.add_argument('--workers', type=int, default=4, help='Pages fetched at once')
+    arg_parser.add_argument('--rate', type=float, default=2.0, help='Requests per second to sfr.gov.ru')
+    arg_parser.add_argument('--state', default='sfr_crawl_state.sqlite3', help='Crawl state file')
+    arg_parser.add_argument('--full', action='store_true', help='Refetch every page instead of conditional requests')
+    args = arg_parser.parse_args()
+
+    parser = SFRRecursiveParser(workers=args.workers, rate=args.rate, state_path=args.state,
+                                conditional=not args.full)
     
     # Список URL для парсинга
     target_urls = [
@@ -332,33 +307,31 @@ def main():
     print("="*80)
     
     try:
-        # Start parsing all categories
-        parser.parse_multiple_categories(target_urls)
-        
-        # Save results
+        # Start parsing all categories; records are appended to the CSV as pages complete
         timestamp = time.strftime("%Y%m%d_%H%M%S")
-        filename = f"sfr_all_categories_{timestamp}.csv"
-        df = parser.save_to_csv(filename)
+        parser.parse_multiple_categories(target_urls, f"sfr_all_categories_{timestamp}.csv")
+        print(f"✓ Data saved to {parser.output_path}")
         
         # Print statistics
         parser.print_statistics()
         
         # Display summary
+        df = parser.save_to_dataframe(nrows=5)
         print(f"\nFirst 5 records:")
-        print(df[['id', 'category', 'url', 'header']].head().to_string(index=False))
+        print(df[['id', 'category', 'url', 'header']].to_string(index=False))
         
     except KeyboardInterrupt:
-        print("\n\nParsing interrupted by user. Saving current progress...")
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        df = parser.save_to_csv(f"sfr_partial_{timestamp}.csv")
+        print("\n\nParsing interrupted by user. Progress is saved; run again to resume.")
         parser.print_statistics()
         
     except Exception as e:
         print(f"\n\nCritical error: {e}")
-        print("Saving current progress...")
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        df = parser.save_to_csv(f"sfr_error_{timestamp}.csv")
+        print("Progress is saved; run again to resume.")
         parser.print_statistics()
 
+    finally:
+        parser.save_failed()
+        parser.state.close()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""
+Tests for category_classifier.py and how preprocess_categories.py routes documents through it
+
+    python -m unittest test_category_classifier
+"""
+import asyncio
+import contextlib
+import csv
+import io
+import os
+import re
+import tempfile
+import unittest
+
+from category_classifier import CategoryClassifier
+from preprocess_categories import FIELDNAMES, CategorizationPipeline, TokenBucket
+from test_preprocess_categories import FakeChatClient, write_csv
+
+TSR = "Технические средства реабилитации"
+
+
+class CategoryClassifierTests(unittest.TestCase):
+    def setUp(self):
+        self.classifier = CategoryClassifier()
+
+    def test_obvious_document_is_classified_confidently(self):
+        category, confidence = self.classifier.classify(
+            'Обеспечение протезами и креслами-колясками',
+            'Технические средства реабилитации выдаются по индивидуальной программе реабилитации.',
+        )
+
+        self.assertEqual(category, TSR)
+        self.assertGreaterEqual(confidence, 0.7)
+
+    def test_no_known_words_gives_the_fallback(self):
+        self.assertEqual(self.classifier.classify('Контакты', 'Телефон горячей линии'), ("Другое", 0.0))
+
+    def test_header_words_outweigh_text_words(self):
+        category, _ = self.classifier.classify('Налоговый вычет', 'Пенсионерам и работающим гражданам')
+
+        self.assertEqual(category, "Налоговые льготы")
+
+    def test_mixed_document_is_less_confident(self):
+        _, clear = self.classifier.classify('Пенсия по старости', 'Страховая пенсия и стаж')
+        _, mixed = self.classifier.classify('Пенсия и проезд', 'Бесплатный проезд для пенсионеров')
+
+        self.assertLess(mixed, clear)
+        self.assertLess(mixed, 0.7)
+
+    def test_training_learns_words_that_point_to_one_category(self):
+        rows = [{'header': f'Слабовидящим гражданам {number}', 'text': '', 'category': TSR} for number in range(3)]
+        rows.append({'header': 'Гражданам', 'text': '', 'category': "Образование"})
+
+        self.assertEqual(self.classifier.classify('Слабовидящим', '')[0], "Другое")
+        learned = self.classifier.train(rows)
+
+        self.assertEqual(self.classifier.classify('Слабовидящим', '')[0], TSR)
+        self.assertIn('слабовидящим', self.classifier.lexicon[TSR])
+        # 'гражданам' is in 4 documents but only 3/4 of them share a category
+        self.assertNotIn('гражданам', self.classifier.lexicon[TSR])
+        self.assertEqual(learned, 1)
+
+    def test_training_from_csv_skips_the_classifiers_own_guesses(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'categorized.csv')
+            write_csv(path, [
+                {'id': str(number), 'header': f'Слабовидящим {number}', 'category': TSR, 'category_source': source}
+                for number, source in enumerate(['local'] * 3 + ['llm'] * 2)
+            ])
+
+            self.assertEqual(self.classifier.train_from_csv(path), 0)  # 2 LLM rows are too few
+
+
+class ClassifierRoutingTests(unittest.TestCase):
+    """Only documents the classifier is unsure about (plus the audit sample) reach the LLM"""
+
+    ROWS = [
+        {'id': '1', 'header': 'Пенсия по старости', 'text': 'Страховая пенсия и стаж'},
+        {'id': '2', 'header': 'Налоговый вычет', 'text': 'Вычет по НДФЛ'},
+        {'id': '3', 'header': 'Контакты', 'text': 'Телефон горячей линии'},
+    ]
+
+    def run_pipeline(self, client, audit_rate):
+        pipeline = CategorizationPipeline(client, TokenBucket(rate=1000.0, capacity=10), concurrency=1, batch_size=5,
+                                          classifier=CategoryClassifier(), audit_rate=audit_rate)
+        rows = [dict(row) for row in self.ROWS]
+        with tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as output:
+            writer = csv.DictWriter(output, fieldnames=FIELDNAMES)
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(pipeline.run(iter(rows), writer, output))
+            output.seek(0)
+            written = {row['id']: row for row in csv.DictReader(output, fieldnames=FIELDNAMES)}
+        return pipeline, written
+
+    @staticmethod
+    def prompted_ids(client):
+        headers = re.findall(r'Заголовок: (.+)', ''.join(client.prompts))
+        return [row['id'] for row in ClassifierRoutingTests.ROWS if row['header'] in headers]
+
+    def test_confident_documents_skip_the_llm(self):
+        client = FakeChatClient(category="Другое")
+
+        pipeline, written = self.run_pipeline(client, audit_rate=0.0)
+
+        self.assertEqual(self.prompted_ids(client), ['3'])
+        self.assertEqual(written['1']['category'], "Пенсионное обеспечение")
+        self.assertEqual(written['1']['category_source'], 'local')
+        self.assertGreaterEqual(float(written['1']['confidence']), 0.7)
+        self.assertEqual((written['3']['category'], written['3']['category_source']), ("Другое", 'llm'))
+        self.assertEqual((pipeline.local, pipeline.sent_to_llm), (2, 1))
+        self.assertEqual(pipeline.uncertain, [1, 1])  # The classifier's fallback agreed with the LLM
+
+    def test_audited_documents_measure_agreement(self):
+        client = FakeChatClient(category="Пенсионное обеспечение")
+
+        pipeline, written = self.run_pipeline(client, audit_rate=1.0)
+
+        self.assertEqual(self.prompted_ids(client), ['1', '2', '3'])
+        self.assertTrue(all(row['category_source'] == 'llm' for row in written.values()))
+        self.assertEqual(pipeline.audited, [1, 2])
+        self.assertIn("Classifier/LLM agreement (confident, audited): 1/2 = 50%", pipeline.report(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
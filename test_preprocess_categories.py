@@ -0,0 +1,179 @@
+"""
+Tests for preprocess_categories.py
+
+    python -m unittest test_preprocess_categories
+"""
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import unittest
+
+from preprocess_categories import (
+    FIELDNAMES, CategorizationPipeline, RateLimited, TokenBucket, load_checkpoint, parse_answer, preprocess_csv,
+)
+
+
+class FakeChatClient:
+    """Answers every document with `category`; the first `rate_limited` requests get a 429"""
+
+    def __init__(self, category="Социальные выплаты", rate_limited=0):
+        self.category = category
+        self.rate_limited = rate_limited
+        self.prompts = []
+        self.chat = self
+
+    async def complete_async(self, model, messages, **kwargs):
+        prompt = messages[0]['content']
+        self.prompts.append(prompt)
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise RateLimited(retry_after=0)
+        count = len(re.findall(r'^Документ \d+$', prompt, re.MULTILINE))
+        answer = json.dumps({str(number): self.category for number in range(1, count + 1)}, ensure_ascii=False)
+        message = type('Message', (), {'content': answer})
+        return type('Response', (), {'choices': [type('Choice', (), {'message': message})]})
+
+
+def document(number, change=''):
+    return {'id': str(number), 'url': f'https://sfr.gov.ru/{number}/', 'header': f'Документ {number}',
+            'text': 'Текст', 'change': change}
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({field: row.get(field, '') for field in FIELDNAMES})
+
+
+def read_csv(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+class ParseAnswerTests(unittest.TestCase):
+    def test_reads_json_around_extra_text(self):
+        content = 'Вот ответ: {"1": "Образование", "2": "Налоговые льготы."}'
+        self.assertEqual(parse_answer(content, 2), ["Образование", "Налоговые льготы"])
+
+    def test_close_answers_are_matched_to_a_category(self):
+        self.assertEqual(parse_answer('{"1": "медицинская помощь"}', 1), ["Медицинская помощь"])
+
+    def test_missing_and_unreadable_answers_become_other(self):
+        self.assertEqual(parse_answer('{"1": "Образование"}', 2), ["Образование", "Другое"])
+        self.assertEqual(parse_answer('не JSON', 1), ["Другое"])
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_rate_halves_on_429_and_recovers_additively(self):
+        bucket = TokenBucket(rate=4.0, min_rate=1.5)
+
+        bucket.on_rate_limited()
+        self.assertEqual(bucket.rate, 2.0)
+        bucket.on_rate_limited()
+        self.assertEqual(bucket.rate, 1.5)  # Never below min_rate
+
+        bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 1.7)  # 5% of the starting rate per success
+        for _ in range(100):
+            bucket.on_success()
+        self.assertEqual(bucket.rate, 4.0)  # Never above the starting rate
+
+    def test_retry_after_pauses_requests(self):
+        bucket = TokenBucket(rate=100.0)
+        bucket.on_rate_limited(retry_after=0.2)
+
+        async def acquire():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await bucket.acquire()
+            return loop.time() - started
+
+        self.assertGreaterEqual(asyncio.run(acquire()), 0.15)
+
+
+class CategorizationPipelineTests(unittest.TestCase):
+    def run_pipeline(self, client, rows, **kwargs):
+        pipeline = CategorizationPipeline(client, TokenBucket(rate=1000.0, capacity=10), concurrency=2,
+                                          batch_size=3, **kwargs)
+        with tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as output:
+            writer = csv.DictWriter(output, fieldnames=FIELDNAMES)
+            with contextlib.redirect_stdout(io.StringIO()):
+                done, _ = asyncio.run(pipeline.run(iter(rows), writer, output))
+            output.seek(0)
+            return pipeline, done, list(csv.DictReader(output, fieldnames=FIELDNAMES))
+
+    def test_documents_are_batched_and_429s_retried(self):
+        client = FakeChatClient(rate_limited=1)
+
+        pipeline, done, written = self.run_pipeline(client, [document(number) for number in range(7)])
+
+        self.assertEqual(done, 7)
+        self.assertEqual(sorted(row['id'] for row in written), [str(number) for number in range(7)])
+        self.assertTrue(all(row['category'] == "Социальные выплаты" for row in written))
+        self.assertTrue(all(row['category_source'] == 'llm' for row in written))
+        self.assertEqual(len(client.prompts), 4)  # 3 batches, one of them sent twice
+        self.assertEqual((pipeline.requests, pipeline.rate_limited, pipeline.failed), (4, 1, 0))
+
+    def test_removed_documents_are_passed_on_without_a_request(self):
+        client = FakeChatClient()
+
+        _, done, written = self.run_pipeline(client, [document(1, change='removed'), document(2)])
+
+        self.assertEqual(done, 2)
+        self.assertEqual({row['id']: row['category'] for row in written}, {'1': '', '2': "Социальные выплаты"})
+        self.assertEqual(re.findall(r'Заголовок: Документ (\d+)', ''.join(client.prompts)), ['2'])
+
+
+class ResumeTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input = os.path.join(directory.name, 'input.csv')
+        self.output = os.path.join(directory.name, 'output.csv')
+        write_csv(self.input, [document(number) for number in range(5)])
+
+    def preprocess(self, client):
+        with contextlib.redirect_stdout(io.StringIO()):
+            preprocess_csv(self.input, self.output, client, concurrency=2, batch_size=2, rate=1000.0)
+
+    def test_checkpoint_drops_a_row_cut_off_by_a_crash(self):
+        write_csv(self.output, [dict(document(0), category="Образование", category_source='llm')])
+        with open(self.output, 'a', encoding='utf-8', newline='') as f:
+            f.write('1,https://sfr.gov.ru/1/,Документ 1,Тек')
+
+        self.assertEqual(load_checkpoint(self.output), {'0'})
+        self.assertEqual([row['id'] for row in read_csv(self.output)], ['0'])
+
+    def test_rerun_categorizes_only_missing_documents(self):
+        write_csv(self.output, [dict(document(number), category="Образование", category_source='llm')
+                                for number in (0, 3)])
+        client = FakeChatClient()
+
+        self.preprocess(client)
+
+        rows = read_csv(self.output)
+        self.assertEqual(sorted(row['id'] for row in rows), ['0', '1', '2', '3', '4'])
+        self.assertEqual({row['id']: row['category'] for row in rows if row['id'] in ('0', '3')},
+                         {'0': "Образование", '3': "Образование"})
+        prompted = re.findall(r'Заголовок: Документ (\d+)', ''.join(client.prompts))
+        self.assertEqual(sorted(prompted), ['1', '2', '4'])
+
+    def test_finished_output_sends_nothing(self):
+        self.preprocess(FakeChatClient())
+        client = FakeChatClient()
+
+        self.preprocess(client)
+
+        self.assertEqual(client.prompts, [])
+        self.assertEqual(len(read_csv(self.output)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+"""
+Tests for sfr_crawler.py, against an in-memory site
+
+    python -m unittest test_sfr_crawler
+"""
+import contextlib
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from sfr_crawler import Crawler, CrawlState, HostRateLimiter, parse_page
+from sfr_parser import SFRRecursiveParser
+
+BASE = 'https://sfr.gov.ru/grazhdanam/'
+
+
+def html(header, text='', links=()):
+    anchors = ''.join(f'<li><a href="{link}">{link}</a></li>' for link in links)
+    return (f'<html><body><h1 class="re-container__head-title">{header}</h1>'
+            f'<div class="re-container__inner-left"><p>{text}</p></div><ul>{anchors}</ul></body></html>')
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'{status_code} Error')
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class FakeSite:
+    """
+    fetch() for a dict of path -> HTML, with every request recorded and an optional delay.
+    Pages carry an ETag and are answered with 304 when If-None-Match matches it.
+    """
+
+    def __init__(self, pages, latency=0.0):
+        self.pages = dict(pages)
+        self.latency = latency
+        self.requests = []
+        self.conditional = []  # URLs requested with If-None-Match
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, url, headers):
+        with self._lock:
+            self.requests.append(url)
+            if 'If-None-Match' in headers:
+                self.conditional.append(url)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            body = self.pages.get(url[len(BASE):])
+            if body is None:
+                raise HTTPError(404)
+            etag = f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+            if headers.get('If-None-Match') == etag:
+                return SimpleNamespace(status_code=304, content=b'', headers={'ETag': etag})
+            return SimpleNamespace(status_code=200, content=body.encode('utf-8'), headers={'ETag': etag})
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+SITE = {
+    'invalidam/': html('Инвалидам', 'Раздел для людей с инвалидностью', [
+        'tsr/', 'tsr/#top', '/grazhdanam/invalidam/pensii/', 'https://gosuslugi.ru/', '/grazhdanam/workers/',
+    ]),
+    'invalidam/tsr/': html('Технические средства реабилитации', 'Протезы и кресла-коляски',
+                           ['/grazhdanam/invalidam/pensii/', 'kompensaciya/']),
+    'invalidam/tsr/kompensaciya/': html('Компенсация за самостоятельно купленные ТСР', 'Порядок выплаты'),
+    'invalidam/pensii/': html('Пенсии по инвалидности', 'Социальная и страховая пенсия'),
+    'workers/': html('Работающим гражданам', 'Вне раздела'),
+}
+
+
+class ParsePageTests(unittest.TestCase):
+    def test_header_text_and_absolute_links_from_one_parse(self):
+        header, text, links = parse_page(SITE['invalidam/'], f'{BASE}invalidam/')
+
+        self.assertEqual(header, 'Инвалидам')
+        self.assertEqual(text, 'Раздел для людей с инвалидностью')
+        self.assertIn(f'{BASE}invalidam/tsr/', links)
+        self.assertNotIn(f'{BASE}invalidam/tsr/#top', links)  # Fragments name a place on the same page
+        self.assertIn('https://gosuslugi.ru/', links)
+
+
+class CrawlerTests(unittest.TestCase):
+    def crawl(self, site, **kwargs):
+        crawler = Crawler(site.fetch, rate=1000.0, **kwargs)
+        return {page['url']: page for page in crawler.crawl(f'{BASE}invalidam/')}
+
+    def test_every_page_below_the_start_url_is_fetched_once(self):
+        site = FakeSite(SITE)
+
+        pages = self.crawl(site)
+
+        expected = [f'{BASE}invalidam/{path}' for path in ('', 'pensii/', 'tsr/', 'tsr/kompensaciya/')]
+        self.assertEqual(sorted(pages), expected)
+        self.assertEqual(sorted(site.requests), expected)
+        self.assertEqual(pages[f'{BASE}invalidam/tsr/']['header'], 'Технические средства реабилитации')
+        self.assertEqual(pages[f'{BASE}invalidam/']['links'],
+                         [f'{BASE}invalidam/pensii/', f'{BASE}invalidam/tsr/'])
+        # Linked from two pages, queued by whichever was crawled first
+        queued_by = [url for url, page in pages.items() if f'{BASE}invalidam/pensii/' in page['new_links']]
+        self.assertEqual(queued_by, [f'{BASE}invalidam/'])
+
+    def test_pages_are_fetched_concurrently(self):
+        site = FakeSite({
+            'invalidam/': html('Инвалидам', links=[f'{number}/' for number in range(8)]),
+            **{f'invalidam/{number}/': html(f'Страница {number}') for number in range(8)},
+        }, latency=0.05)
+
+        started = time.perf_counter()
+        pages = self.crawl(site, workers=4)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(pages), 9)
+        self.assertEqual(site.max_in_flight, 4)
+        self.assertLess(elapsed, 9 * site.latency)
+
+    def test_failed_and_skipped_pages(self):
+        site = FakeSite({path: body for path, body in SITE.items() if path != 'invalidam/pensii/'})
+
+        pages = self.crawl(site, should_skip=lambda url: 'kompensaciya' in url)
+
+        self.assertEqual(pages[f'{BASE}invalidam/pensii/']['status'], 404)
+        self.assertIsNotNone(pages[f'{BASE}invalidam/pensii/']['error'])
+        self.assertNotIn(f'{BASE}invalidam/tsr/kompensaciya/', site.requests)
+
+
+class CrawlStateTests(unittest.TestCase):
+    """Re-crawls with a CrawlState send conditional requests and report what changed"""
+
+    START = f'{BASE}invalidam/'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state = CrawlState(os.path.join(directory.name, 'state.sqlite3'))
+        self.addCleanup(self.state.close)
+        self.site = FakeSite(SITE)
+
+    def crawl(self, conditional=True):
+        """{url: (change, id)} of one run, removed pages included"""
+        self.site.requests.clear()
+        self.site.conditional.clear()
+        self.state.begin_run()
+        crawler = Crawler(self.site.fetch, rate=1000.0, state=self.state, conditional=conditional)
+        changes = {page['url']: (page['change'], page['id']) for page in crawler.crawl(self.START)}
+        for page in self.state.removed(self.START):
+            changes[page['url']] = ('removed', page['id'])
+        self.state.commit()
+        self.state.finish_run()
+        return changes
+
+    def test_first_crawl_adds_every_page(self):
+        changes = self.crawl()
+
+        self.assertEqual({change for change, _ in changes.values()}, {'added'})
+        self.assertEqual(len({page_id for _, page_id in changes.values()}), 4)
+        self.assertEqual(self.site.conditional, [])
+
+    def test_unchanged_site_is_answered_with_304s(self):
+        first = self.crawl()
+
+        changes = self.crawl()
+
+        self.assertEqual(changes, {url: ('unchanged', page_id) for url, (_, page_id) in first.items()})
+        self.assertEqual(sorted(self.site.conditional), sorted(first))
+        # The pages below a 304 are still reached, from the links stored for it
+        self.assertIn(f'{BASE}invalidam/tsr/kompensaciya/', self.site.requests)
+
+    def test_edited_page_is_changed_and_keeps_its_id(self):
+        first = self.crawl()
+        url = f'{BASE}invalidam/pensii/'
+        self.site.pages['invalidam/pensii/'] = html('Пенсии по инвалидности', 'Новые размеры пенсии')
+
+        changes = self.crawl()
+
+        self.assertEqual(changes[url], ('changed', first[url][1]))
+        self.assertEqual(sum(change == 'unchanged' for change, _ in changes.values()), 3)
+
+    def test_markup_only_change_is_unchanged(self):
+        self.crawl()
+        self.site.pages['invalidam/pensii/'] = self.site.pages['invalidam/pensii/'].replace('<p>', '<p>\n  ')
+
+        changes = self.crawl()
+
+        self.assertEqual(changes[f'{BASE}invalidam/pensii/'][0], 'unchanged')
+        self.assertIn(f'{BASE}invalidam/pensii/', self.site.requests)
+
+    def test_gone_and_unlinked_pages_are_removed(self):
+        first = self.crawl()
+        del self.site.pages['invalidam/pensii/']
+        self.site.pages['invalidam/tsr/'] = html('Технические средства реабилитации', 'Протезы и кресла-коляски',
+                                                 ['/grazhdanam/invalidam/pensii/'])
+
+        changes = self.crawl()
+
+        removed = f'{BASE}invalidam/tsr/kompensaciya/', f'{BASE}invalidam/pensii/'
+        self.assertEqual({url: changes[url] for url in removed}, {url: ('removed', first[url][1]) for url in removed})
+        self.assertEqual(self.crawl()[f'{BASE}invalidam/pensii/'][0], None)  # Still failing, not reported again
+
+    def test_full_crawl_refetches_without_conditional_headers(self):
+        self.crawl()
+
+        changes = self.crawl(conditional=False)
+
+        self.assertEqual(self.site.conditional, [])
+        self.assertEqual({change for change, _ in changes.values()}, {'unchanged'})
+
+
+class ResumeTests(unittest.TestCase):
+    """An interrupted run continues from the frontier and output offset kept in the state file"""
+
+    START = f'{BASE}invalidam/'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_path = os.path.join(directory.name, 'state.sqlite3')
+        self.output_path = os.path.join(directory.name, 'sfr_data.csv')
+        self.site = FakeSite(SITE)
+
+    def test_crawl_resumes_with_the_page_that_was_not_committed(self):
+        state = CrawlState(self.state_path)
+        self.assertFalse(state.begin_run())
+        crawled = []
+        for page in Crawler(self.site.fetch, workers=1, rate=1000.0, state=state).crawl(self.START):
+            crawled.append(page['url'])
+            if len(crawled) == 2:
+                break  # As a crash would: the page in hand is not committed
+        state.close()
+
+        state = CrawlState(self.state_path)
+        self.addCleanup(state.close)
+        self.assertTrue(state.begin_run())
+        crawler = Crawler(self.site.fetch, workers=1, rate=1000.0, state=state)
+        resumed = [page['url'] for page in crawler.crawl(self.START)]
+        state.finish_run()
+
+        self.assertEqual(resumed[0], crawled[1])
+        self.assertEqual(sorted(crawled[:1] + resumed), sorted(f'{BASE}invalidam/{path}' for path in
+                                                            ('', 'pensii/', 'tsr/', 'tsr/kompensaciya/')))
+        self.assertEqual(len(self.site.requests), 5)  # Only the uncommitted page twice
+        self.assertFalse(state.begin_run())  # A finished run isn't resumed
+        self.assertEqual(state.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0], 0)
+
+    def parser(self):
+        parser = SFRRecursiveParser(workers=1, rate=1000.0, state_path=self.state_path)
+        parser.crawler.fetch = self.site.fetch
+        return parser
+
+    def test_parser_output_is_cut_back_to_the_last_committed_page(self):
+        parser = self.parser()
+        add_record = parser.add_record
+
+        def crash_on_third_record(*args):
+            add_record(*args)  # Written to the file, but its offset is never committed
+            if parser.category_counts['invalidam'] == 3:
+                raise KeyboardInterrupt
+
+        with mock.patch.object(parser, 'add_record', crash_on_third_record), \
+                contextlib.redirect_stdout(io.StringIO()), self.assertRaises(KeyboardInterrupt):
+            parser.parse_multiple_categories([self.START], filename=self.output_path)
+        parser.state.close()
+
+        parser = self.parser()
+        self.addCleanup(parser.state.close)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            parser.parse_multiple_categories([self.START], filename='ignored.csv')
+
+        self.assertIn(f'Resuming interrupted crawl into {self.output_path}', output.getvalue())
+        with open(self.output_path, encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(sorted(row['url'] for row in rows), sorted(f'{BASE}invalidam/{path}' for path in
+                                                                    ('', 'pensii/', 'tsr/', 'tsr/kompensaciya/')))
+        self.assertEqual({row['change'] for row in rows}, {'added'})
+        self.assertEqual(len({row['id'] for row in rows}), 4)
+
+
+class HostRateLimiterTests(unittest.TestCase):
+    def test_requests_to_one_host_are_spaced_out(self):
+        limiter = HostRateLimiter(rate=20.0)
+
+        started = time.perf_counter()
+        for _ in range(3):
+            limiter.wait('https://sfr.gov.ru/a/')
+        elapsed = time.perf_counter() - started
+
+        self.assertGreaterEqual(elapsed, 0.09)  # Slots at 0, 50 and 100 ms
+
+    def test_other_hosts_are_not_held_up(self):
+        limiter = HostRateLimiter(rate=1.0)
+        limiter.wait('https://sfr.gov.ru/a/')
+
+        started = time.perf_counter()
+        limiter.wait('https://gosuslugi.ru/')
+
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()